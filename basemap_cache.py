@@ -0,0 +1,253 @@
+import hashlib
+import http.client
+import math
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from qgis.core import QgsDataSourceUri, QgsRasterLayer
+from .transforms import transform_bounds
+from .tile_renderer import page_size_pixels, visible_layers
+from .virtual_grid import regular_grid
+
+# Web Mercator tile pyramid
+ORIGIN_SHIFT = 20037508.342789244
+TILE_SIZE = 256
+ZOOM0_RESOLUTION = 2 * ORIGIN_SHIFT / TILE_SIZE
+
+BASEMAP_POOL_SIZE = 8
+BASEMAP_PREFETCH_LIMIT = 200000
+USER_AGENT = "RockyCrop GIS Auto Exporter"
+
+
+def xyz_layers(layers):
+    # (layer, uri) for every XYZ layer, the only kind whose tiles can be computed up front
+    found = []
+    for layer in layers:
+        if not isinstance(layer, QgsRasterLayer) or layer.providerType() != "wms":
+            continue
+        uri = QgsDataSourceUri()
+        uri.setEncodedUri(layer.source())
+        if uri.param("type") == "xyz" and uri.param("url"):
+            found.append((layer, uri))
+    return found
+
+
+def zoom_for_resolution(resolution, zmin=0, zmax=19):
+    # Nearest pyramid level to the render resolution (metres per pixel in EPSG:3857)
+    zoom = int(round(math.log2(ZOOM0_RESOLUTION / resolution)))
+    return max(zmin, min(zmax, zoom))
+
+
+def tile_range(bounds, zoom):
+    # Inclusive x/y tile span covering an EPSG:3857 bounding box
+    size = 2 * ORIGIN_SHIFT / (2 ** zoom)
+    last = 2 ** zoom - 1
+    x_start = max(0, int(math.floor((bounds[0] + ORIGIN_SHIFT) / size)))
+    x_end = min(last, int(math.floor((bounds[2] + ORIGIN_SHIFT) / size)))
+    y_start = max(0, int(math.floor((ORIGIN_SHIFT - bounds[3]) / size)))
+    y_end = min(last, int(math.floor((ORIGIN_SHIFT - bounds[1]) / size)))
+    return x_start, x_end, y_start, y_end
+
+
+def tile_count(bounds, zoom):
+    x_start, x_end, y_start, y_end = tile_range(bounds, zoom)
+    return max(0, x_end - x_start + 1) * max(0, y_end - y_start + 1)
+
+
+def tiles_for_bounds(bounds, zoom):
+    x_start, x_end, y_start, y_end = tile_range(bounds, zoom)
+    for x in range(x_start, x_end + 1):
+        for y in range(y_start, y_end + 1):
+            yield zoom, x, y
+
+
+def quadkey(z, x, y):
+    digits = []
+    for level in range(z, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return "".join(digits)
+
+
+def tile_url(template, z, x, y):
+    # Same placeholders the QGIS XYZ provider understands
+    return (template.replace("{z}", str(z)).replace("{x}", str(x))
+            .replace("{-y}", str(2 ** z - 1 - y)).replace("{y}", str(y))
+            .replace("{q}", quadkey(z, x, y)))
+
+
+class TileFetcher:
+    # A bounded pool of worker threads, each keeping one keep-alive connection per host
+
+    def __init__(self, pool_size=BASEMAP_POOL_SIZE, timeout=30, retries=2):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self._local = threading.local()
+
+    def _connection(self, scheme, host, fresh=False):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (scheme, host)
+        if fresh or key not in connections:
+            if key in connections:
+                connections[key].close()
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            connections[key] = cls(host, timeout=self.timeout)
+        return connections[key]
+
+    def fetch(self, url):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        for attempt in range(self.retries + 1):
+            try:
+                connection = self._connection(parts.scheme, parts.netloc, fresh=attempt > 0)
+                connection.request("GET", path, headers={"User-Agent": USER_AGENT})
+                response = connection.getresponse()
+                data = response.read()
+                if response.status == 200:
+                    return data
+                if response.status == 404:
+                    return None
+                error = f"HTTP {response.status}"
+            except (OSError, http.client.HTTPException) as err:
+                error = str(err)
+            time.sleep(0.2 * (attempt + 1))
+        raise Exception(f"Could not fetch {url}: {error}")
+
+
+class BasemapCache:
+    # Persistent on-disk XYZ cache: <cache>/<template hash>/{z}/{x}/{y}.<ext>
+
+    def __init__(self, cache_dir, fetcher=None):
+        self.cache_dir = cache_dir
+        self.fetcher = fetcher or TileFetcher()
+
+    def folder(self, template):
+        key = hashlib.sha1(template.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, key)
+
+    def extension(self, template):
+        ext = os.path.splitext(urllib.parse.urlsplit(template).path)[1].lower()
+        return ext if ext in (".png", ".jpg", ".jpeg", ".webp") else ".png"
+
+    def tile_path(self, template, z, x, y):
+        return os.path.join(self.folder(template), str(z), str(x), f"{y}{self.extension(template)}")
+
+    def local_template(self, template):
+        folder = self.folder(template).replace("\\", "/")
+        if not folder.startswith("/"):
+            folder = "/" + folder
+        return "file://" + urllib.parse.quote(folder) + "/{z}/{x}/{y}" + self.extension(template)
+
+    def _fetch_tile(self, template, z, x, y):
+        path = self.tile_path(template, z, x, y)
+        data = self.fetcher.fetch(tile_url(template, z, x, y))
+        if data is None:
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name so an interrupted run never leaves half a tile
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def prefetch(self, template, tiles):
+        stats = {"tiles": 0, "cached": 0, "fetched": 0, "missing": 0, "failed": 0, "bytes": 0}
+        missing = []
+        for z, x, y in tiles:
+            stats["tiles"] += 1
+            if os.path.exists(self.tile_path(template, z, x, y)):
+                stats["cached"] += 1
+            else:
+                missing.append((z, x, y))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.fetcher.pool_size) as pool:
+            futures = [pool.submit(self._fetch_tile, template, *tile) for tile in missing]
+            for future in as_completed(futures):
+                try:
+                    size = future.result()
+                except Exception as err:
+                    print(err)
+                    stats["failed"] += 1
+                    continue
+                if size:
+                    stats["fetched"] += 1
+                    stats["bytes"] += size
+                else:
+                    stats["missing"] += 1
+        stats["fetch_s"] = round(time.perf_counter() - start, 3)
+        return stats
+
+
+def prefetch_basemaps(layers, extent, extent_crs, resolution, cache_dir, pool_size=BASEMAP_POOL_SIZE):
+    # Fetches every XYZ tile the export will draw, then points the layers at the cache.
+    # Returns a restore callable and the per-layer stats.
+    cache = BasemapCache(cache_dir, TileFetcher(pool_size))
+    bounds = transform_bounds([extent], extent_crs, "EPSG:3857")[0]
+
+    # Render resolution in EPSG:3857 metres; the neighbouring levels cover QGIS' own zoom choice
+    scale = (bounds[2] - bounds[0]) / max(extent[2] - extent[0], 1e-12)
+    resolution_3857 = resolution * scale
+
+    originals = []
+    stats = {"layers": {}}
+    for layer, uri in xyz_layers(layers):
+        template = uri.param("url")
+        zmin = int(uri.param("zmin") or 0)
+        zmax = int(uri.param("zmax") or 19)
+        zoom = zoom_for_resolution(resolution_3857, zmin, zmax)
+        zooms = sorted({zoom, max(zmin, zoom - 1), min(zmax, zoom + 1)})
+
+        count = sum(tile_count(bounds, z) for z in zooms)
+        if count > BASEMAP_PREFETCH_LIMIT:
+            print(f"{layer.name()}: {count:,} tiles is over the prefetch limit, left online")
+            continue
+
+        print(f"Prefetching {count:,} tiles for {layer.name()} at zoom {zooms}")
+        layer_stats = cache.prefetch(template, (tile for z in zooms for tile in tiles_for_bounds(bounds, z)))
+        layer_stats["zoom"] = zooms
+        stats["layers"][layer.name()] = layer_stats
+        print(f"{layer.name()}: {layer_stats['cached']} cached, {layer_stats['fetched']} fetched, "
+              f"{layer_stats['failed']} failed in {layer_stats['fetch_s']:.1f} s")
+
+        # A partial cache would render holes, so the layer stays online until a re-run fills it
+        if layer_stats["failed"]:
+            print(f"{layer.name()}: some tiles failed to download, left online")
+            continue
+
+        # Render from disk only
+        originals.append((layer, layer.source()))
+        local = QgsDataSourceUri(uri)
+        local.removeParam("url")
+        local.setParam("url", cache.local_template(template))
+        layer.setDataSource(bytes(local.encodedUri()).decode(), layer.name(), "wms")
+
+    def restore():
+        for layer, source in originals:
+            layer.setDataSource(source, layer.name(), "wms")
+
+    stats["all_cached"] = bool(originals) and len(originals) == len(xyz_layers(layers))
+    return restore, stats
+
+
+def prefetch_for_grid(project, coverage, page_width_mm, page_height_mm, cache_dir, dpi=300, pool_size=BASEMAP_POOL_SIZE,
+                      layers=None):
+    # Extent and resolution the direct renderer will draw the grid at
+    grid = regular_grid(coverage)
+    width_px, height_px = page_size_pixels(page_width_mm, page_height_mm, dpi)
+    resolution = max(grid.h_spacing / width_px, grid.v_spacing / height_px)
+
+    # Tiles are widened to the page aspect ratio, one cell of margin covers that
+    margin = max(grid.h_spacing, grid.v_spacing)
+    extent = grid.extent()
+    bounds = [extent.xMinimum() - margin, extent.yMinimum() - margin,
+              extent.xMaximum() + margin, extent.yMaximum() + margin]
+
+    layers = layers if layers is not None else visible_layers(project)
+    return prefetch_basemaps(layers, bounds, grid.crs(), resolution, cache_dir, pool_size)
@@ -0,0 +1,57 @@
+import argparse
+import math
+import os
+import sys
+import time
+
+plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, plugin_dir)
+import headless
+
+CELL_COUNTS = (10000, 100000, 1000000)
+SPACING_M = 1000
+
+
+def bench_grid(grid_generation, cells):
+    side = int(math.ceil(math.sqrt(cells)))
+    extent = [0, 0, side * SPACING_M, side * SPACING_M]
+
+    start = time.perf_counter()
+    layer = grid_generation.run_grid_generation(
+        horizontal_spacing = SPACING_M,
+        vertical_spacing = SPACING_M,
+        horizontal_unit = "meters",
+        vertical_unit = "meters",
+        crs = "EPSG:3857",
+        extent = extent,
+        interactive = False
+    )
+    elapsed = time.perf_counter() - start
+
+    count = layer.featureCount()
+    from qgis.core import QgsProject
+    QgsProject.instance().removeMapLayer(layer.id())
+    return count, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time grid generation at several grid sizes")
+    parser.add_argument("--cells", type=int, nargs="+", default=list(CELL_COUNTS))
+    args = parser.parse_args(argv)
+
+    app = headless.start_qgis()
+    try:
+        grid_generation = headless.import_plugin_module(plugin_dir, "grid_generation")
+        profiling = headless.import_plugin_module(plugin_dir, "profiling")
+        print(f"{'cells':>10} {'seconds':>10} {'cells/s':>12} {'peak RSS MB':>12}")
+        for cells in args.cells:
+            count, elapsed = bench_grid(grid_generation, cells)
+            rss = profiling.peak_rss_mb()
+            rss_text = f"{rss:.0f}" if rss is not None else "n/a"
+            print(f"{count:>10} {elapsed:>10.2f} {count / elapsed:>12.0f} {rss_text:>12}")
+    finally:
+        headless.stop_qgis(app)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, plugin_dir)
+import headless
+from tile_server import TileServer
+
+# Tile counts (square grids) and page sizes in mm
+GRID_TILES = (16, 64, 256)
+PAGE_SIZES_MM = (50, 100)
+SPACING_M = 500
+
+# Synthetic data sits in Web Mercator so no reprojection is needed
+ORIGIN = (1110000.0, 6860000.0)
+CRS = "EPSG:3857"
+DEM_PIXEL_M = 10.0
+BASEMAP_PIXEL_M = 4.0
+
+RESULT_PREFIX = "ROCKYCROP_BENCH"
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+
+def grid_side(tiles):
+    return int(math.ceil(math.sqrt(tiles)))
+
+
+def data_extent(max_tiles):
+    # Covers the largest grid plus one cell of margin for the DEM buffer
+    size = (grid_side(max_tiles) + 1) * SPACING_M
+    return [ORIGIN[0] - SPACING_M / 2, ORIGIN[1] - SPACING_M / 2, ORIGIN[0] + size, ORIGIN[1] + size]
+
+
+def write_raster(path, array, extent, pixel_size, nodata=None):
+    from osgeo import gdal, osr
+
+    bands = array.shape[0]
+    rows, cols = array.shape[1], array.shape[2]
+    gdal_type = gdal.GDT_Float32 if array.dtype.kind == "f" else gdal.GDT_Byte
+
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(path, cols, rows, bands, gdal_type, options=["TILED=YES"])
+    dataset.SetGeoTransform((extent[0], pixel_size, 0, extent[3], 0, -pixel_size))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(CRS.split(":")[1]))
+    dataset.SetProjection(srs.ExportToWkt())
+
+    for index in range(bands):
+        band = dataset.GetRasterBand(index + 1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(array[index])
+    dataset.FlushCache()
+    dataset = None
+
+
+def make_synthetic_data(data_dir, max_tiles):
+    import numpy as np
+
+    extent = data_extent(max_tiles)
+    width_m = extent[2] - extent[0]
+    height_m = extent[3] - extent[1]
+
+    # --- DEM: rolling hills with a ridge, deterministic ---
+    cols = int(width_m / DEM_PIXEL_M)
+    rows = int(height_m / DEM_PIXEL_M)
+    y, x = np.mgrid[0:rows, 0:cols].astype(np.float32)
+    dem = (200.0
+           + 80.0 * np.sin(x / 37.0) * np.cos(y / 53.0)
+           + 150.0 * np.exp(-((x - cols / 2) ** 2) / (2 * (cols / 6) ** 2))
+           + 0.01 * x * y / max(cols, rows))
+    dem_path = os.path.join(data_dir, "synthetic_dem.tif")
+    write_raster(dem_path, dem[np.newaxis, :, :].astype(np.float32), extent, DEM_PIXEL_M, nodata=-9999)
+
+    # --- Basemap: RGB pattern standing in for an online tile service ---
+    cols = int(width_m / BASEMAP_PIXEL_M)
+    rows = int(height_m / BASEMAP_PIXEL_M)
+    y, x = np.mgrid[0:rows, 0:cols]
+    checker = ((x // 64 + y // 64) % 2).astype(np.uint8)
+    basemap = np.stack([
+        (x % 256).astype(np.uint8),
+        (y % 256).astype(np.uint8),
+        (checker * 200 + 30).astype(np.uint8),
+    ])
+    basemap_path = os.path.join(data_dir, "synthetic_basemap.tif")
+    write_raster(basemap_path, basemap, extent, BASEMAP_PIXEL_M)
+
+    return dem_path, basemap_path
+
+
+def folder_bytes(folder):
+    total = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def scenario_key(result):
+    return (result["tiles"], result["page_mm"], result["render_mode"],
+            result.get("basemap", "file"), result.get("prefetch", False), result.get("pipeline", False))
+
+
+def run_scenario(data_dir, tiles, page_mm, render_mode, basemap_url=None, prefetch=False, pipelined=False):
+    # Runs in its own process so peak RSS belongs to this scenario only
+    app_start = time.perf_counter()
+    app = headless.start_qgis()
+    try:
+        pipeline = headless.import_plugin_module(plugin_dir, "pipeline")
+        profiling = headless.import_plugin_module(plugin_dir, "profiling")
+
+        side = grid_side(tiles)
+        out_dir = os.path.join(data_dir, f"out_{tiles}_{page_mm}_{render_mode}")
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+        job = dict(pipeline.JOB_DEFAULTS)
+        job.update({
+            "extent": [ORIGIN[0], ORIGIN[1], ORIGIN[0] + side * SPACING_M, ORIGIN[1] + side * SPACING_M],
+            "crs": CRS,
+            "horizontal_spacing": SPACING_M,
+            "vertical_spacing": SPACING_M,
+            "page_width_mm": page_mm,
+            "page_height_mm": page_mm,
+            "dem_path": os.path.join(data_dir, "synthetic_dem.tif"),
+            "basemap": basemap_url or os.path.join(data_dir, "synthetic_basemap.tif"),
+            "basemap_prefetch": prefetch,
+            "basemap_cache": os.path.join(out_dir, "basemap_cache"),
+            "visual_folder": os.path.join(out_dir, "visual"),
+            "elevation_folder": os.path.join(out_dir, "elevation"),
+            "log_path": os.path.join(out_dir, "export_log.jsonl"),
+            "render_mode": render_mode,
+            "resume": False,
+            "pipeline": pipelined,
+        })
+        os.makedirs(out_dir, exist_ok=True)
+
+        pipeline.prepare_project(job)
+        startup_s = time.perf_counter() - app_start
+        timings = pipeline.run_pipeline(job, interactive=False)
+        summary = timings["summary"]
+
+        return {
+            "tiles": timings["tiles"],
+            "page_mm": page_mm,
+            "render_mode": render_mode,
+            "basemap": "xyz" if basemap_url else "file",
+            "prefetch": prefetch,
+            "pipeline": pipelined,
+            "prefetch_s": round(timings.get("prefetch", 0.0), 3),
+            "startup_s": round(startup_s, 3),
+            "grid_s": round(timings["grid"], 3),
+            "layout_s": round(timings["layout"], 3),
+            "export_s": round(timings["export"], 3),
+            "tiles_per_s": round(timings["tiles"] / timings["export"], 3) if timings["export"] > 0 else None,
+            "latency_ms": summary["latency_ms"],
+            "stage_ms": summary["stage_ms"],
+            "failed": summary["failed"],
+            "bytes_written": folder_bytes(job["visual_folder"]) + folder_bytes(job["elevation_folder"]),
+            "peak_rss_mb": profiling.peak_rss_mb(),
+        }
+    finally:
+        headless.stop_qgis(app)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=plugin_dir, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def previous_results(results_path, commit):
+    # Latest result per scenario from any other commit, for the comparison column
+    previous = {}
+    if not os.path.exists(results_path):
+        return previous
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            result = json.loads(line)
+            if result.get("commit") != commit:
+                previous[scenario_key(result)] = result
+    return previous
+
+
+def spawn_scenario(data_dir, tiles, page_mm, render_mode, basemap_url=None, prefetch=False, pipelined=False):
+    command = [
+        headless.python_executable(), os.path.abspath(__file__),
+        "--scenario", str(tiles), str(page_mm), render_mode, "--data", data_dir
+    ]
+    if basemap_url:
+        command += ["--basemap-url", basemap_url]
+    if prefetch:
+        command.append("--prefetch")
+    if pipelined:
+        command.append("--pipeline")
+    completed = subprocess.run(command, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+
+    print(completed.stdout[-2000:])
+    print(completed.stderr[-2000:])
+    raise Exception(f"Scenario {tiles} tiles / {page_mm} mm / {render_mode} failed (exit code {completed.returncode})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the grid, layout and export pipeline")
+    parser.add_argument("--tiles", type=int, nargs="+", default=list(GRID_TILES))
+    parser.add_argument("--pages", type=int, nargs="+", default=list(PAGE_SIZES_MM))
+    parser.add_argument("--render-mode", nargs="+", default=["direct"], choices=["direct", "atlas"])
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSONL file results are appended to")
+    parser.add_argument("--data", help="Folder for the synthetic layers and outputs (default: a temp folder)")
+    parser.add_argument("--xyz", action="store_true", help="Serve the basemap from a local XYZ tile server")
+    parser.add_argument("--latency-ms", type=int, default=0, help="Simulated network latency of the local tile server")
+    parser.add_argument("--prefetch", action="store_true", help="Prefetch XYZ basemap tiles before exporting")
+    parser.add_argument("--pipeline", action="store_true", help="Use the pipelined export (write and clip worker threads)")
+    parser.add_argument("--basemap-url", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", nargs=3, metavar=("TILES", "PAGE_MM", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        result = run_scenario(args.data, int(args.scenario[0]), int(args.scenario[1]), args.scenario[2],
+                              args.basemap_url, args.prefetch, args.pipeline)
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+        return 0
+
+    data_dir = args.data or tempfile.mkdtemp(prefix="rockycrop_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+    make_synthetic_data(data_dir, max(args.tiles))
+    print(f"Synthetic DEM and basemap written to {data_dir}")
+
+    server = TileServer(latency_ms=args.latency_ms).start() if args.xyz else None
+    basemap_url = server.url_template if server else None
+
+    commit = git_commit()
+    previous = previous_results(args.results, commit)
+
+    print(f"{'tiles':>6} {'page':>5} {'mode':>7} {'tiles/s':>9} {'prev':>9} {'p95 ms':>8} {'MB out':>8} {'RSS MB':>8}")
+    try:
+        for render_mode in args.render_mode:
+            for page_mm in args.pages:
+                for tiles in args.tiles:
+                    result = spawn_scenario(data_dir, tiles, page_mm, render_mode, basemap_url, args.prefetch,
+                                            args.pipeline)
+                    result["commit"] = commit
+                    result["timestamp"] = round(time.time(), 3)
+                    with open(args.results, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(result) + "\n")
+
+                    before = previous.get(scenario_key(result), {}).get("tiles_per_s")
+                    p95 = result["latency_ms"]["p95"]
+                    print(f"{result['tiles']:>6} {page_mm:>5} {render_mode:>7} "
+                          f"{result['tiles_per_s'] or 0:>9.2f} {before if before is not None else 'n/a':>9} "
+                          f"{p95 if p95 is not None else 0:>8.0f} {result['bytes_written'] / 1e6:>8.1f} "
+                          f"{result['peak_rss_mb'] or 0:>8.0f}")
+    finally:
+        if server:
+            print(f"Local tile server answered {server.requests} requests")
+            server.stop()
+        if not args.data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"Results appended to {args.results}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import argparse
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-in for an online XYZ basemap: /{z}/{x}/{y}.png with a generated pattern
+TILE_SIZE = 256
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.png$")
+
+
+def png_bytes(width, height, rows):
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    raw = b"".join(b"\x00" + row for row in rows)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def tile_png(z, x, y):
+    # Colour depends on the tile, with a dark border so tile seams are visible in renders
+    base = bytes(((x * 53 + z * 17) % 256, (y * 97 + z * 29) % 256, (x + y) * 31 % 256))
+    border = b"\x20\x20\x20"
+    inner = border + base * (TILE_SIZE - 2) + border
+    edge = border * TILE_SIZE
+    rows = [edge] + [inner] * (TILE_SIZE - 2) + [edge]
+    return png_bytes(TILE_SIZE, TILE_SIZE, rows)
+
+
+class TileServer:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                match = TILE_PATH.match(self.path)
+                if not match:
+                    self.send_error(404)
+                    return
+                server.requests += 1
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000.0)
+                data = tile_png(*(int(value) for value in match.groups()))
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url_template(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{{z}}/{{x}}/{{y}}.png"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local XYZ tile server for offline basemap tests")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=int, default=0, help="Delay added to every response")
+    args = parser.parse_args(argv)
+
+    server = TileServer(port=args.port, latency_ms=args.latency_ms)
+    print(f"Serving {server.url_template}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
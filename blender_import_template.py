@@ -1,12 +1,20 @@
 import bpy
 import bpy.utils
-import bgl
 from bpy import context
 from mathutils import *
 import time
 import os
 import re
 import bmesh
+import json
+import math
+import sqlite3
+import struct
+import zlib
+import numpy as np
+import shutil
+import subprocess
+import sys
 
 from bpy_extras.io_utils import ImportHelper #helper class defines filename and invoke() function which calls the file selector
 from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty
@@ -16,78 +24,684 @@ from bpy.types import Operator
 mapfolder = None
 elvfolder = None
 crs = None
-log_path = r"C:\import_log.txt"
-
-# Clear scene
-bpy.ops.object.select_all(action='SELECT')
-bpy.ops.object.delete()
-
-# Process matching pairs
-for mapfile in os.listdir(mapfolder):
-    if mapfile.endswith('_visual.tif'):
-        # Get corresponding elevation file
-        fid = mapfile.split('_')[1]
-        elvfile = f"map_{fid}_elevation.tif"
-        elvpath = os.path.join(elvfolder, elvfile)
-       
-        if not os.path.exists(elvpath):
-            print(f"Missing elevation file for {mapfile}")
+manifest_path = None
+import_mode = "mesh"    # "mesh" builds meshes from the elevation arrays, "georaster" uses BlenderGIS
+vertical_scale = None   # None picks a scale that keeps relief in proportion with the grid CRS
+log_path = None         # Per-tile import times (JSON lines), defaults to the elevation folder
+chunk_tiles = None      # Tiles per chunk .blend; None chunks only grids over memory_budget_mb, 0 never chunks
+memory_budget_mb = 4096 # Memory shared by the Blender processes building chunks
+chunk_workers = 1       # Chunks built at the same time, each in its own background Blender
+chunk_folder = None     # Where chunk .blend files go, defaults to the elevation folder
+texture_mode = "tile"   # "tile" gives every tile its own material, "udim" shares one per block of 10 x 100 tiles
+
+GEOGRAPHIC_CRS = ("EPSG:4326", "EPSG:4258", "EPSG:4269")
+EARTH_RADIUS = 6378137.0
+
+# Memory of an empty background Blender, and rough cost per vertex and per texture pixel
+BLENDER_BASE_MB = 300
+VERTEX_BYTES = 64
+PIXEL_BYTES = 8
+
+# UDIM numbers run 1001-1999: ten tiles across, a hundred rows up
+UDIM_COLUMNS = 10
+UDIM_ROWS = 100
+
+# === GEOTIFF READING ===
+# Blender has no GDAL, so single band GeoTIFFs are read directly.
+# Handles the encodings the exporter writes except LZW/ZSTD, which need GDAL.
+
+TIFF_TYPES = {1: "B", 2: "s", 3: "H", 4: "I", 5: "II", 6: "b", 7: "B", 8: "h", 9: "i",
+              10: "ii", 11: "f", 12: "d", 16: "Q", 17: "q", 18: "Q"}
+DEFLATE = (8, 32946)
+
+
+def read_tiff_tags(data):
+    order = "<" if data[:2] == b"II" else ">"
+    big = struct.unpack(order + "H", data[2:4])[0] == 43
+    if big:
+        offset = struct.unpack(order + "Q", data[8:16])[0]
+        count = struct.unpack(order + "Q", data[offset:offset + 8])[0]
+        entry_size, inline, start = 20, 8, offset + 8
+    else:
+        offset = struct.unpack(order + "I", data[4:8])[0]
+        count = struct.unpack(order + "H", data[offset:offset + 2])[0]
+        entry_size, inline, start = 12, 4, offset + 2
+
+    tags = {}
+    for index in range(count):
+        entry = data[start + index * entry_size:start + (index + 1) * entry_size]
+        if big:
+            tag, kind, n = struct.unpack(order + "HHQ", entry[:12])
+            value = entry[12:]
+        else:
+            tag, kind, n = struct.unpack(order + "HHI", entry[:8])
+            value = entry[8:]
+        fmt = TIFF_TYPES.get(kind)
+        if fmt is None:
             continue
-           
-        # === 1. IMPORT ELEVATION (AS MESH) ===
-        bpy.ops.importgis.georaster(
-            filepath=elvpath,
-            rastCRS=crs,
-            importMode="DEM"  # Creates a terrain mesh
-        )
-        terrain = bpy.context.object
-        terrain.name = f"Terrain_{fid}"
-        
-        bpy.context.view_layer.objects.active = terrain
-        terrain.select_set(True)
-
-        # Apply each modifier in reverse order to avoid indexing issues
-        for mod in list(terrain.modifiers):
-            try:
-                bpy.ops.object.modifier_apply(modifier=mod.name)
-                print(f"Applied '{mod.name}' on '{terrain.name}'")
-            except Exception as e:
-                print(f"Failed to apply")
-
-            # Deselect object after processing
-            terrain.select_set(False)
-               
-        # === 2. APPLY VISUAL AS TEXTURE ===
-        mappath = os.path.join(mapfolder, mapfile)
-       
-        # Create material
-        mat = bpy.data.materials.new(name=f"TerrainMat_{fid}")
+        size = struct.calcsize(order + fmt) * n
+        if size > inline:
+            pointer = struct.unpack(order + ("Q" if big else "I"), value)[0]
+            value = data[pointer:pointer + size]
+        if kind == 2:
+            tags[tag] = value[:size].split(b"\x00")[0].decode("ascii", "replace")
+        else:
+            tags[tag] = struct.unpack(order + fmt * n, value[:size])
+    return order, tags
+
+
+def decode_block(raw, rows, width, samples, dtype, predictor):
+    count = rows * width * samples
+    if predictor == 3:
+        # Floating point predictor: byte planes, most significant first, differenced per row
+        planes = np.frombuffer(raw, dtype=np.uint8, count=count * dtype.itemsize)
+        planes = planes.reshape(rows, -1, samples).cumsum(axis=1, dtype=np.uint8).reshape(rows, dtype.itemsize, width * samples)
+        values = np.ascontiguousarray(planes.transpose(0, 2, 1)).view(dtype.newbyteorder(">"))
+        return values.reshape(rows, width, samples)
+    values = np.frombuffer(raw, dtype=dtype, count=count).reshape(rows, width, samples)
+    if predictor == 2:
+        values = values.cumsum(axis=1, dtype=dtype)
+    return values
+
+
+def read_tiff_band(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    order, tags = read_tiff_tags(data)
+
+    width, height = tags[256][0], tags[257][0]
+    bits = tags.get(258, (8,))[0]
+    sample_format = tags.get(339, (1,))[0]
+    samples = tags.get(277, (1,))[0]
+    compression = tags.get(259, (1,))[0]
+    predictor = tags.get(317, (1,))[0]
+    planar = tags.get(284, (1,))[0]
+    if compression not in (1,) + DEFLATE:
+        raise Exception(f"{os.path.basename(path)}: compression {compression} needs GDAL, export elevations as NONE or DEFLATE")
+
+    dtype = np.dtype({1: "u", 2: "i", 3: "f"}[sample_format] + str(bits // 8)).newbyteorder(order)
+    if planar == 2:
+        samples = 1
+    if 322 in tags:
+        block_w, block_h = tags[322][0], tags[323][0]
+        offsets, counts = tags[324], tags[325]
+    else:
+        block_w, block_h = width, min(tags.get(278, (height,))[0], height)
+        offsets, counts = tags[273], tags[279]
+
+    across = -(-width // block_w)
+    down = -(-height // block_h)
+    band = np.empty((down * block_h, across * block_w), dtype=dtype.newbyteorder("="))
+    for index in range(across * down):
+        raw = data[offsets[index]:offsets[index] + counts[index]]
+        if compression in DEFLATE:
+            raw = zlib.decompress(raw)
+        row, col = divmod(index, across)
+        rows = block_h if 322 in tags else min(block_h, height - row * block_h)
+        block = decode_block(raw, rows, block_w, samples, dtype, predictor)
+        band[row * block_h:row * block_h + rows, col * block_w:(col + 1) * block_w] = block[:, :, 0]
+    band = band[:height, :width]
+
+    if 33922 in tags and 33550 in tags:
+        i, j, _, x, y, _ = tags[33922][:6]
+        sx, sy = tags[33550][:2]
+        geotransform = (x - i * sx, sx, 0.0, y + j * sy, 0.0, -sy)
+    elif 34264 in tags:
+        m = tags[34264]
+        geotransform = (m[3], m[0], m[1], m[7], m[4], m[5])
+    else:
+        raise Exception(f"{os.path.basename(path)} has no georeferencing")
+
+    nodata = float(tags[42113]) if tags.get(42113, "").strip() else None
+    return band, geotransform, nodata
+
+
+def read_elevation(path):
+    # GDAL when Blender's Python has it, the built-in reader otherwise
+    try:
+        from osgeo import gdal
+    except ImportError:
+        gdal = None
+    if gdal is None:
+        return read_tiff_band(path)
+
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    return band.ReadAsArray(), dataset.GetGeoTransform(), band.GetNoDataValue()
+
+
+# === PLACEMENT ===
+def manifest_crs(path):
+    # CRS the exporter rendered the tiles in, None for manifests written before it was recorded
+    connection = sqlite3.connect(path)
+    tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    row = connection.execute("SELECT value FROM meta WHERE key = 'render_crs'").fetchone() if "meta" in tables else None
+    connection.close()
+    return row[0] if row else None
+
+
+def load_manifest(path):
+    # Finished tiles with the extents the exporter rendered and clipped them at
+    connection = sqlite3.connect(path)
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(tiles)")]
+    dem_column = "dem_extent" if "dem_extent" in columns else "NULL"
+    rows = connection.execute(
+        f"SELECT fid, extent, visual_path, elevation_path, {dem_column} FROM tiles WHERE status = 'complete' ORDER BY fid"
+    ).fetchall()
+    connection.close()
+
+    tiles = []
+    for fid, extent, visual_path, elevation_path, dem_extent in rows:
+        tiles.append({
+            "fid": fid,
+            "extent": json.loads(extent),
+            "visual": local_path(visual_path, mapfolder),
+            "elevation": local_path(elevation_path, elvfolder),
+            "dem_extent": json.loads(dem_extent) if dem_extent else None,
+        })
+    return tiles
+
+
+def local_path(path, folder):
+    # Output folders may have been moved or copied since the export
+    if path and os.path.exists(path):
+        return path
+    return os.path.join(folder, os.path.basename(path or ""))
+
+
+def grid_spacing(tiles):
+    # Cell step between neighbouring tiles. Tile extents are widened to the page aspect ratio,
+    # so the step is the smallest gap between tile corners, not the extent size.
+    first = tiles[0]["extent"]
+    spacing = []
+    for axis, size in ((0, first[2] - first[0]), (1, first[3] - first[1])):
+        corners = sorted(set(tile["extent"][axis] for tile in tiles))
+        gaps = [b - a for a, b in zip(corners, corners[1:]) if b - a > size * 1e-6]
+        # A single row or column has no gap; its extent size is as good as any step
+        spacing.append(min(gaps) if gaps else size)
+    return spacing
+
+
+def index_tiles(tiles, origin, spacing):
+    # Grid column and row of every tile, counted from the grid's lower left corner
+    for tile in tiles:
+        tile["col"] = int((tile["extent"][0] - origin[0]) / spacing[0] + 0.5)
+        tile["row"] = int((tile["extent"][1] - origin[1]) / spacing[1] + 0.5)
+
+
+def grid_scales(tiles):
+    # Horizontal metres per CRS unit and the height scale, so relief matches the ground plan
+    xmin = min(tile["extent"][0] for tile in tiles)
+    ymin = min(tile["extent"][1] for tile in tiles)
+    xmax = max(tile["extent"][2] for tile in tiles)
+    ymax = max(tile["extent"][3] for tile in tiles)
+    centre_y = (ymin + ymax) / 2
+
+    if crs in GEOGRAPHIC_CRS:
+        lat = math.radians(centre_y)
+        horizontal = (math.pi * EARTH_RADIUS / 180 * math.cos(lat), math.pi * EARTH_RADIUS / 180)
+        vertical = 1.0
+    elif crs == "EPSG:3857":
+        # Web Mercator stretches distances by 1 / cos(latitude)
+        lat = math.atan(math.sinh(centre_y / EARTH_RADIUS))
+        horizontal = (1.0, 1.0)
+        vertical = 1.0 / math.cos(lat)
+    else:
+        horizontal = (1.0, 1.0)
+        vertical = 1.0
+
+    if vertical_scale is not None:
+        vertical = vertical_scale
+    return (xmin, ymin, xmax, ymax), horizontal, vertical
+
+
+# === MESH BUILDING ===
+def sample_heights(band, geotransform, nodata, window, nx, ny):
+    # Bilinear heights at an nx * ny lattice spanning the tile's DEM window
+    band = band.astype(np.float64)
+    invalid = ~np.isfinite(band)
+    if nodata is not None:
+        invalid |= band == nodata
+    if invalid.all():
+        band = np.zeros_like(band)
+    elif invalid.any():
+        band[invalid] = band[~invalid].min()
+
+    xs = window[0] + (window[2] - window[0]) * np.linspace(0.0, 1.0, nx)
+    ys = window[1] + (window[3] - window[1]) * np.linspace(0.0, 1.0, ny)
+    px = np.clip((xs - geotransform[0]) / geotransform[1] - 0.5, 0, band.shape[1] - 1)
+    py = np.clip((ys - geotransform[3]) / geotransform[5] - 0.5, 0, band.shape[0] - 1)
+
+    x0 = np.minimum(np.floor(px).astype(int), band.shape[1] - 2) if band.shape[1] > 1 else np.zeros(nx, int)
+    y0 = np.minimum(np.floor(py).astype(int), band.shape[0] - 2) if band.shape[0] > 1 else np.zeros(ny, int)
+    x1 = np.minimum(x0 + 1, band.shape[1] - 1)
+    y1 = np.minimum(y0 + 1, band.shape[0] - 1)
+    fx = (px - x0)[None, :]
+    fy = (py - y0)[:, None]
+
+    top = band[np.ix_(y0, x0)] * (1 - fx) + band[np.ix_(y0, x1)] * fx
+    bottom = band[np.ix_(y1, x0)] * (1 - fx) + band[np.ix_(y1, x1)] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def grid_topology(nx, ny):
+    # Quad loops (counter-clockwise seen from above) and per-loop UVs for an nx * ny lattice
+    index = np.arange(nx * ny).reshape(ny, nx)
+    corners = np.stack([index[:-1, :-1], index[:-1, 1:], index[1:, 1:], index[1:, :-1]], axis=-1)
+    loops = corners.reshape(-1).astype(np.int32)
+
+    u, v = np.meshgrid(np.linspace(0.0, 1.0, nx), np.linspace(0.0, 1.0, ny))
+    uvs = np.stack([u.ravel(), v.ravel()], axis=-1)[loops]
+    return loops, uvs.astype(np.float32)
+
+
+def build_terrain(tile, origin, horizontal, vertical, collection, uv_offset=(0.0, 0.0)):
+    band, geotransform, nodata = read_elevation(tile["elevation"])
+    read_done = time.perf_counter()
+
+    # The DEM window of the tile, or the whole clip for manifests without one
+    window = tile["dem_extent"]
+    if window is None:
+        window = [geotransform[0], geotransform[3] + geotransform[5] * band.shape[0],
+                  geotransform[0] + geotransform[1] * band.shape[1], geotransform[3]]
+
+    # One vertex per DEM pixel across the window
+    nx = max(2, int(round((window[2] - window[0]) / abs(geotransform[1]))) + 1)
+    ny = max(2, int(round((window[3] - window[1]) / abs(geotransform[5]))) + 1)
+    heights = sample_heights(band, geotransform, nodata, window, nx, ny)
+
+    extent = tile["extent"]
+    xs = (extent[0] + (extent[2] - extent[0]) * np.linspace(0.0, 1.0, nx) - origin[0]) * horizontal[0]
+    ys = (extent[1] + (extent[3] - extent[1]) * np.linspace(0.0, 1.0, ny) - origin[1]) * horizontal[1]
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    coords = np.stack([grid_x.ravel(), grid_y.ravel(), heights.ravel() * vertical], axis=-1).astype(np.float32)
+
+    loops, uvs = grid_topology(nx, ny)
+    uvs += np.asarray(uv_offset, dtype=np.float32)
+    face_count = (nx - 1) * (ny - 1)
+
+    name = f"Terrain_{tile['fid']}"
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(nx * ny)
+    mesh.vertices.foreach_set("co", coords.ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops)
+    mesh.polygons.add(face_count)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, len(loops), 4, dtype=np.int32))
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", np.full(face_count, 4, dtype=np.int32))
+    mesh.polygons.foreach_set("use_smooth", np.ones(face_count, dtype=bool))
+    mesh.uv_layers.new(name="UVMap").data.foreach_set("uv", uvs.ravel())
+    mesh.update()
+
+    terrain = bpy.data.objects.new(name, mesh)
+    collection.objects.link(terrain)
+    return terrain, read_done, nx * ny
+
+
+def apply_texture(terrain, fid, mappath):
+    # Create material
+    mat = bpy.data.materials.new(name=f"TerrainMat_{fid}")
+    mat.use_nodes = True
+    bsdf = mat.node_tree.nodes["Principled BSDF"]
+
+    # Add image texture
+    tex_node = mat.node_tree.nodes.new('ShaderNodeTexImage')
+    tex_node.image = bpy.data.images.load(mappath)
+
+    # Connect to material
+    mat.node_tree.links.new(tex_node.outputs['Color'], bsdf.inputs['Base Color'])
+    terrain.data.materials.append(mat)
+
+
+# === UDIM TEXTURES ===
+# Tiles are hard linked into udim/ as Region_<x>_<y>.<udim>.tif, so each block of
+# 10 x 100 tiles is one tiled image and one material. UVs are offset into the
+# tile's UDIM square instead of every tile getting its own material and image.
+
+def udim_region(tile):
+    name = f"Region_{tile['col'] // UDIM_COLUMNS}_{tile['row'] // UDIM_ROWS}"
+    number = 1001 + tile["col"] % UDIM_COLUMNS + UDIM_COLUMNS * (tile["row"] % UDIM_ROWS)
+    return name, number
+
+
+def udim_offset(tile):
+    return tile["col"] % UDIM_COLUMNS, tile["row"] % UDIM_ROWS
+
+
+def link_udim_tiles(tiles):
+    folder = os.path.join(mapfolder, "udim")
+    os.makedirs(folder, exist_ok=True)
+    for tile in tiles:
+        name, number = udim_region(tile)
+        path = os.path.join(folder, f"{name}.{number}{os.path.splitext(tile['visual'])[1]}")
+        tile["udim_path"] = path
+        if not os.path.exists(tile["visual"]):
+            continue
+        if os.path.exists(path):
+            # Re-exported tiles are new files, so older links are replaced
+            if os.path.samefile(path, tile["visual"]):
+                continue
+            os.remove(path)
+        try:
+            os.link(tile["visual"], path)
+        except OSError:
+            shutil.copyfile(tile["visual"], path)
+
+
+def udim_material(tile, materials):
+    name, _ = udim_region(tile)
+    if name not in materials:
+        mat = bpy.data.materials.new(name=f"TerrainMat_{name}")
         mat.use_nodes = True
         bsdf = mat.node_tree.nodes["Principled BSDF"]
-       
-        # Add image texture
+
+        # A tiled image picks up every Region_<x>_<y>.<udim> file next to the one loaded
         tex_node = mat.node_tree.nodes.new('ShaderNodeTexImage')
-        tex_node.image = bpy.data.images.load(mappath)
-       
-        # Connect to material
+        tex_node.image = bpy.data.images.load(tile["udim_path"], check_existing=True)
+        tex_node.image.source = 'TILED'
+
         mat.node_tree.links.new(tex_node.outputs['Color'], bsdf.inputs['Base Color'])
-        terrain.data.materials.append(mat)
-       
-        # === 3. FIX VISIBILITY & SCALE ===
-        terrain.scale = (1000000, 1000000, 10)
-        bpy.ops.object.transform_apply(scale=True)
-       
-        # Ensure object is visible
-        terrain.hide_set(False)
-        terrain.hide_viewport = False
-        terrain.hide_render = False
-
-# Fix viewport clipping
-for area in bpy.context.screen.areas:
-    if area.type == 'VIEW_3D':
-        for space in area.spaces:
-            if space.type == 'VIEW_3D':
-                space.clip_start = 0.1
-                space.clip_end = 100000  # Large enough for terrain
-                
-print("=== IMPORT COMPLETE ===")
+        materials[name] = mat
+    return materials[name]
+
+
+def import_meshes(tiles, origin, horizontal, vertical, collection):
+    udim = texture_mode == "udim"
+    if udim:
+        link_udim_tiles(tiles)
+    materials = {}
+
+    log = open(log_path or os.path.join(elvfolder, "blender_import_log.jsonl"), "a")
+    import_start = time.perf_counter()
+    imported = 0
+    try:
+        for tile in tiles:
+            fid = tile["fid"]
+            if not os.path.exists(tile["elevation"]) or not os.path.exists(tile["visual"]):
+                print(f"Missing files for tile {fid}")
+                continue
+
+            start = time.perf_counter()
+            try:
+                uv_offset = udim_offset(tile) if udim else (0.0, 0.0)
+                terrain, read_done, vertices = build_terrain(tile, origin, horizontal, vertical, collection, uv_offset)
+                mesh_done = time.perf_counter()
+                if udim:
+                    terrain.data.materials.append(udim_material(tile, materials))
+                else:
+                    apply_texture(terrain, fid, tile["visual"])
+            except Exception as e:
+                print(f"Failed to import tile {fid}: {e}")
+                continue
+            end = time.perf_counter()
+
+            imported += 1
+            timing = {
+                "fid": fid,
+                "vertices": vertices,
+                "read_ms": round((read_done - start) * 1000, 2),
+                "mesh_ms": round((mesh_done - read_done) * 1000, 2),
+                "material_ms": round((end - mesh_done) * 1000, 2),
+                "total_ms": round((end - start) * 1000, 2),
+            }
+            log.write(json.dumps(timing) + "\n")
+            print(f"Tile {fid}: {timing['total_ms']:.1f} ms ({vertices} vertices)")
+    finally:
+        log.close()
+
+    elapsed = time.perf_counter() - import_start
+    if imported:
+        print(f"Imported {imported} tiles in {elapsed:.1f} s, {elapsed / imported * 1000:.1f} ms per tile")
+    return imported
+
+
+# === CHUNKED IMPORT ===
+# Large grids are split into square blocks of tiles. Each block is built by a
+# background Blender into its own .blend file, then its collection is linked
+# into this scene. Building stays within the budget: at most chunk_workers
+# chunks are in memory at once. Linking reads every chunk's meshes into this
+# session though; only the texture pixels wait until they are drawn.
+
+def raster_size(path):
+    with open(path, "rb") as f:
+        _, tags = read_tiff_tags(f.read())
+    return tags[256][0], tags[257][0]
+
+
+def estimate_tile_mb(tile, textures=True):
+    # Texture pixels plus mesh vertices, from the first tile since an export's tiles share a size
+    width, height = raster_size(tile["visual"]) if textures else (0, 0)
+    vertices = np.prod(raster_size(tile["elevation"]))
+    return (width * height * PIXEL_BYTES + vertices * VERTEX_BYTES) / (1024 * 1024)
+
+
+def plan_chunks(tiles, per_chunk):
+    # Square blocks of neighbouring tiles, so each chunk is one compact area
+    side = max(1, int(math.sqrt(per_chunk)))
+    chunks = {}
+    for tile in tiles:
+        chunks.setdefault((tile["row"] // side, tile["col"] // side), []).append(tile)
+    return [chunks[key] for key in sorted(chunks)]
+
+
+def this_script():
+    # The copied blender_import.py, also when run from Blender's text editor
+    path = globals().get("__file__")
+    if path and os.path.exists(path):
+        return os.path.abspath(path)
+    for text in bpy.data.texts:
+        if text.filepath and os.path.basename(text.filepath) == "blender_import.py":
+            return bpy.path.abspath(text.filepath)
+    raise Exception("Save blender_import.py to disk to use the chunked import")
+
+
+def build_chunk(spec_path):
+    # Runs inside a background Blender: builds one chunk and saves it
+    with open(spec_path, "r") as f:
+        spec = json.load(f)
+
+    bpy.ops.object.select_all(action='SELECT')
+    bpy.ops.object.delete()
+
+    collection = bpy.data.collections.new(spec["name"])
+    bpy.context.scene.collection.children.link(collection)
+    wanted = set(spec["fids"])
+    tiles = [tile for tile in load_manifest(manifest_file) if tile["fid"] in wanted]
+    index_tiles(tiles, spec["origin"], spec["spacing"])
+    import_meshes(tiles, spec["origin"], spec["horizontal"], spec["vertical"], collection)
+
+    bpy.ops.wm.save_as_mainfile(filepath=spec["blend"])
+
+
+def link_chunk(blend_path, name):
+    with bpy.data.libraries.load(blend_path, link=True) as (data_from, data_to):
+        data_to.collections = [found for found in data_from.collections if found == name]
+    for collection in data_to.collections:
+        bpy.context.scene.collection.children.link(collection)
+
+
+def import_chunked(tiles, origin, spacing, horizontal, vertical):
+    folder = chunk_folder or os.path.join(elvfolder, "blender_chunks")
+    os.makedirs(folder, exist_ok=True)
+
+    per_chunk = chunk_tiles
+    if not per_chunk:
+        worker_mb = memory_budget_mb / max(1, chunk_workers) - BLENDER_BASE_MB
+        per_chunk = max(1, int(worker_mb / estimate_tile_mb(tiles[0])))
+        print(f"{per_chunk} tiles per chunk for {memory_budget_mb} MB over {max(1, chunk_workers)} workers")
+    chunks = plan_chunks(tiles, per_chunk)
+
+    # --- Write chunk specs, reusing .blend files whose spec hasn't changed ---
+    jobs = []
+    for index, chunk in enumerate(chunks):
+        name = f"Chunk_{index:04d}"
+        spec = {
+            "name": name,
+            "blend": os.path.join(folder, f"{name}.blend"),
+            "fids": [tile["fid"] for tile in chunk],
+            "origin": list(origin),
+            "spacing": list(spacing),
+            "horizontal": list(horizontal),
+            "vertical": vertical,
+        }
+        spec_path = os.path.join(folder, f"{name}.json")
+        text = json.dumps(spec, sort_keys=True)
+        if os.path.exists(spec["blend"]) and os.path.exists(spec_path):
+            with open(spec_path, "r") as f:
+                if f.read() == text:
+                    jobs.append((spec, None))
+                    continue
+        with open(spec_path, "w") as f:
+            f.write(text)
+        jobs.append((spec, spec_path))
+
+    # --- Build chunks in background Blenders, chunk_workers at a time ---
+    script = this_script()
+    pending = [job for job in jobs if job[1]]
+    running = []
+    start = time.perf_counter()
+    print(f"{len(chunks)} chunks, {len(pending)} to build")
+    while pending or running:
+        while pending and len(running) < max(1, chunk_workers):
+            spec, spec_path = pending.pop(0)
+            command = [bpy.app.binary_path, "--background", "--factory-startup", "--python", script, "--", "--chunk", spec_path]
+            running.append((spec, subprocess.Popen(command), time.perf_counter()))
+        for entry in list(running):
+            spec, process, chunk_start = entry
+            if process.poll() is None:
+                continue
+            running.remove(entry)
+            status = "built" if process.returncode == 0 else f"failed (exit code {process.returncode})"
+            print(f"{spec['name']}: {len(spec['fids'])} tiles {status} in {time.perf_counter() - chunk_start:.1f} s")
+        time.sleep(0.2)
+    print(f"Chunks built in {time.perf_counter() - start:.1f} s")
+
+    # --- Link every chunk into this scene ---
+    # Linked meshes are loaded into this session, so the assembled scene holds the whole grid's geometry
+    scene_mb = BLENDER_BASE_MB + len(tiles) * estimate_tile_mb(tiles[0], textures=False)
+    print(f"Linking {len(chunks)} chunks, about {scene_mb:,.0f} MB of meshes in this session "
+          f"(textures load when drawn)")
+    if scene_mb > memory_budget_mb:
+        print(f"Warning: the linked meshes alone exceed memory_budget_mb ({memory_budget_mb} MB); "
+              f"open the chunk .blend files separately or lower the elevation grid size")
+    imported = 0
+    for spec, _ in jobs:
+        if os.path.exists(spec["blend"]):
+            link_chunk(spec["blend"], spec["name"])
+            imported += len(spec["fids"])
+        else:
+            print(f"{spec['name']} was not built")
+    return imported
+
+
+def import_manifest(tiles):
+    if not tiles:
+        print("No finished tiles in the export manifest")
+        return 0, 0
+    bounds, horizontal, vertical = grid_scales(tiles)
+    origin = (bounds[0], bounds[1])
+    spacing = grid_spacing(tiles)
+    index_tiles(tiles, origin, spacing)
+    print(f"Placing {len(tiles)} tiles, origin {origin}, height scale {vertical:.4f}")
+
+    # Grids that fit the budget go straight into this scene
+    chunked = bool(chunk_tiles)
+    if chunk_tiles is None:
+        total_mb = estimate_tile_mb(tiles[0]) * len(tiles)
+        chunked = total_mb > memory_budget_mb - BLENDER_BASE_MB
+        print(f"Estimated {total_mb:.0f} MB for the whole grid, {'chunked' if chunked else 'single scene'} import")
+
+    if chunked:
+        import_chunked(tiles, origin, spacing, horizontal, vertical)
+    else:
+        import_meshes(tiles, origin, horizontal, vertical, bpy.context.scene.collection)
+    return (bounds[2] - bounds[0]) * horizontal[0], (bounds[3] - bounds[1]) * horizontal[1]
+
+
+# === BLENDERGIS IMPORT ===
+def import_georaster():
+    # Original importer, one BlenderGIS operator call per tile
+    for mapfile in os.listdir(mapfolder):
+        if mapfile.endswith('_visual.tif'):
+            # Get corresponding elevation file
+            fid = mapfile.split('_')[1]
+            elvfile = f"map_{fid}_elevation.tif"
+            elvpath = os.path.join(elvfolder, elvfile)
+
+            if not os.path.exists(elvpath):
+                print(f"Missing elevation file for {mapfile}")
+                continue
+
+            start = time.perf_counter()
+
+            # === 1. IMPORT ELEVATION (AS MESH) ===
+            bpy.ops.importgis.georaster(
+                filepath=elvpath,
+                rastCRS=crs,
+                importMode="DEM"  # Creates a terrain mesh
+            )
+            terrain = bpy.context.object
+            terrain.name = f"Terrain_{fid}"
+
+            bpy.context.view_layer.objects.active = terrain
+            terrain.select_set(True)
+
+            # Apply each modifier in reverse order to avoid indexing issues
+            for mod in list(terrain.modifiers):
+                try:
+                    bpy.ops.object.modifier_apply(modifier=mod.name)
+                    print(f"Applied '{mod.name}' on '{terrain.name}'")
+                except Exception as e:
+                    print(f"Failed to apply")
+
+                # Deselect object after processing
+                terrain.select_set(False)
+
+            # === 2. APPLY VISUAL AS TEXTURE ===
+            apply_texture(terrain, fid, os.path.join(mapfolder, mapfile))
+
+            # === 3. FIX VISIBILITY & SCALE ===
+            terrain.scale = (1000000, 1000000, 10)
+            bpy.ops.object.transform_apply(scale=True)
+
+            # Ensure object is visible
+            terrain.hide_set(False)
+            terrain.hide_viewport = False
+            terrain.hide_render = False
+            print(f"Tile {fid}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    return 0, 0
+
+
+# === MAIN ===
+manifest_file = manifest_path or os.path.join(mapfolder, "rockycrop_manifest.sqlite")
+script_args = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+# Tile extents and GeoTIFFs are in the render CRS, not necessarily the grid CRS
+if os.path.exists(manifest_file):
+    crs = manifest_crs(manifest_file) or crs
+
+if "--chunk" in script_args:
+    # Background chunk build started by import_chunked
+    build_chunk(script_args[script_args.index("--chunk") + 1])
+else:
+    # Clear scene
+    bpy.ops.object.select_all(action='SELECT')
+    bpy.ops.object.delete()
+
+    if import_mode == "mesh" and os.path.exists(manifest_file):
+        span = import_manifest(load_manifest(manifest_file))
+    else:
+        if import_mode == "mesh":
+            print(f"No export manifest at {manifest_file}, using the BlenderGIS importer")
+        span = import_georaster()
+
+    # Fix viewport clipping
+    for area in bpy.context.screen.areas:
+        if area.type == 'VIEW_3D':
+            for space in area.spaces:
+                if space.type == 'VIEW_3D':
+                    space.clip_start = 0.1
+                    space.clip_end = max(100000, 2 * max(span))  # Large enough for terrain
+
+    print("=== IMPORT COMPLETE ===")
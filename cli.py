@@ -0,0 +1,108 @@
+import argparse
+import os
+import sys
+import time
+import traceback
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the RockyCrop grid, layout and export pipeline without the QGIS GUI")
+    parser.add_argument("job", help="Job spec (.json or .toml)")
+    parser.add_argument("--workers", type=int, help="Override the job's worker process count")
+    parser.add_argument("--prefetch", action="store_true", help="Download XYZ basemap tiles to the local cache before exporting")
+    parser.add_argument("--pipeline", action="store_true", help="Write visuals and clip DEM tiles on worker threads while rendering")
+    parser.add_argument("--aoi", help="Only export cells overlapping this polygon (vector file, layer name or WKT)")
+    parser.add_argument("--dem-precheck", action="store_true", help="Skip cells with no elevation data in the DEM")
+    parser.add_argument("--resolution", help="Visual ground resolution in metres per pixel, or \"basemap\" to match the basemap's native zoom")
+    parser.add_argument("--elevation-grid", type=int, help="Resample elevation tiles to N x N samples sharing their edges (e.g. 257)")
+    parser.add_argument("--elevation-resampling", choices=["nearest", "bilinear", "cubic", "cubicspline", "lanczos", "average"],
+                        help="Kernel for --elevation-grid")
+    parser.add_argument("--visual-layers", help="Comma-separated layer names or ids to draw into the visuals (default: visible layers except the grid)")
+    parser.add_argument("--render-cache", action="store_true", help="Render unlabelled bottom layers once per block of neighbouring tiles (direct mode)")
+    parser.add_argument("--dem-mmap", action="store_true", help="Decode the DEM under the grid once into a memory-mapped file shared by all workers")
+    parser.add_argument("--incremental", action="store_true", help="Only redo tiles whose inputs changed since the last run")
+    parser.add_argument("--profile", action="store_true", help="Write a profile report next to the export log")
+    parser.add_argument("--profile-sample", type=int, help="Capture cProfile stats for every Nth tile")
+    args = parser.parse_args(argv)
+
+    # === STARTUP ===
+    startup_start = time.perf_counter()
+    from .headless import start_qgis, stop_qgis
+    app = start_qgis()
+
+    try:
+        from .pipeline import load_job, prepare_project, run_pipeline
+        from .run_logger import format_summary
+
+        job = load_job(args.job)
+        if args.workers:
+            job["workers"] = args.workers
+        if args.prefetch:
+            job["basemap_prefetch"] = True
+        if args.aoi:
+            job["aoi"] = os.path.abspath(args.aoi) if os.path.exists(args.aoi) else args.aoi
+        if args.dem_precheck:
+            job["dem_precheck"] = True
+        if args.incremental:
+            job["incremental"] = True
+        if args.resolution:
+            job["visual_resolution"] = args.resolution if args.resolution == "basemap" else float(args.resolution)
+        if args.elevation_grid:
+            job["elevation_grid"] = args.elevation_grid
+        if args.elevation_resampling:
+            job["elevation_resampling"] = args.elevation_resampling
+        if args.visual_layers:
+            job["visual_layers"] = [name.strip() for name in args.visual_layers.split(",") if name.strip()]
+        if args.render_cache:
+            job["render_cache"] = True
+        if args.dem_mmap and not job["dem_mmap"]:
+            job["dem_mmap"] = True
+        if args.pipeline and not job["pipeline"]:
+            job["pipeline"] = True
+        if args.profile or args.profile_sample:
+            job["profile"] = True
+        if args.profile_sample:
+            job["profile_sample_every"] = args.profile_sample
+        prepare_project(job)
+        startup_time = time.perf_counter() - startup_start
+        print(f"Startup: {startup_time:.2f} s")
+
+        # === PIPELINE ===
+        def progress(done, total):
+            if done and (done == total or done % 100 == 0):
+                print(f"Exported {done}/{total} tiles")
+
+        timings = run_pipeline(job, interactive=False, progress_callback=progress)
+
+        print(f"Grid: {timings['grid']:.2f} s")
+        if "grid_filter" in timings:
+            stats = timings["grid_filter"]
+            print(f"Grid filter: {stats.get('outside_aoi', 0):,} cells outside the AOI, "
+                  f"{stats.get('no_dem_data', 0):,} without DEM data, ~{stats['bytes_skipped'] / 1e6:,.0f} MB avoided")
+        if "visual_sizing" in timings:
+            sizing = timings["visual_sizing"]
+            print(f"Visual size: {sizing['width_px']} x {sizing['height_px']} px at {sizing['dpi']:g} dpi, "
+                  f"{sizing['resolution_m']:g} m/px")
+        print(f"Layout: {timings['layout']:.2f} s")
+        if "prefetch" in timings:
+            print(f"Basemap prefetch: {timings['prefetch']:.2f} s")
+        if "dem_mmap" in timings:
+            print(f"Mapped DEM: {timings['dem_mmap']:.2f} s")
+        print(f"Export: {timings['export']:.2f} s for {timings['tiles']} tiles")
+        if timings["export"] > 0:
+            print(f"Throughput: {timings['tiles'] / timings['export']:.2f} tiles/s")
+        print(f"Run summary: {format_summary(timings['summary'])}")
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        stop_qgis(app)
+    return 0
+
+
+if __name__ == "__main__":
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, plugin_dir)
+    import headless
+    cli = headless.import_plugin_module(plugin_dir, "cli")
+    sys.exit(cli.main())
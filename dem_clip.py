@@ -0,0 +1,374 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+import time
+import numpy as np
+from osgeo import gdal, gdal_array
+import processing
+from .raster_encoding import RasterEncoding
+
+DEM_BUFFER = 0.0002  # ~20 meters at equator
+DEM_NODATA = -9999
+
+# Rows decoded per read when building a memory-mapped DEM
+MAPPED_DEM_ROWS = 1024
+
+# Kernels for elevation tiles resampled to a fixed grid
+RESAMPLING_KERNELS = {
+    "nearest": gdal.GRIORA_NearestNeighbour,
+    "bilinear": gdal.GRIORA_Bilinear,
+    "cubic": gdal.GRIORA_Cubic,
+    "cubicspline": gdal.GRIORA_CubicSpline,
+    "lanczos": gdal.GRIORA_Lanczos,
+    "average": gdal.GRIORA_Average,
+}
+
+
+def clip_with_processing(dem_layer, buffered_extent, output_path, encoding=None):
+    # Original path: one Processing call per tile
+    processing_params = {
+        'INPUT': dem_layer,
+        'PROJWIN': [
+            buffered_extent.xMinimum(),
+            buffered_extent.xMaximum(),
+            buffered_extent.yMinimum(),
+            buffered_extent.yMaximum()
+        ],
+        'NODATA': DEM_NODATA,
+        'OUTPUT': output_path
+    }
+
+    # Try GDAL clip first, fall back to native QGIS clip if needed
+    try:
+        processing.run("gdal:cliprasterbyextent", processing_params)
+    except Exception as gdal_err:
+        print(f"GDAL clip failed, trying native clip: {gdal_err}")
+        processing.run("gdal:warpreproject", {
+            'INPUT': dem_layer,
+            'SOURCE_CRS': dem_layer.crs(),
+            'TARGET_CRS': dem_layer.crs(),
+            'RESAMPLING': 0,
+            'NODATA': DEM_NODATA,
+            'TARGET_RESOLUTION': dem_layer.rasterUnitsPerPixelX(),
+            'TARGET_EXTENT': buffered_extent,
+            'DATA_TYPE': 0,
+            'OUTPUT': output_path
+        })
+
+    # Processing writes with its own defaults, the requested encoding is applied afterwards
+    if encoding:
+        encoding.recode(output_path)
+
+
+class DemClipper:
+    # Keeps the DEM open for the whole export session and cuts each tile with
+    # a windowed read/write, matching gdal_translate -projwin output.
+
+    def __init__(self, source_path):
+        self.source_path = source_path
+        self.dataset = gdal.Open(source_path, gdal.GA_ReadOnly)
+        if self.dataset is None:
+            raise Exception(f"GDAL could not open DEM source: {source_path}")
+
+        self.geotransform = self.dataset.GetGeoTransform()
+        if self.geotransform[2] != 0 or self.geotransform[4] != 0:
+            raise Exception("Rotated DEM geotransforms are not supported by the windowed clipper.")
+
+        self.projection = self.dataset.GetProjection()
+        self.width = self.dataset.RasterXSize
+        self.height = self.dataset.RasterYSize
+        self.band_count = self.dataset.RasterCount
+        self.data_type = self.dataset.GetRasterBand(1).DataType
+
+    @classmethod
+    def from_layer(cls, dem_layer):
+        # Strip provider options such as "|layername=" from the layer source
+        return cls(dem_layer.source().split("|")[0])
+
+    def reopen(self):
+        # A separate handle for another thread, GDAL datasets can't be shared
+        return DemClipper(self.source_path)
+
+    def pixel_window(self, extent):
+        # Same rounding gdal_translate applies to -projwin with nearest resampling
+        gt = self.geotransform
+        x_off = math.floor((extent.xMinimum() - gt[0]) / gt[1] + 0.001)
+        y_off = math.floor((extent.yMaximum() - gt[3]) / gt[5] + 0.001)
+        x_end = math.floor((extent.xMaximum() - gt[0]) / gt[1] + 0.5)
+        y_end = math.floor((extent.yMinimum() - gt[3]) / gt[5] + 0.5)
+        return x_off, y_off, max(1, x_end - x_off), max(1, y_end - y_off)
+
+    def clip(self, buffered_extent, output_path, encoding=None):
+        gt = self.geotransform
+        x_off, y_off, x_size, y_size = self.pixel_window(buffered_extent)
+
+        encoding = encoding or RasterEncoding()
+        out = encoding.create(output_path, x_size, y_size, self.band_count, self.data_type)
+        out.SetGeoTransform((gt[0] + x_off * gt[1], gt[1], 0.0, gt[3] + y_off * gt[5], 0.0, gt[5]))
+        out.SetProjection(self.projection)
+
+        # Part of the window that actually overlaps the source raster
+        read_x = max(x_off, 0)
+        read_y = max(y_off, 0)
+        read_w = min(x_off + x_size, self.width) - read_x
+        read_h = min(y_off + y_size, self.height) - read_y
+
+        for band_index in range(1, self.band_count + 1):
+            out_band = out.GetRasterBand(band_index)
+            out_band.SetNoDataValue(DEM_NODATA)
+            if read_w < x_size or read_h < y_size:
+                out_band.Fill(DEM_NODATA)
+            if read_w > 0 and read_h > 0:
+                self.copy_window(band_index, out_band, read_x, read_y, read_w, read_h, read_x - x_off, read_y - y_off)
+
+        encoding.finish(out, output_path)
+        out = None
+        return x_size, y_size
+
+    def copy_window(self, band_index, out_band, read_x, read_y, read_w, read_h, dest_x, dest_y):
+        data = self.dataset.GetRasterBand(band_index).ReadRaster(read_x, read_y, read_w, read_h)
+        out_band.WriteRaster(dest_x, dest_y, read_w, read_h, data)
+
+    def clip_resampled(self, extent, output_path, size, resampling="bilinear", encoding=None):
+        # size x size samples, the outer ones on the extent's edges so neighbouring tiles share
+        # their edge heights. Output pixels are centred on the samples; each band is one
+        # resampled read of the fractional source window, written straight to the output.
+        gt = self.geotransform
+        step_x = extent.width() / (size - 1)
+        step_y = extent.height() / (size - 1)
+        out_x = extent.xMinimum() - step_x / 2
+        out_y = extent.yMaximum() + step_y / 2
+
+        # Output pixel edges in source pixel coordinates
+        x0 = (out_x - gt[0]) / gt[1]
+        y0 = (out_y - gt[3]) / gt[5]
+        scale_x = step_x / gt[1]
+        scale_y = step_y / abs(gt[5])
+
+        # Output pixels that lie on the source raster, the rest stays nodata
+        col0 = max(0, math.ceil(-x0 / scale_x - 1e-6))
+        col1 = min(size, math.floor((self.width - x0) / scale_x + 1e-6))
+        row0 = max(0, math.ceil(-y0 / scale_y - 1e-6))
+        row1 = min(size, math.floor((self.height - y0) / scale_y + 1e-6))
+
+        encoding = encoding or RasterEncoding()
+        out = encoding.create(output_path, size, size, self.band_count, self.data_type)
+        out.SetGeoTransform((out_x, step_x, 0.0, out_y, 0.0, -step_y))
+        out.SetProjection(self.projection)
+
+        for band_index in range(1, self.band_count + 1):
+            out_band = out.GetRasterBand(band_index)
+            out_band.SetNoDataValue(DEM_NODATA)
+            if col0 > 0 or row0 > 0 or col1 < size or row1 < size:
+                out_band.Fill(DEM_NODATA)
+            if col1 > col0 and row1 > row0:
+                data = self.read_resampled(band_index, x0 + col0 * scale_x, y0 + row0 * scale_y,
+                                           (col1 - col0) * scale_x, (row1 - row0) * scale_y,
+                                           col1 - col0, row1 - row0, RESAMPLING_KERNELS[resampling])
+                out_band.WriteRaster(col0, row0, col1 - col0, row1 - row0, data)
+
+        encoding.finish(out, output_path)
+        out = None
+        return size, size
+
+    def read_resampled(self, band_index, x, y, width, height, buf_width, buf_height, kernel):
+        return self.dataset.GetRasterBand(band_index).ReadRaster(
+            x, y, width, height, buf_width, buf_height, resample_alg=kernel
+        )
+
+    def close(self):
+        self.dataset = None
+
+
+def mapped_dem_window(dataset, bounds=None):
+    # Source pixel window covering bounds (DEM CRS), with a pixel of margin; the whole raster when None
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    if bounds is None:
+        return 0, 0, width, height
+
+    gt = dataset.GetGeoTransform()
+    cols = sorted(((bounds[0] - gt[0]) / gt[1], (bounds[2] - gt[0]) / gt[1]))
+    rows = sorted(((bounds[3] - gt[3]) / gt[5], (bounds[1] - gt[3]) / gt[5]))
+    x0 = max(0, math.floor(cols[0]) - 1)
+    y0 = max(0, math.floor(rows[0]) - 1)
+    x1 = min(width, math.ceil(cols[1]) + 1)
+    y1 = min(height, math.ceil(rows[1]) + 1)
+    if x1 <= x0 or y1 <= y0:
+        raise Exception("The grid does not overlap the DEM.")
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def mapped_dem_path(folder, source_path, bounds=None):
+    # One cache file per DEM version and grid window, so concurrent jobs on other DEMs or areas
+    # never share a file
+    is_file = os.path.isfile(source_path)
+    key = [
+        os.path.abspath(source_path) if is_file else source_path,
+        os.path.getsize(source_path) if is_file else None,
+        os.path.getmtime(source_path) if is_file else None,
+        [round(float(value), 6) for value in bounds] if bounds is not None else None,
+    ]
+    name = hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(folder, f"rockycrop_dem_{name}.npy")
+
+
+def build_mapped_dem(source_path, cache_path, bounds=None):
+    # Decodes the DEM, or the window covering bounds, once into a raw .npy array with a JSON
+    # description next to it. A cache of the same unchanged source and window is reused.
+    dataset = gdal.Open(source_path, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise Exception(f"GDAL could not open DEM source: {source_path}")
+    gt = dataset.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0:
+        raise Exception("Rotated DEM geotransforms are not supported by the mapped DEM.")
+
+    window = mapped_dem_window(dataset, bounds)
+    is_file = os.path.isfile(source_path)
+    meta = {
+        "source": os.path.abspath(source_path) if is_file else source_path,
+        "source_size": os.path.getsize(source_path) if is_file else None,
+        "source_mtime": os.path.getmtime(source_path) if is_file else None,
+        "window": list(window),
+        "geotransform": list(gt),
+        "projection": dataset.GetProjection(),
+        "raster_size": [dataset.RasterXSize, dataset.RasterYSize],
+        "bands": dataset.RasterCount,
+        "data_type": dataset.GetRasterBand(1).DataType,
+        "nodata": dataset.GetRasterBand(1).GetNoDataValue(),
+    }
+
+    meta_path = f"{cache_path}.json"
+    if os.path.exists(cache_path) and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f) == meta:
+                print(f"Reusing mapped DEM {cache_path}")
+                return cache_path
+
+    x_off, y_off, width, height = window
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(meta["data_type"])
+    print(f"Decoding DEM window {width} x {height} ({width * height * meta['bands'] * np.dtype(dtype).itemsize / 1e6:,.0f} MB) "
+          f"into {cache_path}")
+
+    # --- Decode in row blocks straight into the mapped file ---
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(meta["bands"], height, width))
+    for band_index in range(meta["bands"]):
+        band = dataset.GetRasterBand(band_index + 1)
+        for row in range(0, height, MAPPED_DEM_ROWS):
+            rows = min(MAPPED_DEM_ROWS, height - row)
+            band.ReadAsArray(x_off, y_off + row, width, rows, buf_obj=array[band_index, row:row + rows])
+    array.flush()
+    del array
+    dataset = None
+
+    # The description is written last, so a half-built cache is never reused
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    os.replace(tmp_path, cache_path)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return cache_path
+
+
+class MappedDem(DemClipper):
+    # Clips from a DEM decoded once by build_mapped_dem. Each tile window is a slice of a
+    # read-only memory map written straight to the output, so nothing is decoded per tile,
+    # and worker processes clipping from the same file share one copy in the page cache.
+
+    def __init__(self, cache_path):
+        with open(f"{cache_path}.json", "r") as f:
+            meta = json.load(f)
+        self.source_path = cache_path
+        self.source = meta["source"]
+        self.array = np.load(cache_path, mmap_mode="r")
+        self.window = meta["window"]
+        self.geotransform = tuple(meta["geotransform"])
+        self.projection = meta["projection"]
+        self.width, self.height = meta["raster_size"]
+        self.band_count = meta["bands"]
+        self.data_type = meta["data_type"]
+        self.nodata = meta.get("nodata")
+        self.fallback = None
+        self.band_datasets = {}
+
+    def reopen(self):
+        return MappedDem(self.source_path)
+
+    def clip(self, buffered_extent, output_path, encoding=None):
+        # Windows reaching past the decoded area but still on the DEM are read from the source
+        x_off, y_off, x_size, y_size = self.pixel_window(buffered_extent)
+        win_x, win_y, win_w, win_h = self.window
+        read_x0 = max(x_off, 0)
+        read_y0 = max(y_off, 0)
+        read_x1 = min(x_off + x_size, self.width)
+        read_y1 = min(y_off + y_size, self.height)
+        if read_x1 > read_x0 and read_y1 > read_y0 and (
+                read_x0 < win_x or read_y0 < win_y or read_x1 > win_x + win_w or read_y1 > win_y + win_h):
+            if self.fallback is None:
+                self.fallback = DemClipper(self.source)
+            return self.fallback.clip(buffered_extent, output_path, encoding)
+        return super().clip(buffered_extent, output_path, encoding)
+
+    def copy_window(self, band_index, out_band, read_x, read_y, read_w, read_h, dest_x, dest_y):
+        # A view into the map, GDAL writes it using the array strides without a copy
+        x = read_x - self.window[0]
+        y = read_y - self.window[1]
+        out_band.WriteArray(self.array[band_index - 1, y:y + read_h, x:x + read_w], dest_x, dest_y)
+
+    def read_resampled(self, band_index, x, y, width, height, buf_width, buf_height, kernel):
+        # Resampled from an in-memory GDAL dataset over the map, or from the source outside the window
+        win_x, win_y, win_w, win_h = self.window
+        if x < win_x or y < win_y or x + width > win_x + win_w or y + height > win_y + win_h:
+            if self.fallback is None:
+                self.fallback = DemClipper(self.source)
+            return self.fallback.read_resampled(band_index, x, y, width, height, buf_width, buf_height, kernel)
+
+        if band_index not in self.band_datasets:
+            dataset = gdal_array.OpenArray(self.array[band_index - 1])
+            # Resampling kernels skip nodata pixels only when the band says which they are
+            if self.nodata is not None:
+                dataset.GetRasterBand(1).SetNoDataValue(self.nodata)
+            self.band_datasets[band_index] = dataset
+        return self.band_datasets[band_index].GetRasterBand(1).ReadRaster(
+            x - win_x, y - win_y, width, height, buf_width, buf_height, resample_alg=kernel
+        )
+
+    def close(self):
+        self.band_datasets = {}
+        self.array = None
+        if self.fallback:
+            self.fallback.close()
+            self.fallback = None
+
+
+class ClipTimer:
+    # Per-tile timing comparison between the windowed clipper and the Processing path
+
+    def __init__(self, dem_layer):
+        self.dem_layer = dem_layer
+        self.scratch_dir = tempfile.mkdtemp(prefix="rockycrop_clip_")
+        self.windowed_ms = []
+        self.processing_ms = []
+
+    def time_processing(self, buffered_extent):
+        scratch_path = os.path.join(self.scratch_dir, "processing_clip.tif")
+        start = time.perf_counter()
+        clip_with_processing(self.dem_layer, buffered_extent, scratch_path)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        self.processing_ms.append(elapsed)
+        return elapsed
+
+    def record_windowed(self, elapsed_ms):
+        self.windowed_ms.append(elapsed_ms)
+
+    def summary(self):
+        if not self.windowed_ms or not self.processing_ms:
+            return "Clip timing: no samples"
+        windowed = sum(self.windowed_ms) / len(self.windowed_ms)
+        proc = sum(self.processing_ms) / len(self.processing_ms)
+        speedup = proc / windowed if windowed > 0 else float("inf")
+        return (f"Clip timing over {len(self.processing_ms)} tiles: "
+                f"windowed {windowed:.1f} ms/tile, processing {proc:.1f} ms/tile ({speedup:.1f}x)")
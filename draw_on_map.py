@@ -40,6 +40,41 @@ class StartDrawOnMap(QgsMapTool):
             self.rubber_band.reset(QgsWkbTypes.PolygonGeometry)  # 👈 This clears the square
         self.canvas.unsetMapTool(self)
         
+class StartDrawPolygon(QgsMapTool):
+    # Left click adds a vertex, right click closes the polygon
+    polygonCreated = pyqtSignal(QgsGeometry)
+
+    def __init__(self, canvas):
+        super(StartDrawPolygon, self).__init__(canvas)
+        self.canvas = canvas
+        self.points = []
+        self.rubber_band = QgsRubberBand(canvas, QgsWkbTypes.PolygonGeometry)
+        self.rubber_band.setColor(QColor(255, 0, 0, 100))
+        self.rubber_band.setFillColor(QColor(255, 0, 0, 40))
+        self.rubber_band.setWidth(2)
+
+    def update_band(self, cursor=None):
+        points = self.points + ([cursor] if cursor else [])
+        self.rubber_band.reset(QgsWkbTypes.PolygonGeometry)
+        for point in points:
+            self.rubber_band.addPoint(point)
+
+    def canvasPressEvent(self, event):
+        point = self.toMapCoordinates(event.pos())
+        if event.button() == Qt.RightButton:
+            if len(self.points) >= 3:
+                self.polygonCreated.emit(QgsGeometry.fromPolygonXY([self.points + [self.points[0]]]))
+            self.rubber_band.reset(QgsWkbTypes.PolygonGeometry)
+            self.points = []
+            self.canvas.unsetMapTool(self)
+            return
+        self.points.append(point)
+        self.update_band()
+
+    def canvasMoveEvent(self, event):
+        if self.points:
+            self.update_band(self.toMapCoordinates(event.pos()))
+
 class DrawOnMap:
     def __init__(self, iface, min_x_input, max_x_input, min_y_input, max_y_input, dialog):
         self.canvas = iface.mapCanvas()
@@ -64,3 +99,20 @@ class DrawOnMap:
         self.tool.rectangleCreated.connect(on_rectangle_drawn)
         self.canvas.setMapTool(self.tool)
 
+    def activate_draw_aoi(self, on_polygon_drawn):
+        self.aoi_tool = StartDrawPolygon(self.canvas)
+        self.dialog.hide()  # hide before drawing
+
+        def on_drawn(geom: QgsGeometry):
+            # The grid extent follows the polygon's bounding box
+            extent = geom.boundingBox()
+            self.min_x_input.setText(str(extent.xMinimum()))
+            self.max_x_input.setText(str(extent.xMaximum()))
+            self.min_y_input.setText(str(extent.yMinimum()))
+            self.max_y_input.setText(str(extent.yMaximum()))
+            on_polygon_drawn(geom)
+            self.dialog.show()
+
+        self.aoi_tool.polygonCreated.connect(on_drawn)
+        self.canvas.setMapTool(self.aoi_tool)
+
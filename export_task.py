@@ -0,0 +1,118 @@
+import time
+import traceback
+from qgis.core import QgsApplication, QgsTask, Qgis
+from qgis.PyQt import QtWidgets
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.utils import iface
+from .pipeline import export_pipeline, finish_pipeline
+
+# Tasks and their progress widgets, kept alive until the task finishes
+_active = []
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ExportTask(QgsTask):
+    # Watches the export off the GUI thread. Grid, layout and project copies are prepared on
+    # the GUI thread beforehand by prepare_pipeline(background=True), and the tiles are rendered
+    # by worker processes, so nothing here touches the project or its layers.
+
+    tilesExported = pyqtSignal(int, int)
+
+    def __init__(self, run):
+        super().__init__("RockyCrop export", QgsTask.CanCancel)
+        self.run_state = run
+        self.summary = None
+        self.error = None
+
+    def run(self):
+        if self.run_state.shard_plan is None:
+            self.error = Exception("Background exports need a shard plan, prepare them with background=True.")
+            return False
+
+        def progress(done, total):
+            if total:
+                self.setProgress(100.0 * done / total)
+            self.tilesExported.emit(done, total)
+
+        try:
+            self.summary = export_pipeline(self.run_state, progress_callback=progress, should_cancel=self.isCanceled)
+        except Exception as err:
+            self.error = err
+            traceback.print_exc()
+            return False
+        return not self.isCanceled()
+
+
+class ExportProgressBar(QtWidgets.QWidget):
+    # Message bar widget with tile count, tiles/s, ETA and a cancel button
+
+    def __init__(self, task, parent=None):
+        super().__init__(parent)
+        self.task = task
+        self.start = time.perf_counter()
+
+        self.label = QtWidgets.QLabel("RockyCrop: starting export...")
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel)
+
+        layout = QtWidgets.QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.label)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_button)
+        self.setLayout(layout)
+
+    def update_progress(self, done, total):
+        elapsed = time.perf_counter() - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = format_duration((total - done) / rate) if rate > 0 else "n/a"
+        if total:
+            self.progress_bar.setValue(int(100 * done / total))
+        self.label.setText(f"RockyCrop: {done}/{total} tiles, {rate:.2f} tiles/s, ETA {eta}")
+
+    def cancel(self):
+        # The current tile is finished before the export stops
+        self.cancel_button.setEnabled(False)
+        self.label.setText("RockyCrop: cancelling after the current tile...")
+        self.task.cancel()
+
+
+def start_export_task(run, parent=None):
+    task = ExportTask(run)
+    progress = ExportProgressBar(task)
+    task.tilesExported.connect(progress.update_progress)
+
+    message_item = iface.messageBar().createMessage("")
+    message_item.layout().addWidget(progress)
+    iface.messageBar().pushWidget(message_item, Qgis.Info)
+
+    def finished(result):
+        # Runs on the GUI thread once the task is done
+        finish_pipeline(run)
+        iface.messageBar().popWidget(message_item)
+        _active.remove(entry)
+
+        if task.error is not None:
+            QtWidgets.QMessageBox.information(parent, "Export Failed", "Visual and elevation exports have failed.")
+        elif task.isCanceled():
+            QtWidgets.QMessageBox.information(parent, "Export Cancelled", "Export stopped. Re-run with Resume ticked to continue.")
+        else:
+            QtWidgets.QMessageBox.information(parent, "Export Complete", "Visual and elevation exports finished successfully.")
+
+    task.taskCompleted.connect(lambda: finished(True))
+    task.taskTerminated.connect(lambda: finished(False))
+
+    entry = (task, progress, message_item)
+    _active.append(entry)
+    QgsApplication.taskManager().addTask(task)
+    return task
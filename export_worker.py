@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import sys
+import traceback
+
+PROGRESS_PREFIX = "ROCKYCROP_TILE"
+
+
+def run_shard(job, shard_index, fid_range, log_path):
+    from qgis.core import QgsProject
+    from .grid_generation import run_grid_generation
+    from .print_layout import create_print_layout
+    from .map_export import run_export, find_dem_layer
+    from .profiling import profiler_from_job
+    from .visual_sizing import DEFAULT_DPI
+
+    project = QgsProject.instance()
+    if not project.read(job["project"]):
+        raise Exception(f"Could not read project copy: {job['project']}")
+
+    # Memory layers are saved without features, so rebuild the grid from the job
+    if job.get("grid_layer_id"):
+        project.removeMapLayer(job["grid_layer_id"])
+
+    grid_layer = run_grid_generation(
+        horizontal_spacing = job["horizontal_spacing"],
+        vertical_spacing = job["vertical_spacing"],
+        horizontal_unit = job["horizontal_unit"],
+        vertical_unit = job["vertical_unit"],
+        crs = job["crs"],
+        extent = job["extent"],
+        interactive = False,
+        virtual = job.get("virtual_grid", False),
+        aoi = job.get("aoi"),
+        aoi_crs = job.get("aoi_crs"),
+        dem_layer = find_dem_layer(job["dem_layer_name"]) if job.get("dem_precheck") else None
+    )
+    if grid_layer is None:
+        raise Exception("Grid generation failed in worker.")
+
+    create_print_layout(
+        project = project,
+        coverage_layer = grid_layer,
+        layout_name = job["layout_name"],
+        page_width_mm = job["page_width_mm"],
+        page_height_mm = job["page_height_mm"],
+        interactive = False
+    )
+
+    def report(fid):
+        print(f"{PROGRESS_PREFIX} {shard_index} {fid}", flush=True)
+
+    def cancel_requested():
+        return bool(job.get("cancel_path")) and os.path.exists(job["cancel_path"])
+
+    run_export(
+        layout_name = job["layout_name"],
+        img_output_folder = job["visual_folder"],
+        elv_output_folder = job["elevation_folder"],
+        dem_layer_name = job["dem_layer_name"],
+        log_path = log_path,
+        render_mode = job.get("render_mode", "atlas"),
+        coverage_layer = grid_layer,
+        page_size_mm = (job["page_width_mm"], job["page_height_mm"]),
+        fid_range = fid_range,
+        log_context = {"shard": shard_index},
+        progress_callback = report,
+        resume = job.get("resume", True),
+        profiler = profiler_from_job(job, job.get("log_path") or log_path, suffix=f"_shard{shard_index}"),
+        settle_ms = job.get("atlas_settle_ms", 200),
+        visual_encoding = job.get("visual_encoding"),
+        elevation_encoding = job.get("elevation_encoding"),
+        should_cancel = cancel_requested,
+        pipeline = job.get("pipeline"),
+        incremental = job.get("incremental", False),
+        dem_mmap = job.get("dem_mmap") or None,
+        dpi = job.get("dpi", DEFAULT_DPI),
+        elevation_grid = job.get("elevation_grid"),
+        elevation_resampling = job.get("elevation_resampling", "bilinear"),
+        visual_layers = job.get("visual_layers"),
+        render_cache = job.get("render_cache", False)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RockyCrop export shard worker")
+    parser.add_argument("--job", required=True)
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--first", type=int, required=True)
+    parser.add_argument("--last", type=int, required=True)
+    parser.add_argument("--log", required=True)
+    args = parser.parse_args(argv)
+
+    with open(args.job, "r") as f:
+        job = json.load(f)
+
+    from .headless import start_qgis, stop_qgis
+    app = start_qgis()
+    try:
+        run_shard(job, args.shard, (args.first, args.last), args.log)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        stop_qgis(app)
+    return 0
+
+
+if __name__ == "__main__":
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, plugin_dir)
+    import headless
+    worker = headless.import_plugin_module(plugin_dir, "export_worker")
+    sys.exit(worker.main())
@@ -0,0 +1,178 @@
+import math
+import os
+import numpy as np
+from osgeo import gdal
+from qgis.core import QgsGeometry, QgsProject, QgsRectangle, QgsVectorLayer
+from .transforms import get_crs, get_transform, transform_bounds
+from .tile_renderer import page_size_pixels, VISUAL_BANDS
+
+# Longest side of the DEM validity mask read for the coverage precheck
+DEM_PRECHECK_SIZE = 4096
+
+# Cells whose DEM windows are transformed together in the precheck
+DEM_PRECHECK_BATCH = 100000
+
+
+def aoi_geometry(aoi, crs, aoi_crs=None, project=None):
+    # One polygon in the grid CRS from a QgsGeometry, a layer, a layer id or name,
+    # a vector file, or WKT. aoi_crs applies to geometries and WKT (default: grid CRS).
+    if aoi is None or aoi == "":
+        return None
+    project = project or QgsProject.instance()
+
+    layer = None
+    if isinstance(aoi, QgsVectorLayer):
+        layer = aoi
+    elif isinstance(aoi, str):
+        layer = project.mapLayer(aoi) or next(iter(project.mapLayersByName(aoi)), None)
+        if layer is None and os.path.exists(aoi):
+            layer = QgsVectorLayer(aoi, "AOI", "ogr")
+            if not layer.isValid():
+                raise ValueError(f"Could not open AOI file: {aoi}")
+
+    if layer is not None:
+        geometry = QgsGeometry.unaryUnion([feature.geometry() for feature in layer.getFeatures()])
+        source_crs = layer.crs()
+    else:
+        geometry = QgsGeometry(aoi) if isinstance(aoi, QgsGeometry) else QgsGeometry.fromWkt(aoi)
+        source_crs = get_crs(aoi_crs) if aoi_crs else get_crs(crs)
+
+    if geometry is None or geometry.isNull() or geometry.isEmpty():
+        raise ValueError("The AOI has no geometry.")
+    if get_crs(source_crs) != get_crs(crs):
+        geometry.transform(get_transform(source_crs, crs))
+    return geometry
+
+
+def cell_bounds(ids, xmin, ymin, h_spacing, v_spacing, rows):
+    # Same cell order as grid generation: id = col * rows + row
+    col = ids // rows
+    row = ids % rows
+    x1 = xmin + col * h_spacing
+    y1 = ymin + row * v_spacing
+    return np.column_stack((x1, y1, x1 + h_spacing, y1 + v_spacing))
+
+
+def aoi_cell_mask(geometry, xmin, ymin, h_spacing, v_spacing, cols, rows):
+    # Cells that overlap the AOI. Blocks of cells over the AOI's bounding box are split in half
+    # until they are outside it or inside it, so only cells along the boundary are tested one by one.
+    keep = np.zeros(cols * rows, dtype=bool)
+    cells = keep.reshape(cols, rows)
+    box = geometry.boundingBox()
+    col_start = max(0, int(math.floor((box.xMinimum() - xmin) / h_spacing)))
+    col_end = min(cols - 1, int(math.floor((box.xMaximum() - xmin) / h_spacing)))
+    row_start = max(0, int(math.floor((box.yMinimum() - ymin) / v_spacing)))
+    row_end = min(rows - 1, int(math.floor((box.yMaximum() - ymin) / v_spacing)))
+    if col_end < col_start or row_end < row_start:
+        return keep
+
+    engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+    engine.prepareGeometry()
+    blocks = [(col_start, col_end + 1, row_start, row_end + 1)]
+    while blocks:
+        col0, col1, row0, row1 = blocks.pop()
+        block = QgsGeometry.fromRect(QgsRectangle(
+            xmin + col0 * h_spacing, ymin + row0 * v_spacing, xmin + col1 * h_spacing, ymin + row1 * v_spacing
+        )).constGet()
+        if not engine.intersects(block):
+            continue
+        if engine.contains(block):
+            cells[col0:col1, row0:row1] = True
+            continue
+        if col1 - col0 == 1 and row1 - row0 == 1:
+            # Cells that only share an edge with the AOI have nothing inside it
+            if not engine.touches(block):
+                cells[col0, row0] = True
+            continue
+        # Split the longer side
+        if col1 - col0 >= row1 - row0:
+            mid = (col0 + col1) // 2
+            blocks += [(col0, mid, row0, row1), (mid, col1, row0, row1)]
+        else:
+            mid = (row0 + row1) // 2
+            blocks += [(col0, col1, row0, mid), (col0, col1, mid, row1)]
+    return keep
+
+
+def dem_cell_mask(dem_layer, xmin, ymin, h_spacing, v_spacing, cols, rows, crs, candidates=None, stats=None):
+    # Cells with at least one valid DEM pixel. The DEM's mask band is read once at reduced
+    # size (averaged, so any valid pixel survives) and summed, so each cell is one lookup.
+    dataset = gdal.Open(dem_layer.source().split("|")[0], gdal.GA_ReadOnly)
+    if dataset is None:
+        raise Exception(f"GDAL could not open DEM source: {dem_layer.source()}")
+    gt = dataset.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0:
+        raise Exception("Rotated DEM geotransforms are not supported by the DEM precheck.")
+
+    scale = max(1.0, max(dataset.RasterXSize, dataset.RasterYSize) / DEM_PRECHECK_SIZE)
+    width = max(1, int(math.ceil(dataset.RasterXSize / scale)))
+    height = max(1, int(math.ceil(dataset.RasterYSize / scale)))
+    valid = dataset.GetRasterBand(1).GetMaskBand().ReadAsArray(
+        0, 0, dataset.RasterXSize, dataset.RasterYSize,
+        buf_xsize=width, buf_ysize=height, resample_alg=gdal.GRIORA_Average
+    ) > 0
+    table = np.zeros((height + 1, width + 1), dtype=np.int64)
+    table[1:, 1:] = valid.cumsum(axis=0).cumsum(axis=1)
+
+    # Size of one pixel of the reduced mask in DEM CRS units
+    pixel_w = gt[1] * dataset.RasterXSize / width
+    pixel_h = gt[5] * dataset.RasterYSize / height
+
+    keep = np.zeros(cols * rows, dtype=bool)
+    ids = np.flatnonzero(candidates) if candidates is not None else np.arange(cols * rows, dtype=np.int64)
+    for start in range(0, len(ids), DEM_PRECHECK_BATCH):
+        batch = ids[start:start + DEM_PRECHECK_BATCH]
+        bounds = transform_bounds(cell_bounds(batch, xmin, ymin, h_spacing, v_spacing, rows), crs, dem_layer.crs())
+        finite = np.isfinite(bounds).all(axis=1)
+        bounds = np.nan_to_num(bounds)
+
+        with np.errstate(invalid="ignore"):
+            x0 = np.clip(np.floor((bounds[:, 0] - gt[0]) / pixel_w), 0, width).astype(np.int64)
+            x1 = np.clip(np.ceil((bounds[:, 2] - gt[0]) / pixel_w), 0, width).astype(np.int64)
+            y0 = np.clip(np.floor((bounds[:, 3] - gt[3]) / pixel_h), 0, height).astype(np.int64)
+            y1 = np.clip(np.ceil((bounds[:, 1] - gt[3]) / pixel_h), 0, height).astype(np.int64)
+        counts = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+        keep[batch] = finite & (x1 > x0) & (y1 > y0) & (counts > 0)
+
+        # Full resolution DEM pixels per cell, for the bytes avoided estimate
+        if stats is not None and start == 0 and finite.any():
+            area = (bounds[finite, 2] - bounds[finite, 0]) * (bounds[finite, 3] - bounds[finite, 1])
+            stats["dem_pixels_per_cell"] = float(np.mean(area) / abs(gt[1] * gt[5]))
+            stats["dem_bytes_per_pixel"] = gdal.GetDataTypeSize(dataset.GetRasterBand(1).DataType) // 8
+
+    dataset = None
+    return keep
+
+
+def filter_cells(xmin, ymin, h_spacing, v_spacing, cols, rows, crs, aoi=None, aoi_crs=None, dem_layer=None, stats=None):
+    # Cells to keep (cell id order), or None when there is nothing to filter
+    if aoi is None and dem_layer is None:
+        return None
+    stats = stats if stats is not None else {}
+    total = cols * rows
+    stats["cells"] = total
+
+    keep = None
+    if aoi is not None:
+        geometry = aoi_geometry(aoi, crs, aoi_crs)
+        keep = aoi_cell_mask(geometry, xmin, ymin, h_spacing, v_spacing, cols, rows)
+        stats["outside_aoi"] = int(total - keep.sum())
+        print(f"AOI: {stats['outside_aoi']:,} of {total:,} cells outside")
+
+    if dem_layer is not None:
+        before = int(keep.sum()) if keep is not None else total
+        keep = dem_cell_mask(dem_layer, xmin, ymin, h_spacing, v_spacing, cols, rows, crs, keep, stats)
+        stats["no_dem_data"] = int(before - keep.sum())
+        print(f"DEM precheck: {stats['no_dem_data']:,} cells without elevation data")
+
+    stats["kept"] = int(keep.sum())
+    stats["skipped"] = total - stats["kept"]
+    return keep
+
+
+def estimate_skipped_bytes(stats, page_width_mm, page_height_mm, dpi=300):
+    # Uncompressed RGB visual plus the DEM window, per tile that won't be exported
+    width, height = page_size_pixels(page_width_mm, page_height_mm, dpi)
+    per_tile = width * height * VISUAL_BANDS
+    per_tile += stats.get("dem_pixels_per_cell", 0) * stats.get("dem_bytes_per_pixel", 0)
+    return int(stats.get("skipped", 0) * per_tile)
@@ -3,20 +3,89 @@ from qgis.core import (
     QgsFeature,
     QgsGeometry,
     QgsPointXY,
-    QgsRectangle,
     QgsFields,
     QgsField,
     QgsProject,
     QgsSimpleFillSymbolLayer,
-    QgsCoordinateReferenceSystem,
-    QgsCoordinateTransform,
     QgsPointXY
 )
+import numpy as np
 from PyQt5.QtCore import QVariant, Qt
 from qgis.PyQt.QtGui import QColor
 from qgis.utils import iface
 from qgis.PyQt.QtWidgets import QMessageBox
-from .plugin_dialog import *
+from .virtual_grid import VirtualGrid
+from .grid_filter import filter_cells
+from .transforms import get_transform
+
+# Cells are built and handed to the provider this many at a time
+GRID_BATCH_SIZE = 50000
+
+# Above this many cells the user is asked to confirm
+GRID_WARNING_FEATURES = 1000000
+
+# Little-endian WKB polygon with one closed 5-point ring
+WKB_POLYGON_DTYPE = np.dtype([
+    ("byte_order", "u1"),
+    ("wkb_type", "<u4"),
+    ("ring_count", "<u4"),
+    ("point_count", "<u4"),
+    ("coords", "<f8", (10,)),
+])
+
+def grid_cell_wkb(xmin, ymin, h_spacing, v_spacing, rows, start, stop):
+    # Cell index i maps to col = i // rows, row = i % rows, same order as the original nested loop
+    index = np.arange(start, stop, dtype=np.int64)
+    col = index // rows
+    row = index % rows
+
+    x1 = xmin + col * h_spacing
+    x2 = x1 + h_spacing
+    y1 = ymin + row * v_spacing
+    y2 = y1 + v_spacing
+
+    cells = np.empty(len(index), dtype=WKB_POLYGON_DTYPE)
+    cells["byte_order"] = 1
+    cells["wkb_type"] = 3
+    cells["ring_count"] = 1
+    cells["point_count"] = 5
+    # Same vertex order as QgsGeometry.fromRect
+    cells["coords"] = np.stack([x1, y1, x1, y2, x2, y2, x2, y1, x1, y1], axis=1)
+
+    buffer = cells.tobytes()
+    size = WKB_POLYGON_DTYPE.itemsize
+    return index, [buffer[offset:offset + size] for offset in range(0, len(buffer), size)]
+
+def build_grid_features(provider, fields, xmin, ymin, h_spacing, v_spacing, cols, rows, batch_size=GRID_BATCH_SIZE, keep=None):
+    total = cols * rows
+    created = 0
+
+    for start in range(0, total, batch_size):
+        stop = min(start + batch_size, total)
+        if keep is not None and not keep[start:stop].any():
+            continue
+        index, wkbs = grid_cell_wkb(xmin, ymin, h_spacing, v_spacing, rows, start, stop)
+
+        # Cells dropped by the AOI or DEM precheck are never added
+        if keep is not None:
+            kept = keep[start:stop]
+            index = index[kept]
+            wkbs = [wkb for wkb, k in zip(wkbs, kept) if k]
+
+        features = []
+        # The id field holds the full-grid cell id, which filtered grids name their tiles from
+        for cell_id, wkb in zip(index.tolist(), wkbs):
+            geom = QgsGeometry()
+            geom.fromWkb(wkb)
+            feat = QgsFeature(fields)
+            feat.setGeometry(geom)
+            feat.setAttributes([cell_id])
+            features.append(feat)
+
+        provider.addFeatures(features)
+        created += len(features)
+
+    return created
 
 def convert_to_meters(value, unit):
     conversions = {
@@ -32,9 +101,7 @@ def convert_to_meters(value, unit):
     return value * conversions.get(unit, 1)
 
 def meters_to_degrees(anchor_point, spacing_m, direction="horizontal", source_crs_code="EPSG:3857"):
-    source_crs = QgsCoordinateReferenceSystem(source_crs_code)
-    target_crs = QgsCoordinateReferenceSystem("EPSG:4326")
-    transformer = QgsCoordinateTransform(source_crs, target_crs, QgsProject.instance())
+    transformer = get_transform(source_crs_code, "EPSG:4326")
 
     if direction == "horizontal":
         shifted = QgsPointXY(anchor_point.x() + spacing_m, anchor_point.y())
@@ -46,7 +113,8 @@ def meters_to_degrees(anchor_point, spacing_m, direction="horizontal", source_cr
 
     return abs(pt2_deg.x() - pt1_deg.x()) if direction == "horizontal" else abs(pt2_deg.y() - pt1_deg.y())
 
-def run_grid_generation(horizontal_spacing, vertical_spacing, horizontal_unit, vertical_unit, crs, extent):
+def run_grid_generation(horizontal_spacing, vertical_spacing, horizontal_unit, vertical_unit, crs, extent, interactive=True, virtual=False,
+                        aoi=None, aoi_crs=None, dem_layer=None, filter_stats=None):
     xmin, ymin, xmax, ymax = extent
 
     is_projected = not crs.startswith("EPSG:4326")
@@ -74,6 +142,22 @@ def run_grid_generation(horizontal_spacing, vertical_spacing, horizontal_unit, v
     rows = int((ymax - ymin) / v_spacing)
     print(f"Grid dimensions: {cols} columns × {rows} rows")
 
+    # --- Keep only cells inside the AOI and with DEM data ---
+    keep = filter_cells(xmin, ymin, h_spacing, v_spacing, cols, rows, crs.strip(),
+                        aoi=aoi, aoi_crs=aoi_crs, dem_layer=dem_layer, stats=filter_stats)
+    if keep is not None:
+        print(f"Keeping {int(keep.sum()):,} of {cols * rows:,} cells")
+        if not keep.any():
+            print("No cells left after the AOI and DEM filters.")
+            return None
+
+    # Cells are derived on demand, so no layer, size warning or feature storage
+    if virtual:
+        print(f"Virtual grid: {cols * rows:,} cells")
+        if keep is not None:
+            return VirtualGrid.masked(xmin, ymin, h_spacing, v_spacing, cols, rows, crs.strip(), keep)
+        return VirtualGrid(xmin, ymin, h_spacing, v_spacing, cols, rows, crs.strip())
+
     layer_uri = "Polygon?crs=" + crs.strip()
     print("Layer URI:", layer_uri)
 
@@ -82,10 +166,13 @@ def run_grid_generation(horizontal_spacing, vertical_spacing, horizontal_unit, v
         print("Layer is invalid! Check CRS or URI formatting.")
         return None
     
-    max_features = 100000
-    estimated_features = cols * rows
+    max_features = GRID_WARNING_FEATURES
+    estimated_features = cols * rows if keep is None else int(keep.sum())
+
+    if estimated_features > max_features and not interactive:
+        print(f"Warning: the grid will generate approximately {estimated_features:,} tiles.")
 
-    if estimated_features > max_features:
+    elif estimated_features > max_features:
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Warning)
         msg.setWindowTitle("Grid Size Warning")
@@ -104,28 +191,9 @@ def run_grid_generation(horizontal_spacing, vertical_spacing, horizontal_unit, v
     provider.addAttributes(fields)
     layer.updateFields()
 
-    features = []
-    fid = 0
-
-    for col in range(cols):
-        for row in range(rows):
-            x1 = xmin + col * h_spacing
-            x2 = x1 + h_spacing
-            y1 = ymin + row * v_spacing
-            y2 = y1 + v_spacing
-
-            rect = QgsRectangle(x1, y1, x2, y2)
-            feat = QgsFeature()
-            feat.setGeometry(QgsGeometry.fromRect(rect))
-            feat.setFields(fields)
-            feat.setAttribute("id", fid)
-            feat.setId(fid)
-            fid += 1
-            features.append(feat)
-
-    provider.addFeatures(features)
+    created = build_grid_features(provider, fields, xmin, ymin, h_spacing, v_spacing, cols, rows, keep=keep)
     layer.updateExtents()
-    print("Created features:", len(features))
+    print("Created features:", created)
 
     try:
         symbol = layer.renderer().symbol()
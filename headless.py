@@ -0,0 +1,75 @@
+import importlib
+import importlib.util
+import os
+import shutil
+import sys
+
+PACKAGE_NAME = "rockycrop"
+
+
+def python_executable():
+    # Inside QGIS sys.executable points at the QGIS binary, not an interpreter
+    exe = sys.executable
+    if os.path.basename(exe).lower().startswith("python"):
+        return exe
+
+    for candidate in (
+        os.path.join(sys.exec_prefix, "python.exe"),
+        os.path.join(sys.exec_prefix, "python3.exe"),
+        os.path.join(sys.exec_prefix, "bin", "python3"),
+    ):
+        if os.path.exists(candidate):
+            return candidate
+
+    return shutil.which("python3") or shutil.which("python") or exe
+
+
+def load_plugin_package(plugin_dir):
+    # Import the plugin folder as a package, whatever the folder happens to be called
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME,
+        os.path.join(plugin_dir, "__init__.py"),
+        submodule_search_locations=[plugin_dir]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def import_plugin_module(plugin_dir, name):
+    load_plugin_package(plugin_dir)
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
+
+
+def start_qgis():
+    # Offscreen platform so rendering works without a display
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from qgis.core import QgsApplication
+
+    prefix = os.environ.get("QGIS_PREFIX_PATH")
+    if prefix:
+        QgsApplication.setPrefixPath(prefix, True)
+
+    app = QgsApplication([], True)
+    app.initQgis()
+
+    # Processing lives in the core plugins folder, which isn't on sys.path outside QGIS
+    plugins_path = os.path.join(QgsApplication.pkgDataPath(), "python", "plugins")
+    if plugins_path not in sys.path:
+        sys.path.append(plugins_path)
+
+    from processing.core.Processing import Processing
+    from qgis.analysis import QgsNativeAlgorithms
+    Processing.initialize()
+    QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+
+    return app
+
+
+def stop_qgis(app):
+    app.exitQgis()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+
+MANIFEST_NAME = "rockycrop_manifest.sqlite"
+
+STATUS_COMPLETE = "complete"
+STATUS_FAILED_VISUAL = "failed_visual"
+STATUS_FAILED_ELEVATION = "failed_elevation"
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extent_list(extent):
+    return [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
+
+
+def same_extent(recorded, extent):
+    return all(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6) for a, b in zip(recorded, extent_list(extent)))
+
+
+class ExportManifest:
+    # Durable per-tile record of an export, so a re-run can skip finished tiles.
+    # Outputs are checked by size and mtime; SHA-256 checksums are only written and compared
+    # when checksums is set (incremental runs, which copy outputs between cells).
+
+    def __init__(self, path, checksums=False):
+        self.path = path
+        self.checksums = checksums
+        # Shard workers share one manifest, so wait on locks instead of failing
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS tiles (
+                fid INTEGER PRIMARY KEY,
+                extent TEXT,
+                visual_path TEXT,
+                visual_size INTEGER,
+                visual_sha256 TEXT,
+                elevation_path TEXT,
+                elevation_size INTEGER,
+                elevation_sha256 TEXT,
+                status TEXT,
+                updated REAL,
+                dem_extent TEXT,
+                visual_inputs TEXT,
+                elevation_inputs TEXT,
+                settings TEXT,
+                visual_mtime REAL,
+                elevation_mtime REAL
+            )"""
+        )
+        # Manifests from earlier versions lack the DEM extent the Blender importer places tiles with,
+        # the input fingerprints incremental runs compare, and the settings and mtimes resume compares
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(tiles)")]
+        for column, column_type in (("dem_extent", "TEXT"), ("visual_inputs", "TEXT"), ("elevation_inputs", "TEXT"),
+                                    ("settings", "TEXT"), ("visual_mtime", "REAL"), ("elevation_mtime", "REAL")):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE tiles ADD COLUMN {column} {column_type}")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tiles_visual_inputs ON tiles (visual_inputs)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tiles_elevation_inputs ON tiles (elevation_inputs)")
+        # Run-wide values the Blender importer reads, such as the CRS the tiles were rendered in
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Input file checksums, so a large DEM is only hashed again when it changes on disk
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT)"
+        )
+        self.connection.commit()
+
+    @classmethod
+    def for_output(cls, img_output_folder, manifest_path=None, checksums=False):
+        return cls(manifest_path or os.path.join(img_output_folder, MANIFEST_NAME), checksums)
+
+    def get(self, fid):
+        cursor = self.connection.execute(
+            "SELECT extent, visual_path, visual_size, visual_sha256, visual_mtime, elevation_path, elevation_size, "
+            "elevation_sha256, elevation_mtime, status, settings FROM tiles WHERE fid = ?", (fid,)
+        )
+        return cursor.fetchone()
+
+    def _file_ok(self, path, size, mtime, checksum):
+        if not path or not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+        if checksum and (self.checksums or mtime is None):
+            return file_checksum(path) == checksum
+        return mtime is not None and os.path.getmtime(path) == mtime
+
+    def is_complete(self, fid, extent, visual_path, elevation_path, settings=None):
+        # Complete means: same cell, same export settings, same outputs, and both files
+        # still match what was written
+        row = self.get(fid)
+        if row is None or row[9] != STATUS_COMPLETE:
+            return False
+
+        (recorded_extent, rec_visual, visual_size, visual_sha, visual_mtime,
+         rec_elevation, elevation_size, elevation_sha, elevation_mtime, _, recorded_settings) = row
+        if recorded_settings != settings:
+            return False
+        if not same_extent(json.loads(recorded_extent), extent):
+            return False
+        if os.path.normpath(rec_visual) != os.path.normpath(visual_path):
+            return False
+        if os.path.normpath(rec_elevation) != os.path.normpath(elevation_path):
+            return False
+
+        return (self._file_ok(rec_visual, visual_size, visual_mtime, visual_sha)
+                and self._file_ok(rec_elevation, elevation_size, elevation_mtime, elevation_sha))
+
+    def settings_changed(self, settings):
+        # Finished tiles written with other export settings, which resume will redo
+        cursor = self.connection.execute(
+            "SELECT COUNT(*) FROM tiles WHERE status = ? AND settings IS NOT ?", (STATUS_COMPLETE, settings)
+        )
+        return cursor.fetchone()[0]
+
+    def reusable(self, fid, kind, inputs, can_copy=None):
+        # (fid, path) of a finished "visual" or "elevation" output made from the same inputs.
+        # The tile's own row comes first; other cells only if can_copy(fid) allows them.
+        statuses = (STATUS_COMPLETE, STATUS_FAILED_ELEVATION) if kind == "visual" else (STATUS_COMPLETE,)
+        cursor = self.connection.execute(
+            f"SELECT fid, {kind}_path, {kind}_size, {kind}_mtime, {kind}_sha256, status FROM tiles "
+            f"WHERE {kind}_inputs = ? ORDER BY fid = ? DESC", (inputs, fid)
+        )
+        for row_fid, path, size, mtime, checksum, status in cursor.fetchall():
+            if status not in statuses:
+                continue
+            if row_fid != fid and not (can_copy and can_copy(row_fid)):
+                continue
+            if self._file_ok(path, size, mtime, checksum):
+                return row_fid, path
+        return None
+
+    def source_checksum(self, path):
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        row = self.connection.execute(
+            "SELECT size, mtime, sha256 FROM sources WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        if row and row[0] == size and row[1] == mtime:
+            return row[2]
+
+        print(f"Checksumming {path}...")
+        checksum = file_checksum(path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sources (path, size, mtime, sha256) VALUES (?, ?, ?, ?)",
+            (os.path.abspath(path), size, mtime, checksum)
+        )
+        self.connection.commit()
+        return checksum
+
+    def record(self, fid, extent, visual_path, elevation_path, status, dem_extent=None,
+               visual_inputs=None, elevation_inputs=None, settings=None):
+        def describe(path):
+            if path and os.path.exists(path):
+                return os.path.getsize(path), os.path.getmtime(path), file_checksum(path) if self.checksums else None
+            return None, None, None
+
+        visual_size, visual_mtime, visual_sha = describe(visual_path)
+        elevation_size, elevation_mtime, elevation_sha = describe(elevation_path)
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tiles (fid, extent, visual_path, visual_size, visual_sha256, elevation_path, "
+            "elevation_size, elevation_sha256, status, updated, dem_extent, visual_inputs, elevation_inputs, "
+            "settings, visual_mtime, elevation_mtime) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (fid, json.dumps(extent_list(extent)), visual_path, visual_size, visual_sha,
+             elevation_path, elevation_size, elevation_sha, status, time.time(),
+             json.dumps(dem_extent) if dem_extent else None, visual_inputs, elevation_inputs,
+             settings, visual_mtime, elevation_mtime)
+        )
+        self.connection.commit()
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self.connection.commit()
+
+    def counts(self):
+        cursor = self.connection.execute("SELECT status, COUNT(*) FROM tiles GROUP BY status")
+        return dict(cursor.fetchall())
+
+    def close(self):
+        self.connection.close()
@@ -1,17 +1,311 @@
 from qgis.core import *
 from qgis.PyQt.QtWidgets import QApplication
 import os
-import processing
+import shutil
+import time
 import traceback
-from .plugin_dialog import *
+from .dem_clip import DemClipper, MappedDem, ClipTimer, clip_with_processing, DEM_BUFFER
+from .tile_renderer import DirectTileRenderer, image_to_rgba, write_rgba_geotiff, export_layers
+from .virtual_grid import VirtualGrid, coverage_cells, fid_range_expression, cell_id_index, feature_fid
+from .manifest import ExportManifest, extent_list, STATUS_COMPLETE, STATUS_FAILED_VISUAL, STATUS_FAILED_ELEVATION
+from .run_logger import RunLogger, TileRecord, format_summary
+from .mosaic_export import export_mosaic
+from .render_cache import RegionCache
+from .pipelined_export import TilePipeline, pipeline_options
+from .raster_encoding import RasterEncoding
+from .tile_inputs import TileInputs, export_settings
+from .visual_sizing import DEFAULT_DPI, add_pixel_savings
+from .transforms import get_transform, transform_bounds, rectangles_to_bounds, bounds_to_rectangles
 from qgis.PyQt.QtCore import QEventLoop, QTimer
-        
+from itertools import islice
+from functools import partial
+
+# Tiles whose DEM windows are transformed together in the direct export loop
+DEM_WINDOW_BATCH = 1024
+
 def delay(ms):
     loop = QEventLoop()
     QTimer.singleShot(ms, loop.quit)
     loop.exec_()
 
-def run_export(layout_name, img_output_folder, elv_output_folder, dem_layer_name, log_path):
+def find_dem_layer(dem_layer_name):
+    # Find DEM layer - more flexible approach
+    for layer in QgsProject.instance().mapLayers().values():
+        if isinstance(layer, QgsRasterLayer) and dem_layer_name in layer.name():
+            return layer
+
+    raise Exception(f"No suitable DEM layer found (looking for name containing '{dem_layer_name}').")
+
+class ExportSession:
+    # Per-run state shared by the atlas and direct export loops
+
+    def __init__(self, img_output_folder, elv_output_folder, dem_layer, logger,
+                 clipper=None, clip_timer=None, manifest=None, progress_callback=None, profiler=None,
+                 visual_encoding=None, elevation_encoding=None, should_cancel=None):
+        self.img_output_folder = img_output_folder
+        self.elv_output_folder = elv_output_folder
+        self.dem_layer = dem_layer
+        self.logger = logger
+        self.clipper = clipper
+        self.clip_timer = clip_timer
+        self.manifest = manifest
+        self.progress_callback = progress_callback
+        self.profiler = profiler
+        self.visual_encoding = visual_encoding or RasterEncoding()
+        self.elevation_encoding = elevation_encoding or RasterEncoding()
+        self.should_cancel = should_cancel
+        self.dpi = DEFAULT_DPI
+        # Fixed size x size elevation grid, or None for the DEM's native pixels
+        self.elevation_grid = None
+        self.elevation_resampling = "bilinear"
+        self.was_cancelled = False
+        self.pipeline = None
+        self.skipped = 0
+        # Input fingerprints recorded with every tile; incremental runs compare them
+        self.inputs = None
+        # Digest of the run settings, resume only skips tiles written with the same ones
+        self.settings = None
+        self.incremental = False
+        self.fid_range = None
+        # Tiles this run has started replacing, their old outputs can't be copied elsewhere
+        self.touched = set()
+
+    def log(self, message):
+        self.logger.message(message)
+
+    def cancelled(self):
+        # Checked between tiles, so a cancel always lets the current tile finish
+        if not self.was_cancelled and self.should_cancel and self.should_cancel():
+            self.was_cancelled = True
+            print("Export cancelled")
+            self.logger.event("cancelled")
+        return self.was_cancelled
+
+    def visual_path(self, fid):
+        return os.path.join(self.img_output_folder, f"map_{fid}_visual.tif")
+
+    def elevation_path(self, fid):
+        return os.path.join(self.elv_output_folder, f"map_{fid}_elevation.tif")
+
+    def begin_tile(self, record):
+        if self.profiler:
+            self.profiler.begin_tile(record)
+
+    def is_exported(self, fid, extent):
+        if not self.manifest:
+            return False
+        return self.manifest.is_complete(fid, extent, self.visual_path(fid), self.elevation_path(fid), self.settings)
+
+    def already_exported(self, record, extent):
+        if not self.is_exported(record.fid, extent):
+            return False
+        self.skip_tile(record)
+        return True
+
+    def skip_tile(self, record):
+        fid = record.fid
+        print(f"Tile {fid} already exported, skipping")
+        self.skipped += 1
+        if self.profiler:
+            self.profiler.end_tile(record)
+        self.logger.tile(record, "skipped")
+        if self.progress_callback:
+            self.progress_callback(fid)
+
+    def finish_tile(self, record, extent, status):
+        fid = record.fid
+        visual_path = self.visual_path(fid)
+        dem_output_path = self.elevation_path(fid) if status != STATUS_FAILED_VISUAL else None
+
+        # Reused outputs weren't written by this run
+        reused = record.extra.get("reused", ())
+        for kind, path in (("visual", visual_path), ("elevation", dem_output_path)):
+            if path and os.path.exists(path) and kind not in reused:
+                size = os.path.getsize(path)
+                record.bytes_written += size
+                record.extra[f"{kind}_bytes"] = size
+
+        if extent is not None:
+            record.extra["extent"] = extent_list(extent)
+        if self.profiler:
+            self.profiler.end_tile(record)
+        self.logger.tile(record, status)
+
+        if self.manifest and extent is not None:
+            tile_dem_extent = record.extra.get("tile_dem_extent")
+            visual_inputs = elevation_inputs = None
+            if self.inputs:
+                visual_inputs = self.inputs.visual(extent)
+                elevation_inputs = self.inputs.elevation(tile_dem_extent) if tile_dem_extent else None
+            self.manifest.record(fid, extent, visual_path, dem_output_path, status, tile_dem_extent,
+                                 visual_inputs, elevation_inputs, self.settings)
+
+        if self.progress_callback:
+            self.progress_callback(fid)
+
+    def can_copy_from(self, fid):
+        # Shards only copy within their own range, other workers may be rewriting the rest
+        if fid in self.touched:
+            return False
+        return self.fid_range is None or self.fid_range[0] <= fid <= self.fid_range[1]
+
+    def plan_tile(self, record, extent, extent_crs, dem_extent=None, resume=True):
+        # What the tile still needs as (render, clip, dem_extent), or None when it is done.
+        # Incremental runs compare recorded inputs per output: unchanged outputs are kept,
+        # or copied from the cell that made them when the grid has shifted.
+        if not self.incremental:
+            if resume and self.already_exported(record, extent):
+                return None
+            return True, True, dem_extent
+
+        if dem_extent is None:
+            try:
+                dem_extent = self.dem_extent(record, extent, extent_crs)
+            except Exception:
+                # The clip reports the transform error
+                return True, True, None
+        record.extra["tile_dem_extent"] = extent_list(dem_extent)
+        self.touched.add(record.fid)
+
+        reused = []
+        outputs = (
+            ("visual", self.inputs.visual(extent), self.visual_path(record.fid)),
+            ("elevation", self.inputs.elevation(record.extra["tile_dem_extent"]), self.elevation_path(record.fid)),
+        )
+        for kind, inputs, path in outputs:
+            found = self.manifest.reusable(record.fid, kind, inputs, self.can_copy_from)
+            if found is None:
+                continue
+            source_fid, source_path = found
+            if os.path.normpath(source_path) != os.path.normpath(path):
+                try:
+                    with record.stage("reuse"):
+                        shutil.copyfile(source_path, path)
+                except OSError as err:
+                    print(f"Could not copy {kind} of tile {source_fid} to tile {record.fid}: {err}")
+                    continue
+                record.extra["reused_from"] = source_fid
+            reused.append(kind)
+
+        if reused:
+            record.extra["reused"] = reused
+        render, clip = "visual" not in reused, "elevation" not in reused
+        if render or clip:
+            return render, clip, dem_extent
+
+        # Nothing changed; copied tiles are recorded under their new fid
+        if "reused_from" in record.extra:
+            self.finish_tile(record, extent, STATUS_COMPLETE)
+        else:
+            self.skip_tile(record)
+        return None
+
+    def visual_failed(self, record, extent, error_msg):
+        print(f"{error_msg}")
+        record.error(error_msg)
+        self.finish_tile(record, extent, STATUS_FAILED_VISUAL)
+
+    def dem_extents(self, extents, extent_crs):
+        # Tile extents -> DEM CRS in one batched call
+        bounds = transform_bounds(rectangles_to_bounds(extents), extent_crs, self.dem_layer.crs())
+        return bounds_to_rectangles(bounds)
+
+    def dem_extent(self, record, extent, extent_crs):
+        with record.stage("transform"):
+            xform = get_transform(extent_crs, self.dem_layer.crs())
+            return xform.transformBoundingBox(extent)
+
+    def deliver(self, record, extent, extent_crs, dem_extent=None, write_visual=None, write_stage="write", clip=True):
+        # Writes the rendered visual and clips the DEM, inline or through the stage pipeline
+        if self.pipeline:
+            # Transforms stay on this thread, the pipeline stages only do GDAL and disk work
+            if clip and dem_extent is None:
+                try:
+                    dem_extent = self.dem_extent(record, extent, extent_crs)
+                except Exception as err:
+                    record.error(f"Failed to transform extent for tile {record.fid}: {err}")
+                    self.finish_tile(record, extent, STATUS_FAILED_ELEVATION)
+                    return
+            self.pipeline.submit(record, extent, dem_extent, write_visual, write_stage, clip)
+            self.pipeline.poll()
+            return
+
+        if write_visual:
+            try:
+                with record.stage(write_stage):
+                    write_visual()
+            except Exception as err:
+                self.visual_failed(record, extent, f"Failed to export visual for tile {record.fid}: {err}")
+                return
+
+        if clip:
+            self.export_elevation(record, extent, extent_crs, dem_extent)
+        else:
+            self.finish_tile(record, extent, STATUS_COMPLETE)
+
+    def flush(self):
+        # Waits for every tile handed to the pipeline, e.g. before a shared buffer is reused
+        if self.pipeline:
+            self.pipeline.wait()
+
+    def export_elevation(self, record, extent, extent_crs, dem_extent=None):
+        success = self.clip_elevation(record, extent, extent_crs, dem_extent)
+        self.finish_tile(record, extent, STATUS_COMPLETE if success else STATUS_FAILED_ELEVATION)
+        return success
+
+    def clip_elevation(self, record, extent, extent_crs, dem_extent=None, clipper=None):
+        fid = record.fid
+        dem_output_path = self.elevation_path(fid)
+        clipper = clipper or self.clipper
+
+        success = False
+        try:
+            # --- Reproject extent from layout CRS to DEM CRS, unless precomputed ---
+            if dem_extent is not None:
+                reprojected_extent = dem_extent
+            else:
+                reprojected_extent = self.dem_extent(record, extent, extent_crs)
+
+            # Add small buffer to ensure we capture all elevation data
+            buffered_extent = reprojected_extent.buffered(DEM_BUFFER)
+            record.extra["dem_extent"] = extent_list(buffered_extent)
+            record.extra["tile_dem_extent"] = extent_list(reprojected_extent)
+
+            # --- Clip DEM to tile extent ---
+            with record.stage("clip"):
+                if clipper and self.elevation_grid:
+                    # Samples sit on the tile edges, so no buffer is needed
+                    record.extra["dem_extent"] = extent_list(reprojected_extent)
+                    clipper.clip_resampled(reprojected_extent, dem_output_path, self.elevation_grid,
+                                           self.elevation_resampling, self.elevation_encoding)
+                elif clipper:
+                    clipper.clip(buffered_extent, dem_output_path, self.elevation_encoding)
+                else:
+                    clip_with_processing(self.dem_layer, buffered_extent, dem_output_path, self.elevation_encoding)
+
+            if self.clip_timer:
+                self.clip_timer.record_windowed(record.stages_ms["clip"])
+                record.extra["processing_clip_ms"] = round(self.clip_timer.time_processing(buffered_extent), 2)
+
+            print(f"Tile {fid} exported: visual + elevation")
+            success = True
+
+        except Exception as err:
+            # Full traceback goes to the console only, the log keeps the message
+            error_msg = f"Failed to process elevation for tile {fid}: {str(err)}"
+            print(f"{error_msg}\n{traceback.format_exc()}")
+            record.error(error_msg)
+
+        return success
+
+def run_export(layout_name, img_output_folder, elv_output_folder, dem_layer_name, log_path,
+               clip_engine="windowed", compare_clip_timing=False,
+               render_mode="atlas", coverage_layer=None, page_size_mm=None,
+               fid_range=None, progress_callback=None,
+               resume=True, manifest_path=None, log_context=None, profiler=None, settle_ms=200,
+               visual_encoding=None, elevation_encoding=None, should_cancel=None, pipeline=None,
+               incremental=False, dem_mmap=None, dpi=DEFAULT_DPI, elevation_grid=None,
+               elevation_resampling="bilinear", visual_layers=None, render_cache=False):
 
     # === CONFIGURATION ===
     layout_name = layout_name
@@ -24,148 +318,291 @@ def run_export(layout_name, img_output_folder, elv_output_folder, dem_layer_name
     project = QgsProject.instance()
     layout = project.layoutManager().layoutByName(layout_name)
 
-    if layout is None:
+    # The direct and mosaic renderers only need the layout if coverage/page size aren't given
+    if render_mode == "atlas" and isinstance(coverage_layer, VirtualGrid):
+        raise Exception("Atlas render mode needs a grid layer, use the direct renderer for virtual grids.")
+    if layout is None and (render_mode == "atlas" or coverage_layer is None or page_size_mm is None):
         raise Exception("Layout not found. Check the layout name.")
 
-    atlas = layout.atlas()
-    exporter = QgsLayoutExporter(layout)
-    coverage_layer = atlas.coverageLayer()
-    map_item = layout.referenceMap()
-
     # Ensure output folders exist
     os.makedirs(img_output_folder, exist_ok=True)
     os.makedirs(elv_output_folder, exist_ok=True)
 
-    # Find DEM layer - more flexible approach
-    dem_layer = None
-    for layer in QgsProject.instance().mapLayers().values():
-        if isinstance(layer, QgsRasterLayer) and dem_layer_name in layer.name():
-            dem_layer = layer
-            break
+    dem_layer = find_dem_layer(dem_layer_name)
 
-    if not dem_layer:
-        raise Exception(f"No suitable DEM layer found (looking for name containing '{dem_layer_name}').")
+    # Raise on bad encoding settings before anything is written
+    visual_encoding = RasterEncoding.from_config(visual_encoding)
+    elevation_encoding = RasterEncoding.from_config(elevation_encoding)
+    pipeline = pipeline_options(pipeline)
 
     # Start log
-    with open(log_path, "a") as log:
-        log.write("=== Starting export session ===\n")
-        log.write(f"DEM layer found: {dem_layer.name()}\n")
-    
+    logger = RunLogger(log_path, context=log_context)
+    logger.event("start", dem_layer=dem_layer.name(), render_mode=render_mode,
+                 visual_folder=img_output_folder, elevation_folder=elv_output_folder,
+                 visual_encoding=visual_encoding.describe(), elevation_encoding=elevation_encoding.describe())
+
+    # Open the DEM once for the whole session; fall back to Processing if GDAL can't read it
+    clipper = None
+    if clip_engine == "windowed" and dem_mmap:
+        # A DEM decoded beforehand by build_mapped_dem, shared with the other workers
+        try:
+            clipper = MappedDem(dem_mmap)
+            logger.message(f"Clipping from mapped DEM {dem_mmap}")
+        except Exception as err:
+            print(f"Mapped DEM unavailable, reading the DEM with GDAL: {err}")
+            logger.message(f"Mapped DEM unavailable, reading the DEM with GDAL: {err}")
+    if clip_engine == "windowed" and clipper is None:
+        try:
+            clipper = DemClipper.from_layer(dem_layer)
+        except Exception as err:
+            print(f"Windowed DEM clipper unavailable, using Processing: {err}")
+            logger.message(f"Windowed DEM clipper unavailable, using Processing: {err}")
+
+    # The Processing fallback and the clip timing comparison only run sequentially
+    if pipeline and clipper is None:
+        print("Pipelined export needs the windowed DEM clipper, exporting sequentially")
+        logger.message("Pipelined export needs the windowed DEM clipper, exporting sequentially")
+        pipeline = None
+
+    # The resampled grid needs a GDAL handle on the DEM
+    if elevation_grid and clipper is None:
+        print("Fixed elevation grid needs the windowed DEM clipper, clipping at native resolution")
+        logger.message("Fixed elevation grid needs the windowed DEM clipper, clipping at native resolution")
+        elevation_grid = None
+
+    clip_timer = ClipTimer(dem_layer) if compare_clip_timing and clipper and not pipeline else None
+
+    # The manifest is always written; resume only controls whether finished tiles are skipped
+    # Only incremental runs copy outputs between cells, so only they need content checksums
+    manifest = ExportManifest.for_output(img_output_folder, manifest_path, checksums=incremental)
+
+    session = ExportSession(
+        img_output_folder, elv_output_folder, dem_layer, logger,
+        clipper=clipper, clip_timer=clip_timer, manifest=manifest, progress_callback=progress_callback,
+        profiler=profiler, visual_encoding=visual_encoding, elevation_encoding=elevation_encoding,
+        should_cancel=should_cancel
+    )
+    if pipeline:
+        session.pipeline = TilePipeline(session, **pipeline)
+        logger.message(f"Pipelined export: {session.pipeline.describe()}")
+
+    # === INPUT FINGERPRINTS ===
+    # The atlas always uses the layout page; the other modes only when no page size is given
+    if render_mode == "atlas" or page_size_mm is None:
+        page_size = layout.pageCollection().pages()[0].pageSize()
+        page_size_mm = (page_size.width(), page_size.height())
+    # Every renderer draws the same explicit layer set; the grid overlay is never part of it
+    grid_layer = coverage_layer if coverage_layer is not None else layout.atlas().coverageLayer()
+    session.visual_layers = export_layers(project, grid_layer, visual_layers)
+    session.render_cache = render_cache
+    session.dpi = dpi
+    session.elevation_grid = elevation_grid
+    session.elevation_resampling = elevation_resampling
+    session.incremental = incremental
+    session.fid_range = fid_range
+    # Extents and GeoTIFFs are in the render CRS, which the Blender importer scales by
+    render_crs = layout.referenceMap().crs() if render_mode == "atlas" else project.crs()
+    manifest.set_meta("render_crs", render_crs.authid())
+    session.settings = export_settings(dem_layer, session.visual_layers, dpi, page_size_mm, render_mode,
+                                       visual_encoding, elevation_encoding, elevation_grid, elevation_resampling)
+    if resume and not incremental:
+        changed = manifest.settings_changed(session.settings)
+        if changed:
+            print(f"Export settings changed since {changed} finished tiles were written, they will be exported again")
+            logger.message(f"Export settings changed since {changed} finished tiles were written, they will be exported again")
+    if incremental:
+        # Only incremental runs pay for fingerprints, the DEM checksum reads the whole file
+        session.inputs = TileInputs(manifest, dem_layer, session.visual_layers, dpi, page_size_mm, render_mode,
+                                    visual_encoding, elevation_encoding, elevation_grid, elevation_resampling)
+        logger.message("Incremental export: only tiles with changed inputs are redone")
+
+    try:
+        if render_mode == "direct":
+            export_direct(session, project, layout, coverage_layer, page_size_mm, fid_range, resume)
+        elif render_mode == "mosaic":
+            export_mosaic(session, project, layout, coverage_layer, page_size_mm, fid_range, resume)
+        else:
+            export_atlas(session, layout, fid_range, resume, settle_ms)
+    finally:
+        # Tiles still in the pipeline are finished before the manifest and DEM close
+        if session.pipeline:
+            session.pipeline.close()
+
+        if session.skipped:
+            print(f"Skipped {session.skipped} tiles already in the manifest")
+
+        manifest.close()
+        if clipper:
+            clipper.close()
+        if clip_timer:
+            print(clip_timer.summary())
+            logger.message(clip_timer.summary())
+
+        summary = logger.close()
+        if session.was_cancelled:
+            summary["cancelled"] = True
+        add_pixel_savings(summary, page_size_mm[0], page_size_mm[1], dpi)
+        print(format_summary(summary))
+
+        if profiler:
+            profiler.close()
+            profiler.write_report(summary, logger.tiles)
+
+    return summary
+
+def export_direct(session, project, layout, coverage_layer, page_size_mm, fid_range=None, resume=False):
+    if coverage_layer is None:
+        coverage_layer = layout.atlas().coverageLayer()
+    if page_size_mm is None:
+        page_size = layout.pageCollection().pages()[0].pageSize()
+        page_size_mm = (page_size.width(), page_size.height())
+
+    renderer = DirectTileRenderer(project, coverage_layer.crs(), page_size_mm[0], page_size_mm[1], dpi=session.dpi,
+                                  layers=session.visual_layers)
+
+    # Static layers rendered once per block of neighbouring cells, when the grid allows it
+    cache = None
+    if session.render_cache:
+        try:
+            cache = RegionCache.for_renderer(renderer, coverage_layer)
+            session.logger.message(f"Render cache: {cache.describe()}")
+        except Exception as err:
+            print(f"Render cache unavailable, rendering every layer per tile: {err}")
+            session.logger.message(f"Render cache unavailable, rendering every layer per tile: {err}")
+
+    # === MAIN LOOP ===
+    cells = coverage_cells(coverage_layer, fid_range)
+    feature_number = 0
+    while True:
+        batch = list(islice(cells, DEM_WINDOW_BATCH))
+        if not batch or session.cancelled():
+            break
+
+        # --- Visible extents and DEM windows for the whole batch, before rendering ---
+        extents = [renderer.visible_extent(bbox) for fid, bbox in batch]
+        dem_extents = session.dem_extents(extents, renderer.dest_crs)
+        work_items = list(zip(batch, extents, dem_extents))
+        if cache:
+            # Region by region, so each region image is rendered once per batch
+            work_items.sort(key=lambda item: cache.region_of(item[1]))
+
+        for (fid, bbox), extent, dem_extent in work_items:
+            if session.cancelled():
+                break
+            print(feature_number)
+            feature_number += 1
+            record = TileRecord(fid)
+            session.begin_tile(record)
+
+            work = session.plan_tile(record, extent, renderer.dest_crs, dem_extent, resume)
+            if work is None:
+                continue
+            render, clip, dem_extent = work
+
+            # --- Render visual map ---
+            write_visual = None
+            if render:
+                try:
+                    with record.stage("render"):
+                        if cache:
+                            image, rendered = cache.render(extent)
+                            record.extra["render_cache"] = "miss" if rendered else "hit"
+                        else:
+                            image, extent = renderer.render(renderer.cell_extent(bbox))
+                    with record.stage("encode"):
+                        rgba = image_to_rgba(image)
+                except Exception as err:
+                    session.visual_failed(record, extent, f"Failed to export visual for tile {fid}: {err}")
+                    continue
+                write_visual = partial(write_rgba_geotiff, *rgba, extent, renderer.dest_crs,
+                                       session.visual_path(fid), session.visual_encoding)
+
+            # --- Write visual and clip DEM, on the pipeline threads when enabled ---
+            session.deliver(record, extent, renderer.dest_crs, dem_extent, write_visual, clip=clip)
+
+def export_atlas(session, layout, fid_range=None, resume=False, settle_ms=200):
+    atlas = layout.atlas()
+    if fid_range:
+        atlas.setFilterFeatures(True)
+        atlas.setFilterExpression(fid_range_expression(fid_range, atlas.coverageLayer()))
+
+    exporter = QgsLayoutExporter(layout)
+    id_index = cell_id_index(atlas.coverageLayer())
+    map_item = layout.referenceMap()
+
     QApplication.processEvents()
-    
+
     # === MAIN LOOP ===
-    delay(200)
+    # The settle delay gives online basemaps time to load; prefetched basemaps don't need it
+    delay(settle_ms)
     atlas.beginRender()
-    atlas.seekTo(-1)
-    QApplication.processEvents()
-    layout.refresh()
-    
-    retry_count = 0
-    max_retries = 5
-    
-    for feature_number in range(atlas.count()):
-        delay(200)
-        print(feature_number)
-        atlas.seekTo(feature_number)
+
+    # Lock the map to the export layer set for the run, then give the layout back as it was
+    previous_layers = (map_item.keepLayerSet(), map_item.layers())
+    map_item.setLayers(session.visual_layers)
+    map_item.setKeepLayerSet(True)
+    try:
+        atlas.seekTo(-1)
         QApplication.processEvents()
         layout.refresh()
-        
-        # Get current feature - more robust approach
-        coverage_layer = atlas.coverageLayer()
-        feature = coverage_layer.getFeature(atlas.currentFeatureNumber())            
-        fid = feature.id()
-        
-        if fid == -9223372036854775808:
-            fid = feature_number
-        
-        if not feature.isValid():
+
+        for feature_number in range(atlas.count()):
+            if session.cancelled():
+                break
+            seek_start = time.perf_counter()
+            delay(settle_ms)
+            print(feature_number)
+            atlas.seekTo(feature_number)
+            QApplication.processEvents()
+            layout.refresh()
+
+            # The atlas position restarts at 0 in every shard, the feature id doesn't
+            feature = layout.reportContext().feature()
+            if not feature.isValid():
+                print(f"Atlas feature {feature_number} is not valid, skipped")
+                session.log(f"Atlas feature {feature_number} is not valid, skipped")
+                atlas.next()
+                continue
+            fid = feature_fid(feature, id_index)
             error_msg = f"Failed to export visual for tile {fid}"
-            print(f"Feature {feature_number} invalid. Retrying... ({retry_count + 1}/{max_retries})")
-            retry_count += 1
-            delay(500)  # Give it more time to settle
-            with open(log_path, "a") as log:
-                log.write(f"{error_msg}\n")
-        else:
-            success = True
 
-        # --- Export visual map ---
-        visual_path = os.path.join(img_output_folder, f"map_{fid}_visual.tif")
-        settings = QgsLayoutExporter.ImageExportSettings()
-        settings.dpi = 300
-        settings.exportGeoTIFF = True
-        result = exporter.exportToImage(visual_path, settings)
-        
-        if result != QgsLayoutExporter.Success:
-            
-            print(f"{error_msg}")
-            with open(log_path, "a") as log:
-                log.write(f"{error_msg}\n")
-            continue
-
-        # --- Get extent of current tile ---
-        extent = map_item.extent()
-        dem_output_path = os.path.join(elv_output_folder, f"map_{fid}_elevation.tif")
-
-        # --- Reproject extent from layout CRS to DEM CRS ---
-        layout_crs = map_item.crs()
-        dem_crs = dem_layer.crs()
-        transform_context = QgsProject.instance().transformContext()
-        xform = QgsCoordinateTransform(layout_crs, dem_crs, transform_context)
-        
-        try:
-            reprojected_extent = xform.transformBoundingBox(extent)
-            
-            # Add small buffer to ensure we capture all elevation data
-            buffered_extent = reprojected_extent.buffered(0.0002)  # ~20 meters at equator
-            
-            # --- Clip DEM to tile extent ---
-            processing_params = {
-                'INPUT': dem_layer,
-                'PROJWIN': [
-                    buffered_extent.xMinimum(),
-                    buffered_extent.xMaximum(),
-                    buffered_extent.yMinimum(),
-                    buffered_extent.yMaximum()
-                ],
-                'NODATA': -9999,
-                'OUTPUT': dem_output_path
-            }
-            
-            # Try GDAL clip first, fall back to native QGIS clip if needed
-            try:
-                processing.run("gdal:cliprasterbyextent", processing_params)
-            except Exception as gdal_err:
-                print(f"GDAL clip failed, trying native clip: {gdal_err}")
-                processing.run("gdal:warpreproject", {
-                    'INPUT': dem_layer,
-                    'SOURCE_CRS': dem_crs,
-                    'TARGET_CRS': dem_crs,
-                    'RESAMPLING': 0,
-                    'NODATA': -9999,
-                    'TARGET_RESOLUTION': dem_layer.rasterUnitsPerPixelX(),
-                    'TARGET_EXTENT': buffered_extent,
-                    'DATA_TYPE': 0,
-                    'OUTPUT': dem_output_path
-                })
-            
-            print(f"Tile {fid} exported: visual + elevation")
-            with open(log_path, "a") as log:
-                log.write(f"Tile {fid} exported: visual + elevation\n")
-        
-        except Exception as err:
-            error_msg = f"Failed to process elevation for tile {fid}: {str(err)}\n{traceback.format_exc()}"
-            print(f"{error_msg}")
-            with open(log_path, "a") as log:
-                log.write(f"{error_msg}\n")
-
-        # --- Log extent and paths ---
-        with open(log_path, "a") as log:
-            log.write(f"Tile {fid} Visual: {visual_path}, Elevation: {dem_output_path}\n")
-            log.write(f"Original Extent: {extent.toString()}\n")
-            log.write(f"Reprojected Extent: {reprojected_extent.toString() if 'reprojected_extent' in locals() else 'N/A'}\n")
-            log.write(f"Buffered Extent: {buffered_extent.toString() if 'buffered_extent' in locals() else 'N/A'}\n\n")
-
-        atlas.next()
-        
-    atlas.endRender()
-    return
\ No newline at end of file
+            # The record starts at the seek, so its latency includes the settle delays
+            record = TileRecord(fid)
+            record.start = seek_start
+            record.stages_ms["seek"] = (time.perf_counter() - seek_start) * 1000.0
+            session.begin_tile(record)
+
+            # --- Get extent of current tile ---
+            extent = map_item.extent()
+
+            work = session.plan_tile(record, extent, map_item.crs(), resume=resume)
+            if work is None:
+                atlas.next()
+                continue
+            render, clip, dem_extent = work
+
+            # --- Export visual map ---
+            recode = None
+            if render:
+                settings = QgsLayoutExporter.ImageExportSettings()
+                settings.dpi = session.dpi
+                settings.exportGeoTIFF = True
+                with record.stage("render"):
+                    result = exporter.exportToImage(session.visual_path(fid), settings)
+
+                if result != QgsLayoutExporter.Success:
+                    session.visual_failed(record, extent, error_msg)
+                    continue
+
+                # The layout exporter can't compress, so the image is rewritten when an encoding is set
+                if not session.visual_encoding.is_default():
+                    recode = partial(session.visual_encoding.recode, session.visual_path(fid))
+
+            session.deliver(record, extent, map_item.crs(), dem_extent, recode, "encode", clip)
+
+            atlas.next()
+    finally:
+        # Also on errors, so the project is never saved with the map locked to the export layers
+        atlas.endRender()
+        map_item.setKeepLayerSet(previous_layers[0])
+        map_item.setLayers(previous_layers[1])
@@ -0,0 +1,155 @@
+import tempfile
+import time
+from functools import partial
+import numpy as np
+from qgis.core import QgsRectangle
+from .tile_renderer import DirectTileRenderer, image_to_rgba, write_rgba_geotiff
+from .virtual_grid import regular_grid
+from .run_logger import TileRecord
+
+# Widest block rendered in one go, keeps each QImage well inside Qt's limits
+MOSAIC_BLOCK_PX = 8192
+
+
+class MosaicLayout:
+    # Pixel placement of every tile in one continuous image of the grid.
+    # Tiles keep the direct renderer's size and scale: page size in pixels,
+    # centred on the cell and widened to the page aspect ratio.
+
+    def __init__(self, grid, width_px, height_px):
+        self.grid = grid
+        self.width_px = width_px
+        self.height_px = height_px
+        self.res = max(grid.h_spacing / width_px, grid.v_spacing / height_px)
+
+        # Top-left corner of the window of the top-left cell
+        self.x0 = grid.xmin + grid.h_spacing / 2 - width_px * self.res / 2
+        self.y0 = grid.ymin + (grid.rows - 0.5) * grid.v_spacing + height_px * self.res / 2
+
+    def column_offset(self, col):
+        return int(round(col * self.grid.h_spacing / self.res))
+
+    def row_offset(self, row):
+        # Rows count up from ymin, pixels count down from the top
+        return int(round((self.grid.rows - 1 - row) * self.grid.v_spacing / self.res))
+
+    def extent(self, px, py, width, height):
+        x_min = self.x0 + px * self.res
+        y_max = self.y0 - py * self.res
+        return QgsRectangle(x_min, y_max - height * self.res, x_min + width * self.res, y_max)
+
+    def tile_extent(self, col, row):
+        return self.extent(self.column_offset(col), self.row_offset(row), self.width_px, self.height_px)
+
+
+def render_strip(renderer, layout, strip, px_start, px_end, py):
+    # One strip of the mosaic, rendered in blocks and copied into the mapped buffer
+    for bx in range(px_start, px_end, MOSAIC_BLOCK_PX):
+        width = min(MOSAIC_BLOCK_PX, px_end - bx)
+        image = renderer.render_region(layout.extent(bx, py, width, layout.height_px), width, layout.height_px)
+        data, w, h, line_bytes = image_to_rgba(image)
+        block = np.frombuffer(data, dtype=np.uint8).reshape(h, line_bytes)[:, :w * 4].reshape(h, w, 4)
+        strip[:, bx - px_start:bx - px_start + w, :] = block
+
+
+def export_mosaic(session, project, layout, coverage_layer, page_size_mm, fid_range=None, resume=False):
+    if coverage_layer is None:
+        coverage_layer = layout.atlas().coverageLayer()
+    if page_size_mm is None:
+        page_size = layout.pageCollection().pages()[0].pageSize()
+        page_size_mm = (page_size.width(), page_size.height())
+
+    grid = regular_grid(coverage_layer)
+    renderer = DirectTileRenderer(project, grid.crs(), page_size_mm[0], page_size_mm[1], dpi=session.dpi,
+                                  layers=session.visual_layers)
+    if renderer.to_dest:
+        raise Exception("Mosaic render mode needs the grid in the project CRS, use the direct renderer instead.")
+
+    output_size = renderer.settings.outputSize()
+    mosaic = MosaicLayout(grid, output_size.width(), output_size.height())
+
+    # The strip buffer is a temporary file, so memory stays at one strip whatever the extent
+    first, last = fid_range if fid_range else (grid.fids()[0], grid.fids()[-1])
+    if grid.cell_fids is None:
+        columns = [col for col in range(grid.cols)
+                   if grid.cell_at(col, 0).fid <= last and grid.cell_at(col, grid.rows - 1).fid >= first]
+    else:
+        # Filtered grid: columns with at least one kept cell in the range
+        fids = grid.cell_fids.reshape(grid.cols, grid.rows)
+        columns = np.flatnonzero(((fids >= first) & (fids <= last) & (fids > 0)).any(axis=1)).tolist()
+    if not columns:
+        return
+
+    px_start = mosaic.column_offset(columns[0])
+    px_end = mosaic.column_offset(columns[-1]) + mosaic.width_px
+    backing = tempfile.TemporaryFile(dir=session.img_output_folder)
+    strip = np.memmap(backing, dtype=np.uint8, mode="w+", shape=(mosaic.height_px, px_end - px_start, 4))
+    strip_view = memoryview(strip).cast("B")
+    line_bytes = (px_end - px_start) * 4
+
+    feature_number = 0
+    try:
+        # === MAIN LOOP ===
+        for row in range(grid.rows - 1, -1, -1):
+            if session.cancelled():
+                break
+            cells = [grid.cell_at(col, row) for col in columns]
+            cells = [cell for cell in cells if first <= cell.fid <= last]
+            extents = [mosaic.tile_extent(cell.col, cell.row) for cell in cells]
+            dem_extents = session.dem_extents(extents, renderer.dest_crs) if extents else []
+
+            # --- Skip the strip entirely if every tile in it is done ---
+            pending = []
+            for cell, extent, dem_extent in zip(cells, extents, dem_extents):
+                record = TileRecord(cell.fid)
+                session.begin_tile(record)
+                work = session.plan_tile(record, extent, renderer.dest_crs, dem_extent, resume)
+                if work is not None:
+                    pending.append((cell, extent, record, work))
+            if not pending:
+                continue
+
+            # --- Render the strip once, after the pipeline has written the previous one ---
+            # Incremental runs skip the render when every visual in the strip is unchanged
+            rendered = [entry for entry in pending if entry[3][0]]
+            render_ms = 0.0
+            render_error = None
+            if rendered:
+                session.flush()
+                render_start = time.perf_counter()
+                try:
+                    render_strip(renderer, mosaic, strip, px_start, px_end, mosaic.row_offset(row))
+                except Exception as err:
+                    render_error = err
+                render_ms = (time.perf_counter() - render_start) * 1000.0
+
+            # --- Slice tiles out of the strip ---
+            for cell, extent, record, (render, clip, dem_extent) in pending:
+                if session.cancelled():
+                    break
+                print(feature_number)
+                feature_number += 1
+                fid = cell.fid
+
+                # Latency starts now; each rendered tile carries an equal share of the strip render
+                record.start = time.perf_counter()
+                write_visual = None
+                if render:
+                    record.stages_ms["render"] = render_ms / len(rendered)
+                    record.start -= record.stages_ms["render"] / 1000.0
+
+                    if render_error is not None:
+                        session.visual_failed(record, extent, f"Failed to export visual for tile {fid}: {render_error}")
+                        continue
+
+                    offset = (mosaic.column_offset(cell.col) - px_start) * 4
+                    write_visual = partial(write_rgba_geotiff, strip_view[offset:], mosaic.width_px, mosaic.height_px,
+                                           line_bytes, extent, renderer.dest_crs, session.visual_path(fid),
+                                           session.visual_encoding)
+                session.deliver(record, extent, renderer.dest_crs, dem_extent, write_visual, clip=clip)
+    finally:
+        # Pending writes still read from the strip
+        session.flush()
+        strip_view.release()
+        del strip
+        backing.close()
@@ -0,0 +1,357 @@
+import json
+import os
+import time
+import numpy as np
+from qgis.core import QgsApplication, QgsProject, QgsRasterLayer, QgsCoordinateReferenceSystem
+from .grid_generation import run_grid_generation
+from .print_layout import create_print_layout
+from .map_export import run_export, find_dem_layer
+from .grid_filter import estimate_skipped_bytes
+from .virtual_grid import first_cell_extent
+from .dem_clip import build_mapped_dem, mapped_dem_path, DEM_BUFFER, RESAMPLING_KERNELS
+from .transforms import transform_bounds
+from .sharded_export import prepare_shards, run_shards
+from .profiling import profiler_from_job
+from .basemap_cache import prefetch_for_grid, BASEMAP_POOL_SIZE
+from .raster_encoding import RasterEncoding
+from .pipelined_export import pipeline_options
+from .set_blender_file import prepare_blender_script
+from .visual_sizing import visual_sizing, add_pixel_savings, DEFAULT_DPI
+from .tile_renderer import export_layers
+
+plugin_dir = os.path.dirname(os.path.abspath(__file__))
+
+JOB_DEFAULTS = {
+    "horizontal_unit": "meters",
+    "vertical_unit": "meters",
+    "crs": "EPSG:3857",
+    "layout_name": "RockyCrop",
+    "page_width_mm": 50,
+    "page_height_mm": 50,
+    "dem_layer_name": "DEM",
+    "render_mode": "direct",
+    "workers": 1,
+    "resume": True,
+    "virtual_grid": False,
+    "profile": False,
+    "profile_sample_every": 0,
+    "basemap_prefetch": False,
+    "basemap_connections": BASEMAP_POOL_SIZE,
+    "atlas_settle_ms": 200,
+    "visual_encoding": None,
+    "elevation_encoding": None,
+    "pipeline": False,
+    "aoi": None,
+    "aoi_crs": None,
+    "dem_precheck": False,
+    "incremental": False,
+    "dem_mmap": False,
+    "dpi": DEFAULT_DPI,
+    "visual_resolution": None,
+    "elevation_grid": None,
+    "elevation_resampling": "bilinear",
+    "visual_layers": None,
+    "render_cache": False,
+}
+
+REQUIRED_JOB_KEYS = ("extent", "horizontal_spacing", "vertical_spacing", "visual_folder", "elevation_folder")
+
+
+def load_job(path):
+    if path.lower().endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            job = tomllib.load(f)
+    else:
+        with open(path, "r") as f:
+            job = json.load(f)
+
+    job = dict(JOB_DEFAULTS, **job)
+
+    missing = [key for key in REQUIRED_JOB_KEYS if key not in job]
+    if missing:
+        raise ValueError(f"Job file is missing required keys: {', '.join(missing)}")
+    if len(job["extent"]) != 4:
+        raise ValueError("Job extent must be [xmin, ymin, xmax, ymax].")
+    if job["render_mode"] not in ("direct", "atlas", "mosaic"):
+        raise ValueError(f"Unknown render mode: {job['render_mode']}")
+    if job["virtual_grid"] and job["render_mode"] == "atlas":
+        raise ValueError("Virtual grids need the direct or mosaic render mode.")
+    if os.path.normpath(job["visual_folder"]) == os.path.normpath(job["elevation_folder"]):
+        raise ValueError("Visual and elevation folders must be different.")
+    RasterEncoding.from_config(job["visual_encoding"])
+    if RasterEncoding.from_config(job["elevation_encoding"]).compress == "JPEG":
+        raise ValueError("JPEG compression only applies to visual tiles.")
+    pipeline_options(job["pipeline"])
+    resolution = job["visual_resolution"]
+    if resolution is not None and resolution != "basemap" and not (isinstance(resolution, (int, float)) and resolution > 0):
+        raise ValueError("visual_resolution must be metres per pixel or \"basemap\".")
+    if job["elevation_grid"] is not None and (not isinstance(job["elevation_grid"], int) or job["elevation_grid"] < 2):
+        raise ValueError("elevation_grid must be a whole number of samples per side, at least 2.")
+    if job["elevation_resampling"] not in RESAMPLING_KERNELS:
+        raise ValueError(f"Unknown elevation resampling: {job['elevation_resampling']}")
+    layers = job["visual_layers"]
+    if layers is not None and (not isinstance(layers, list) or not all(isinstance(name, str) for name in layers)):
+        raise ValueError("visual_layers must be a list of layer names or ids.")
+
+    # Relative paths are resolved against the job file
+    job_dir = os.path.dirname(os.path.abspath(path))
+    for key in ("project", "dem_path", "visual_folder", "elevation_folder", "log_path", "profile_report", "basemap_cache"):
+        if job.get(key):
+            job[key] = os.path.join(job_dir, job[key])
+    # The AOI can also be WKT or a layer name, so it is only resolved when the file exists
+    if isinstance(job.get("aoi"), str) and os.path.exists(os.path.join(job_dir, job["aoi"])):
+        job["aoi"] = os.path.join(job_dir, job["aoi"])
+    # dem_mmap is true or the path of the mapped DEM file
+    if isinstance(job.get("dem_mmap"), str):
+        job["dem_mmap"] = os.path.join(job_dir, job["dem_mmap"])
+
+    return job
+
+
+def basemap_layer(source, index):
+    # XYZ template URLs become XYZ layers, anything else is opened as a raster file
+    if source.startswith("http://") or source.startswith("https://"):
+        uri = f"type=xyz&url={source}&zmax=19&zmin=0"
+        return QgsRasterLayer(uri, f"Basemap {index}", "wms")
+    return QgsRasterLayer(source, f"Basemap {index}")
+
+
+def prepare_project(job):
+    project = QgsProject.instance()
+
+    if job.get("project"):
+        if not project.read(job["project"]):
+            raise Exception(f"Could not read project: {job['project']}")
+    else:
+        project.setCrs(QgsCoordinateReferenceSystem(job["crs"]))
+
+    basemaps = job.get("basemap") or []
+    if isinstance(basemaps, str):
+        basemaps = [basemaps]
+
+    # Layers are added bottom-up so the first basemap ends up on top
+    for index, source in reversed(list(enumerate(basemaps))):
+        layer = basemap_layer(source, index)
+        if not layer.isValid():
+            raise Exception(f"Basemap layer is invalid: {source}")
+        project.addMapLayer(layer)
+
+    if job.get("dem_path"):
+        dem_layer = QgsRasterLayer(job["dem_path"], job["dem_layer_name"])
+        if not dem_layer.isValid():
+            raise Exception(f"DEM layer is invalid: {job['dem_path']}")
+        project.addMapLayer(dem_layer)
+        # Keep the DEM out of the visual tiles
+        project.layerTreeRoot().findLayer(dem_layer.id()).setItemVisibilityChecked(False)
+
+    return project
+
+
+def prepare_mapped_dem(job, grid_layer):
+    # Decodes the DEM under the grid once; every export worker then clips from the same file
+    dem_layer = find_dem_layer(job["dem_layer_name"])
+
+    # Tiles are widened to the page aspect ratio around their cell, so the window gets a cell of margin
+    cell = first_cell_extent(grid_layer)
+    margin = max(cell.width(), cell.height()) if cell else 0.0
+    extent = grid_layer.extent()
+    bounds = [extent.xMinimum() - margin, extent.yMinimum() - margin, extent.xMaximum() + margin, extent.yMaximum() + margin]
+    dem_bounds = transform_bounds(bounds, grid_layer.crs(), dem_layer.crs())[0]
+    dem_bounds += np.array([-DEM_BUFFER, -DEM_BUFFER, DEM_BUFFER, DEM_BUFFER])
+
+    # Next to the elevation tiles by default, the plugin folder may be read-only or replaced on update
+    source_path = dem_layer.source().split("|")[0]
+    cache_path = job["dem_mmap"] if isinstance(job["dem_mmap"], str) \
+        else mapped_dem_path(os.path.join(job["elevation_folder"], "dem_cache"), source_path, dem_bounds)
+    return build_mapped_dem(source_path, cache_path, dem_bounds)
+
+
+class PipelineRun:
+    # State handed from the preparation steps, which touch the project and layouts and
+    # so stay on the main thread, to the export, which can run on a worker thread
+
+    def __init__(self, job, log_path):
+        self.job = job
+        self.log_path = log_path
+        self.grid_layer = None
+        self.shard_plan = None
+        self.restore_basemaps = None
+        self.settle_ms = job.get("atlas_settle_ms", 200)
+        self.timings = {}
+
+
+def prepare_pipeline(job, interactive=True, background=False):
+    project = QgsProject.instance()
+    log_path = job.get("log_path") or os.path.join(plugin_dir, "export_log.jsonl")
+    run = PipelineRun(job, log_path)
+    timings = run.timings
+
+    # === GRID ===
+    start = time.perf_counter()
+    filter_stats = {}
+    grid_layer = run_grid_generation(
+        horizontal_spacing = job["horizontal_spacing"],
+        vertical_spacing = job["vertical_spacing"],
+        horizontal_unit = job["horizontal_unit"],
+        vertical_unit = job["vertical_unit"],
+        crs = job["crs"],
+        extent = job["extent"],
+        interactive = interactive,
+        virtual = job.get("virtual_grid", False),
+        aoi = job.get("aoi"),
+        aoi_crs = job.get("aoi_crs"),
+        dem_layer = find_dem_layer(job["dem_layer_name"]) if job.get("dem_precheck") else None,
+        filter_stats = filter_stats
+    )
+    if grid_layer is None:
+        raise Exception("Grid generation failed or was cancelled.")
+    run.grid_layer = grid_layer
+    timings["grid"] = time.perf_counter() - start
+
+    # === VISUAL LAYERS ===
+    # Same set the export renders, resolved here so a wrong layer name fails before any tile
+    layers = export_layers(project, grid_layer, job.get("visual_layers"))
+    print(f"Visual layers: {', '.join(layer.name() for layer in layers)}")
+
+    # === VISUAL RESOLUTION ===
+    # The DPI is worked out once here, so every render mode and shard uses the same one
+    job.setdefault("dpi", DEFAULT_DPI)
+    if job.get("visual_resolution"):
+        sizing = visual_sizing(project, grid_layer, job["page_width_mm"], job["page_height_mm"], job["visual_resolution"],
+                               layers)
+        job["dpi"] = sizing["dpi"]
+        timings["visual_sizing"] = sizing
+        saved = sizing["pixels_saved_per_tile"]
+        print(f"Visual tiles: {sizing['width_px']} x {sizing['height_px']} px at {sizing['dpi']:g} dpi "
+              f"({sizing['resolution_m']:g} m/px), {abs(saved):,} px per tile {'fewer' if saved >= 0 else 'more'} "
+              f"than at 300 dpi")
+
+    if filter_stats:
+        filter_stats["bytes_skipped"] = estimate_skipped_bytes(filter_stats, job["page_width_mm"], job["page_height_mm"],
+                                                               job["dpi"])
+        timings["grid_filter"] = filter_stats
+        print(f"Skipped {filter_stats['skipped']:,} of {filter_stats['cells']:,} tiles, "
+              f"about {filter_stats['bytes_skipped'] / 1e6:,.0f} MB not written")
+
+    # === LAYOUT ===
+    start = time.perf_counter()
+    layout = create_print_layout(
+        project = project,
+        coverage_layer = grid_layer,
+        layout_name = job["layout_name"],
+        page_width_mm = job["page_width_mm"],
+        page_height_mm = job["page_height_mm"],
+        interactive = interactive
+    )
+    if layout is None:
+        raise Exception("Print layout creation failed.")
+    timings["layout"] = time.perf_counter() - start
+
+    # Setting up Blender code for use; tiles are rendered in the project CRS, not the grid CRS
+    prepare_blender_script(plugin_dir, job["visual_folder"], job["elevation_folder"], project.crs().authid(),
+                           open_output=interactive)
+
+    # === BASEMAP PREFETCH ===
+    if job.get("basemap_prefetch"):
+        start = time.perf_counter()
+        run.restore_basemaps, prefetch_stats = prefetch_for_grid(
+            project, grid_layer, job["page_width_mm"], job["page_height_mm"],
+            # Shared between jobs in the QGIS profile, the plugin folder may be read-only or replaced on update
+            job.get("basemap_cache") or os.path.join(QgsApplication.qgisSettingsDirPath(), "rockycrop", "basemap_cache"),
+            dpi = job["dpi"],
+            pool_size = job.get("basemap_connections", BASEMAP_POOL_SIZE),
+            layers = layers
+        )
+        # With every basemap on local disk there is nothing left for the atlas to wait for
+        if prefetch_stats["all_cached"]:
+            run.settle_ms = 0
+        timings["prefetch"] = time.perf_counter() - start
+        timings["prefetch_stats"] = prefetch_stats
+
+    # === MAPPED DEM ===
+    # Built before the shards start, so they all map the same file
+    if job.get("dem_mmap"):
+        start = time.perf_counter()
+        job["dem_mmap"] = prepare_mapped_dem(job, grid_layer)
+        timings["dem_mmap"] = time.perf_counter() - start
+
+    # === SHARDS ===
+    # The project, layer tree, layouts and memory layers are not thread safe, so a background
+    # export never renders on the task thread: it runs in a worker process, the task only watches it
+    shard_count = job.get("workers", 1)
+    if shard_count > 1 or background:
+        shard_job = dict(job, log_path=log_path, atlas_settle_ms=run.settle_ms)
+        run.shard_plan = prepare_shards(shard_job, grid_layer, log_path, shard_count)
+
+    return run
+
+
+def export_pipeline(run, progress_callback=None, should_cancel=None):
+    job = run.job
+    start = time.perf_counter()
+    total = run.grid_layer.featureCount()
+
+    # === EXPORT ===
+    if run.shard_plan:
+        summary = run_shards(run.shard_plan, progress_callback=progress_callback, should_cancel=should_cancel)
+    else:
+        done = []
+
+        def tile_done(fid):
+            done.append(fid)
+            if progress_callback:
+                progress_callback(len(done), total)
+
+        summary = run_export(
+            layout_name = job["layout_name"],
+            img_output_folder = job["visual_folder"],
+            elv_output_folder = job["elevation_folder"],
+            dem_layer_name = job["dem_layer_name"],
+            log_path = run.log_path,
+            render_mode = job.get("render_mode", "atlas"),
+            coverage_layer = run.grid_layer,
+            page_size_mm = (job["page_width_mm"], job["page_height_mm"]),
+            progress_callback = tile_done,
+            resume = job.get("resume", True),
+            profiler = profiler_from_job(job, run.log_path),
+            settle_ms = run.settle_ms,
+            visual_encoding = job.get("visual_encoding"),
+            elevation_encoding = job.get("elevation_encoding"),
+            should_cancel = should_cancel,
+            pipeline = job.get("pipeline"),
+            incremental = job.get("incremental", False),
+            dem_mmap = job.get("dem_mmap") or None,
+            dpi = job["dpi"],
+            elevation_grid = job.get("elevation_grid"),
+            elevation_resampling = job.get("elevation_resampling", "bilinear"),
+            visual_layers = job.get("visual_layers"),
+            render_cache = job.get("render_cache", False)
+        )
+    run.timings["export"] = time.perf_counter() - start
+    run.timings["tiles"] = total
+    # Shard summaries are rebuilt from the log, without the per-run pixel count
+    if "pixels_saved" not in summary:
+        add_pixel_savings(summary, job["page_width_mm"], job["page_height_mm"], job["dpi"])
+    run.timings["summary"] = summary
+    return summary
+
+
+def finish_pipeline(run):
+    # Put the project's online basemaps back
+    if run.restore_basemaps:
+        run.restore_basemaps()
+        run.restore_basemaps = None
+    return run.timings
+
+
+def run_pipeline(job, interactive=True, progress_callback=None):
+    run = prepare_pipeline(job, interactive)
+    try:
+        export_pipeline(run, progress_callback)
+    finally:
+        finish_pipeline(run)
+    return run.timings
@@ -0,0 +1,154 @@
+import queue
+import threading
+from .manifest import STATUS_COMPLETE, STATUS_FAILED_ELEVATION
+
+PIPELINE_DEFAULTS = {
+    "write_workers": 2,
+    "clip_workers": 2,
+    "queue_size": 8,
+}
+
+# Tells a stage thread to exit
+_STOP = object()
+
+
+def pipeline_options(config):
+    # False/None, True for the defaults, or a table overriding some of them
+    if not config:
+        return None
+    options = dict(PIPELINE_DEFAULTS)
+    if isinstance(config, dict):
+        unknown = set(config) - set(PIPELINE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown pipeline settings: {', '.join(sorted(unknown))}")
+        options.update(config)
+    for key, value in options.items():
+        if int(value) < 1:
+            raise ValueError(f"Pipeline setting {key} must be at least 1.")
+        options[key] = int(value)
+    return options
+
+
+class PipelineTile:
+    def __init__(self, record, extent, dem_extent, write_visual, write_stage, clip=True):
+        self.record = record
+        self.extent = extent
+        self.dem_extent = dem_extent
+        self.write_visual = write_visual
+        self.write_stage = write_stage
+        self.clip = clip
+        self.error = None
+        self.status = STATUS_COMPLETE
+
+
+class TilePipeline:
+    # Overlaps rendering with visual writes and DEM clipping.
+    # The export loop renders on its own thread and submits tiles; write threads
+    # save the visual, clip threads cut the DEM with their own GDAL handle.
+    # Bounded queues hold the renderer back when the disk can't keep up.
+    # Finished tiles are logged and recorded on the export loop's thread,
+    # since the manifest and progress callbacks aren't thread safe.
+
+    def __init__(self, session, write_workers=2, clip_workers=2, queue_size=8):
+        if session.clipper is None:
+            raise Exception("The pipelined export needs the windowed DEM clipper.")
+        self.session = session
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.clip_queue = queue.Queue(maxsize=queue_size)
+        self.done_queue = queue.Queue()
+        self.pending = 0
+
+        self.write_threads = [threading.Thread(target=self._write_loop, daemon=True) for _ in range(write_workers)]
+        self.clip_threads = [threading.Thread(target=self._clip_loop, daemon=True) for _ in range(clip_workers)]
+        for thread in self.write_threads + self.clip_threads:
+            thread.start()
+
+    def describe(self):
+        return f"{len(self.write_threads)} write, {len(self.clip_threads)} clip workers, queue {self.write_queue.maxsize}"
+
+    # === STAGES ===
+    def _write_loop(self):
+        while True:
+            tile = self.write_queue.get()
+            if tile is _STOP:
+                return
+            try:
+                with tile.record.stage(tile.write_stage):
+                    tile.write_visual()
+            except Exception as err:
+                tile.error = f"Failed to export visual for tile {tile.record.fid}: {err}"
+                self.done_queue.put(tile)
+                continue
+            finally:
+                # Drop the rendered pixels as soon as they are on disk
+                tile.write_visual = None
+            # Incremental runs can keep a tile's elevation and only redo its visual
+            if tile.clip:
+                self.clip_queue.put(tile)
+            else:
+                self.done_queue.put(tile)
+
+    def _clip_loop(self):
+        # GDAL datasets can't be shared between threads, each clip thread opens the DEM itself
+        clipper = None
+        try:
+            clipper = self.session.clipper.reopen()
+        except Exception as err:
+            print(f"Pipeline clip worker could not open the DEM: {err}")
+
+        while True:
+            tile = self.clip_queue.get()
+            if tile is _STOP:
+                break
+            try:
+                if clipper is None:
+                    raise Exception("DEM not open in this worker")
+                success = self.session.clip_elevation(tile.record, tile.extent, None, tile.dem_extent, clipper)
+            except Exception as err:
+                tile.record.error(f"Failed to export elevation for tile {tile.record.fid}: {err}")
+                success = False
+            if not success:
+                tile.status = STATUS_FAILED_ELEVATION
+            self.done_queue.put(tile)
+
+        if clipper:
+            clipper.close()
+
+    # === EXPORT LOOP SIDE ===
+    def submit(self, record, extent, dem_extent, write_visual=None, write_stage="write", clip=True):
+        # Blocks while the first stage queue is full
+        tile = PipelineTile(record, extent, dem_extent, write_visual, write_stage, clip)
+        self.pending += 1
+        if write_visual:
+            self.write_queue.put(tile)
+        else:
+            self.clip_queue.put(tile)
+
+    def _finish(self, tile):
+        self.pending -= 1
+        if tile.error:
+            self.session.visual_failed(tile.record, tile.extent, tile.error)
+        else:
+            self.session.finish_tile(tile.record, tile.extent, tile.status)
+
+    def poll(self):
+        # Records whatever the stages have finished, without waiting
+        while True:
+            try:
+                tile = self.done_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._finish(tile)
+
+    def wait(self):
+        while self.pending:
+            self._finish(self.done_queue.get())
+
+    def close(self):
+        self.wait()
+        for thread in self.write_threads:
+            self.write_queue.put(_STOP)
+        for thread in self.clip_threads:
+            self.clip_queue.put(_STOP)
+        for thread in self.write_threads + self.clip_threads:
+            thread.join()
@@ -1,15 +1,13 @@
 from qgis.PyQt import QtWidgets, QtGui
 from qgis.PyQt.QtCore import Qt
 from qgis.utils import iface
-from qgis.core import QgsCoordinateReferenceSystem, QgsProject, QgsRectangle
+from qgis.core import QgsCoordinateReferenceSystem, QgsProject, QgsRectangle, QgsVectorLayer, QgsWkbTypes
 from PyQt5.QtWidgets import QDialog, QLineEdit, QLabel, QPushButton, QFileDialog
 import os
 import traceback
-from .grid_generation import run_grid_generation
 from .draw_on_map import DrawOnMap, StartDrawOnMap
-from .print_layout import create_print_layout
-from .map_export import run_export
-from .set_blender_file import prepare_blender_script
+from .pipeline import prepare_pipeline, JOB_DEFAULTS
+from .export_task import start_export_task
 
 class PluginDialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
@@ -74,6 +72,21 @@ class PluginDialog(QtWidgets.QDialog):
         extent_buttons_wid = QtWidgets.QWidget()
         extent_buttons_wid.setLayout(extent_buttons)
 
+        # Area of interest: only cells overlapping it are generated and exported
+        self.drawn_aoi = None
+        self.aoi_input = QtWidgets.QComboBox()
+        self.aoi_input.addItem("Whole extent", None)
+        self.aoi_input.addItem("Drawn polygon", "drawn")
+        for layer in QgsProject.instance().mapLayers().values():
+            if isinstance(layer, QgsVectorLayer) and layer.geometryType() == QgsWkbTypes.PolygonGeometry:
+                self.aoi_input.addItem(f"Layer: {layer.name()}", layer.id())
+        self.draw_aoi_button = QtWidgets.QPushButton("Draw AOI on Map")
+        aoi_layout = QtWidgets.QHBoxLayout()
+        aoi_layout.addWidget(self.aoi_input)
+        aoi_layout.addWidget(self.draw_aoi_button)
+        aoi_wid = QtWidgets.QWidget()
+        aoi_wid.setLayout(aoi_layout)
+
         # Group box to hold manual inputs
         self.manual_extent_group = QtWidgets.QGroupBox("Manual Extent Coordinates")
         manual_layout = QtWidgets.QFormLayout()
@@ -82,6 +95,7 @@ class PluginDialog(QtWidgets.QDialog):
         manual_layout.addRow("Min Y:", self.min_y_input)
         manual_layout.addRow("Max Y:", self.max_y_input)
         manual_layout.addRow("Choose extent: ", extent_buttons_wid)
+        manual_layout.addRow("Area of interest: ", aoi_wid)
         self.manual_extent_group.setLayout(manual_layout)
         
         # Layout Settings
@@ -98,11 +112,29 @@ class PluginDialog(QtWidgets.QDialog):
         self.page_height_input = QtWidgets.QDoubleSpinBox()
         self.page_height_input.setRange(10, 500)
         self.page_height_input.setValue(50)
+
+        # Pixels per tile: fixed 300 DPI, the basemap's own resolution, or a ground resolution
+        self.resolution_label = QtWidgets.QLabel("Visual resolution:")
+        self.resolution_mode_input = QtWidgets.QComboBox()
+        self.resolution_mode_input.addItem("300 DPI", None)
+        self.resolution_mode_input.addItem("Match basemap native zoom", "basemap")
+        self.resolution_mode_input.addItem("Metres per pixel", "target")
+        self.resolution_input = QtWidgets.QDoubleSpinBox()
+        self.resolution_input.setDecimals(3)
+        self.resolution_input.setRange(0.001, 10000)
+        self.resolution_input.setValue(1.0)
+        self.resolution_input.setEnabled(False)
+        self.resolution_mode_input.currentIndexChanged.connect(
+            lambda: self.resolution_input.setEnabled(self.resolution_mode_input.currentData() == "target"))
+        resolution_layout = QtWidgets.QHBoxLayout()
+        resolution_layout.addWidget(self.resolution_mode_input)
+        resolution_layout.addWidget(self.resolution_input)
         
         print_layout = QtWidgets.QFormLayout()
         print_layout.addRow(self.layout_name_label, self.layout_name_input)
         print_layout.addRow(self.page_width_label, self.page_width_input)
         print_layout.addRow(self.page_height_label, self.page_height_input)
+        print_layout.addRow(self.resolution_label, resolution_layout)
         print_layout_settings.setLayout(print_layout)
         
         # Atlas Settings
@@ -122,6 +154,7 @@ class PluginDialog(QtWidgets.QDialog):
         self.extent_button.clicked.connect(self.populate_manual_extent_from_canvas)
         self.draw_tool = DrawOnMap(iface, self.min_x_input, self.max_x_input, self.min_y_input, self.max_y_input, self)
         self.draw_extent_button.clicked.connect(self.draw_tool.activate_draw_extent)
+        self.draw_aoi_button.clicked.connect(lambda: self.draw_tool.activate_draw_aoi(self.set_drawn_aoi))
         
         # Print Layout
         form_layout.addRow(print_layout_settings)
@@ -142,6 +175,60 @@ class PluginDialog(QtWidgets.QDialog):
         self.elevation_folder_button = QtWidgets.QPushButton("Browse...")
         self.elevation_folder_button.clicked.connect(self.select_elevation_folder)
 
+        # Visual render mode
+        self.render_mode_label = QtWidgets.QLabel("Render mode:")
+        self.render_mode_input = QtWidgets.QComboBox()
+        self.render_mode_input.addItem("Direct (map renderer)", "direct")
+        self.render_mode_input.addItem("Mosaic (render strips, slice tiles)", "mosaic")
+        self.render_mode_input.addItem("Atlas (compatibility)", "atlas")
+
+        # Worker processes, 1 keeps the export inside QGIS
+        self.workers_label = QtWidgets.QLabel("Worker processes:")
+        self.workers_input = QtWidgets.QSpinBox()
+        self.workers_input.setRange(1, max(1, os.cpu_count() or 1))
+        self.workers_input.setValue(1)
+
+        # Compute grid cells on demand instead of storing them in a layer
+        self.virtual_grid_checkbox = QtWidgets.QCheckBox("Virtual grid (direct or mosaic render mode)")
+        self.virtual_grid_checkbox.setChecked(False)
+
+        # Download basemap tiles up front and render from the local cache
+        self.prefetch_checkbox = QtWidgets.QCheckBox("Prefetch basemap tiles to local cache")
+        self.prefetch_checkbox.setChecked(False)
+
+        # Draw unlabelled bottom layers once per block of neighbouring cells
+        self.render_cache_checkbox = QtWidgets.QCheckBox("Reuse static layers across neighbouring tiles (direct render mode)")
+        self.render_cache_checkbox.setChecked(False)
+
+        # Decode the DEM once and let every worker slice tiles out of the same mapped file
+        self.dem_mmap_checkbox = QtWidgets.QCheckBox("Decode DEM once into a shared memory-mapped file")
+        self.dem_mmap_checkbox.setChecked(False)
+
+        # Resample elevation tiles to a fixed vertex grid, 0 keeps the DEM's own pixels
+        self.elevation_grid_label = QtWidgets.QLabel("Elevation grid (samples per side):")
+        self.elevation_grid_input = QtWidgets.QSpinBox()
+        self.elevation_grid_input.setRange(0, 8193)
+        self.elevation_grid_input.setSpecialValueText("Native DEM resolution")
+        self.elevation_grid_input.setValue(0)
+        self.elevation_resampling_input = QtWidgets.QComboBox()
+        for kernel in ("bilinear", "cubic", "cubicspline", "lanczos", "average", "nearest"):
+            self.elevation_resampling_input.addItem(kernel.capitalize(), kernel)
+        elevation_grid_layout = QtWidgets.QHBoxLayout()
+        elevation_grid_layout.addWidget(self.elevation_grid_input)
+        elevation_grid_layout.addWidget(self.elevation_resampling_input)
+
+        # Drop cells with no elevation data (sea, outside the DEM)
+        self.dem_precheck_checkbox = QtWidgets.QCheckBox("Skip tiles without DEM data")
+        self.dem_precheck_checkbox.setChecked(False)
+
+        # Skip tiles a previous run already finished
+        self.resume_checkbox = QtWidgets.QCheckBox("Resume previous export")
+        self.resume_checkbox.setChecked(True)
+
+        # Redo only tiles whose DEM, layers, page or extent changed since the last run
+        self.incremental_checkbox = QtWidgets.QCheckBox("Only re-export tiles whose inputs changed")
+        self.incremental_checkbox.setChecked(False)
+
         # Setup export settings layout
         export_settings = QtWidgets.QGroupBox("Export Settings:")
         export_settings_layout = QtWidgets.QFormLayout()
@@ -161,6 +248,16 @@ class PluginDialog(QtWidgets.QDialog):
         elevation_layout.addWidget(self.elevation_folder_input)
         elevation_layout.addWidget(self.elevation_folder_button)
         export_settings_layout.addRow(self.elevation_folder_label, elevation_layout)
+        export_settings_layout.addRow(self.render_mode_label, self.render_mode_input)
+        export_settings_layout.addRow(self.elevation_grid_label, elevation_grid_layout)
+        export_settings_layout.addRow(self.workers_label, self.workers_input)
+        export_settings_layout.addRow(self.virtual_grid_checkbox)
+        export_settings_layout.addRow(self.prefetch_checkbox)
+        export_settings_layout.addRow(self.render_cache_checkbox)
+        export_settings_layout.addRow(self.dem_mmap_checkbox)
+        export_settings_layout.addRow(self.dem_precheck_checkbox)
+        export_settings_layout.addRow(self.resume_checkbox)
+        export_settings_layout.addRow(self.incremental_checkbox)
         
         export_settings.setLayout(export_settings_layout)
 
@@ -244,6 +341,19 @@ class PluginDialog(QtWidgets.QDialog):
 
             return transformed_extent
     
+    def set_drawn_aoi(self, geometry):
+        self.drawn_aoi = geometry
+        self.aoi_input.setCurrentIndex(self.aoi_input.findData("drawn"))
+
+    def aoi_job(self):
+        # The drawn polygon goes into the job as WKT in the canvas CRS
+        choice = self.aoi_input.currentData()
+        if choice == "drawn":
+            if self.drawn_aoi is None:
+                raise ValueError("No AOI polygon has been drawn.")
+            return {"aoi": self.drawn_aoi.asWkt(), "aoi_crs": iface.mapCanvas().mapSettings().destinationCrs().authid()}
+        return {"aoi": choice, "aoi_crs": None}
+
     def populate_manual_extent_from_canvas(self):
         extent = iface.mapCanvas().extent()
         self.min_x_input.setText(str(extent.xMinimum()))
@@ -252,10 +362,7 @@ class PluginDialog(QtWidgets.QDialog):
         self.max_y_input.setText(str(extent.yMaximum()))
         
     def generate_grid(self):
-        grid_size_hor = self.horizontal_spacing.value()
-        grid_size_ver = self.vertical_spacing.value()
-        grid_hor_unit = self.horizontal_unit.currentText()
-        grid_ver_unit = self.vertical_unit.currentText()
+        # Spacing and units are read by build_job, the one place the job is built from the widgets
         crs_text = self.crs_options.currentText()
         epsg_code = crs_text.split(" ")[0]
         grid_crs = QgsCoordinateReferenceSystem(epsg_code)
@@ -280,44 +387,53 @@ class PluginDialog(QtWidgets.QDialog):
         user_extent = self.get_extent("manual")
         extent = [user_extent.xMinimum(), user_extent.yMinimum(), user_extent.xMaximum(), user_extent.yMaximum()]
 
-        # Generate the grid
-        grid_layer = run_grid_generation(
-            horizontal_spacing = grid_size_hor,
-            vertical_spacing = grid_size_ver,
-            horizontal_unit = grid_hor_unit,
-            vertical_unit = grid_ver_unit,
-            crs = crs_str,
-            extent = extent
-        )
-
-        # Add to map
-        QgsProject.instance().addMapLayer(grid_layer)
-        
-        create_print_layout(
-            project = QgsProject.instance(),
-            coverage_layer = grid_layer,
-            layout_name = self.layout_name_input.text(),
-            page_width_mm = self.page_width_input.value(),
-            page_height_mm = self.page_height_input.value()
-        )
-        
-        # Setting up Blender code for use
-        plugin_dir = os.path.dirname(__file__)
-        prepare_blender_script(plugin_dir, visual_path, elevation_path, crs_str)
-        
-        #Run the export code
         try:
-            run_export(
-                layout_name=self.layout_name_input.text(),
-                img_output_folder = self.visual_folder_input.text(),
-                elv_output_folder = self.elevation_folder_input.text(),
-                dem_layer_name = self.elevation_srtm_input.text(),
-                log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_log.txt")
-            )
-            QtWidgets.QMessageBox.information(self, "Export Complete", "Visual and elevation exports finished successfully.")
+            job = self.build_job(extent, crs_str)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Area of Interest", str(e))
+            return
+
+        # Grid and layout are built here; the export itself runs as a background task
+        try:
+            run = prepare_pipeline(job, interactive=True, background=True)
         except Exception as e:
             QtWidgets.QMessageBox.information(self, "Export Failed", "Visual and elevation exports have failed.")
             traceback.print_exc()
+            return
+
+        start_export_task(run)
+
+    def build_job(self, extent, crs_str):
+        # Same job spec the command line entry point reads from JSON/TOML, defaults included
+        return dict(JOB_DEFAULTS, **{
+            "horizontal_spacing": self.horizontal_spacing.value(),
+            "horizontal_unit": self.horizontal_unit.currentText(),
+            "vertical_spacing": self.vertical_spacing.value(),
+            "vertical_unit": self.vertical_unit.currentText(),
+            "crs": crs_str,
+            "extent": extent,
+            "layout_name": self.layout_name_input.text(),
+            "page_width_mm": self.page_width_input.value(),
+            "page_height_mm": self.page_height_input.value(),
+            "visual_folder": self.visual_folder_input.text(),
+            "elevation_folder": self.elevation_folder_input.text(),
+            "dem_layer_name": self.elevation_srtm_input.text(),
+            "render_mode": self.render_mode_input.currentData(),
+            "workers": self.workers_input.value(),
+            "resume": self.resume_checkbox.isChecked(),
+            "incremental": self.incremental_checkbox.isChecked(),
+            "basemap_prefetch": self.prefetch_checkbox.isChecked(),
+            "render_cache": self.render_cache_checkbox.isChecked() and self.render_mode_input.currentData() == "direct",
+            "dem_mmap": self.dem_mmap_checkbox.isChecked(),
+            "elevation_grid": self.elevation_grid_input.value() if self.elevation_grid_input.value() >= 2 else None,
+            "elevation_resampling": self.elevation_resampling_input.currentData(),
+            "visual_resolution": self.resolution_input.value() if self.resolution_mode_input.currentData() == "target"
+                                 else self.resolution_mode_input.currentData(),
+            "virtual_grid": self.virtual_grid_checkbox.isChecked() and self.render_mode_input.currentData() != "atlas",
+            "dem_precheck": self.dem_precheck_checkbox.isChecked(),
+            "log_path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_log.jsonl"),
+            **self.aoi_job(),
+        })
 
     def get_inputs(self):
         # Returns all input data as a dictionary for later use
@@ -333,6 +449,8 @@ class PluginDialog(QtWidgets.QDialog):
             "page_width_mm": self.page_width_input.value(),
             "page_height_mm": self.page_height_input.value(),
             "atlas_enabled": self.atlas_checkbox.isChecked(),
+            "render_mode": self.render_mode_input.currentData(),
+            "workers": self.workers_input.value(),
         }
     
     def accept(self):
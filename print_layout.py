@@ -9,13 +9,21 @@ from qgis.core import (
     QgsLayoutAtlas,
     QgsLayoutExporter,
     QgsVectorLayer,
-    QgsCoordinateTransform,
 )
 from qgis.PyQt.QtWidgets import QMessageBox
 from PyQt5.QtCore import QTimer
+from .virtual_grid import VirtualGrid, first_cell_extent
+from .transforms import get_transform
 
-def create_print_layout(project, coverage_layer, layout_name, page_width_mm, page_height_mm):
-    atlas_enabled = True
+def warn(interactive, title, message):
+    if interactive:
+        QMessageBox.warning(None, title, message)
+    else:
+        print(f"{title}: {message}")
+
+def create_print_layout(project, coverage_layer, layout_name, page_width_mm, page_height_mm, interactive=True):
+    # A virtual grid has no layer to drive an atlas; the map is only zoomed to the first cell
+    atlas_enabled = not isinstance(coverage_layer, VirtualGrid)
     manager = project.layoutManager()
 
     # Remove any existing layout with same name
@@ -41,11 +49,11 @@ def create_print_layout(project, coverage_layer, layout_name, page_width_mm, pag
     map_item.attemptResize(QgsLayoutSize(page_width_mm, page_height_mm, QgsUnitTypes.LayoutMillimeters))
     map_item.setFrameEnabled(False)
 
-    # Lock coverage layer to ensure rendering
-    map_item.setLayers([coverage_layer])
-    map_item.setKeepLayerStyles(False)
-
     if atlas_enabled:
+        # Lock coverage layer to ensure rendering
+        map_item.setLayers([coverage_layer])
+        map_item.setKeepLayerStyles(False)
+
         # Set up Atlas
         atlas = layout.atlas()
         atlas.setEnabled(True)
@@ -54,29 +62,25 @@ def create_print_layout(project, coverage_layer, layout_name, page_width_mm, pag
         map_item.setAtlasDriven(True)
         map_item.setAtlasScalingMode(QgsLayoutItemMap.Fixed)
         map_item.setAtlasMargin(0.0)
-        
-
-        # Safe zoom to first feature's extent
-        features = list(coverage_layer.getFeatures())
-        if features:
-            first_geom = features[0].geometry()
-            if not first_geom or first_geom.isNull():
-                QMessageBox.warning(None, "Geometry Error", "First feature geometry is null.")
-                return
-
-            # Transform bounding box to project CRS if needed
-            if coverage_layer.crs() != QgsProject.instance().crs():
-                transformer = QgsCoordinateTransform(
-                    coverage_layer.crs(), QgsProject.instance().crs(), QgsProject.instance())
-                bbox = transformer.transformBoundingBox(first_geom.boundingBox())
-            else:
-                bbox = first_geom.boundingBox()
-
-            print("Zooming to bbox:", bbox.toString())
-            map_item.zoomToExtent(bbox)
-        else:
-            QMessageBox.warning(None, "Atlas Error", "No features found in coverage layer.")
-            return
+
+    # Safe zoom to first feature's extent, without reading the rest of the grid
+    first_bbox = first_cell_extent(coverage_layer)
+    if first_bbox is None:
+        warn(interactive, "Atlas Error", "No features found in coverage layer.")
+        return
+    if first_bbox.isNull():
+        warn(interactive, "Geometry Error", "First feature geometry is null.")
+        return
+
+    # Transform bounding box to project CRS if needed
+    if coverage_layer.crs() != QgsProject.instance().crs():
+        transformer = get_transform(coverage_layer.crs(), QgsProject.instance().crs())
+        bbox = transformer.transformBoundingBox(first_bbox)
+    else:
+        bbox = first_bbox
+
+    print("Zooming to bbox:", bbox.toString())
+    map_item.zoomToExtent(bbox)
     
     def lock(map_item):
         # Lock the actual layer set
@@ -89,8 +93,13 @@ def create_print_layout(project, coverage_layer, layout_name, page_width_mm, pag
             layout.atlas().beginRender()
             layout.refresh()
 
-        QTimer.singleShot(1000, unlock)
+        # Without an event loop (headless workers) the timer would never fire
+        if interactive:
+            QTimer.singleShot(1000, unlock)
+        else:
+            unlock()
 
     lock(map_item)
 
-    print(f"Layout '{layout_name}' created at {page_width_mm}mm × {page_height_mm}mm. Atlas: {'enabled' if atlas_enabled else 'disabled'}")
\ No newline at end of file
+    print(f"Layout '{layout_name}' created at {page_width_mm}mm × {page_height_mm}mm. Atlas: {'enabled' if atlas_enabled else 'disabled'}")
+    return layout
\ No newline at end of file
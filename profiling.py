@@ -0,0 +1,204 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tracemalloc
+from .run_logger import STAGES, percentile
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+
+
+class ExportProfiler:
+    # Opt-in instrumentation for the export loop: counters, network request counts,
+    # and cProfile/tracemalloc captures for every Nth tile.
+
+    def __init__(self, report_path, sample_every=0, use_cprofile=True, use_tracemalloc=False, top=15):
+        self.report_path = report_path
+        self.sample_every = sample_every
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.top = top
+
+        self.counters = {}
+        self.samples = []
+        self.rss_high_water = 0.0
+        self.tile_count = 0
+        self.network_requests = 0
+
+        self._profile = None
+        self._sampled_record = None
+        self._network_start = {}
+        self._baseline = None
+        self._network_signal = None
+
+        if use_tracemalloc:
+            tracemalloc.start()
+            self._baseline = tracemalloc.take_snapshot()
+
+        self._attach_network_counter()
+
+    def _attach_network_counter(self):
+        # Basemap tiles are fetched lazily while rendering; counting requests shows how much
+        # of a tile's render time is really network time
+        try:
+            from qgis.core import QgsNetworkAccessManager
+            self._network_signal = QgsNetworkAccessManager.instance().requestAboutToBeCreated
+            self._network_signal.connect(self._on_request)
+        except Exception as err:
+            print(f"Network request counting unavailable: {err}")
+            self._network_signal = None
+
+    def _on_request(self, *args):
+        self.network_requests += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def begin_tile(self, record):
+        self.tile_count += 1
+        self._network_start[id(record)] = self.network_requests
+
+        # With a pipelined export several tiles are open at once; only one is sampled at a time
+        sampled = self.sample_every > 0 and (self.tile_count - 1) % self.sample_every == 0
+        if sampled and self._sampled_record is None:
+            self._sampled_record = record
+            if self.use_cprofile:
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+
+    def end_tile(self, record):
+        requests = self.network_requests - self._network_start.pop(id(record), self.network_requests)
+        record.extra["network_requests"] = requests
+        self.count("network_requests", requests)
+
+        rss = current_rss_mb()
+        if rss is not None:
+            self.rss_high_water = max(self.rss_high_water, rss)
+
+        if record is not self._sampled_record:
+            return
+
+        sample = {"fid": record.fid, "stages_ms": dict(record.stages_ms)}
+        if self._profile:
+            self._profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+            sample["profile"] = stream.getvalue()
+            self._profile = None
+
+        if self.use_tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            sample["python_mb"] = current / (1024 * 1024)
+            sample["python_peak_mb"] = peak / (1024 * 1024)
+            diff = tracemalloc.take_snapshot().compare_to(self._baseline, "lineno")
+            sample["allocations"] = [str(stat) for stat in diff[:10]]
+
+        self.samples.append(sample)
+        self._sampled_record = None
+
+    def close(self):
+        if self._network_signal is not None:
+            try:
+                self._network_signal.disconnect(self._on_request)
+            except Exception:
+                pass
+        if self.use_tracemalloc:
+            tracemalloc.stop()
+
+    def write_report(self, summary, tiles):
+        lines = ["# RockyCrop export profile", ""]
+
+        # --- Summary ---
+        lines.append(f"- Tiles: {summary['tiles']} ({summary['completed']} complete, "
+                     f"{summary['failed']} failed, {summary['skipped']} skipped)")
+        lines.append(f"- Elapsed: {summary['elapsed_s']:.1f} s")
+        if summary["tiles_per_s"] is not None:
+            lines.append(f"- Throughput: {summary['tiles_per_s']:.2f} tiles/s")
+        lines.append(f"- Bytes written: {summary['bytes_written'] / 1e6:.1f} MB")
+        lines.append(f"- Network requests: {self.network_requests}")
+        lines.append("")
+
+        # --- Stage breakdown ---
+        exported = [tile for tile in tiles if tile.get("status") != "skipped"]
+        total_ms = sum(tile["latency_ms"] for tile in exported) or 1.0
+        lines += ["## Stage breakdown", "",
+                  "| Stage | Total s | Mean ms | p95 ms | Share |",
+                  "|---|---:|---:|---:|---:|"]
+        stage_names = list(STAGES) + sorted({stage for tile in exported for stage in tile["stages_ms"]} - set(STAGES))
+        for stage in stage_names:
+            values = sorted(tile["stages_ms"][stage] for tile in exported if stage in tile["stages_ms"])
+            if not values:
+                continue
+            total = sum(values)
+            lines.append(f"| {stage} | {total / 1000:.2f} | {total / len(values):.1f} | "
+                         f"{percentile(values, 95):.1f} | {100 * total / total_ms:.1f}% |")
+        lines.append("")
+
+        # --- Slowest tiles ---
+        lines += ["## Slowest tiles", "", "| fid | Latency ms | Slowest stage | Network requests |", "|---:|---:|---|---:|"]
+        for tile in sorted(exported, key=lambda tile: tile["latency_ms"], reverse=True)[:10]:
+            stages = tile["stages_ms"]
+            slowest = max(stages, key=stages.get) if stages else "n/a"
+            lines.append(f"| {tile['fid']} | {tile['latency_ms']:.0f} | {slowest} | {tile.get('network_requests', 'n/a')} |")
+        lines.append("")
+
+        # --- Counters and memory ---
+        if self.counters:
+            lines += ["## Counters", ""]
+            lines += [f"- {name}: {value}" for name, value in sorted(self.counters.items())]
+            lines.append("")
+
+        lines += ["## Memory", ""]
+        peak = peak_rss_mb()
+        lines.append(f"- Process peak RSS: {peak:.0f} MB" if peak is not None else "- Process peak RSS: n/a")
+        if self.rss_high_water:
+            lines.append(f"- Highest RSS seen between tiles: {self.rss_high_water:.0f} MB")
+        python_peaks = [sample["python_peak_mb"] for sample in self.samples if "python_peak_mb" in sample]
+        if python_peaks:
+            lines.append(f"- Python heap peak (tracemalloc): {max(python_peaks):.1f} MB")
+        lines.append("")
+
+        # --- Sampled tiles ---
+        for sample in self.samples:
+            lines += [f"## Sampled tile {sample['fid']}", ""]
+            if "profile" in sample:
+                lines += ["```", sample["profile"].strip(), "```", ""]
+            if sample.get("allocations"):
+                lines += ["Largest allocation growth since start:", "", "```"] + sample["allocations"] + ["```", ""]
+
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        print(f"Profile report written to {self.report_path}")
+        return self.report_path
+
+
+def profiler_from_job(job, log_path, suffix=""):
+    if not job.get("profile"):
+        return None
+    report_path = job.get("profile_report") or os.path.splitext(log_path)[0] + "_profile.md"
+    if suffix:
+        base, ext = os.path.splitext(report_path)
+        report_path = f"{base}{suffix}{ext}"
+    return ExportProfiler(
+        report_path,
+        sample_every=job.get("profile_sample_every", 0),
+        use_cprofile=job.get("profile_cprofile", True),
+        use_tracemalloc=job.get("profile_tracemalloc", False)
+    )
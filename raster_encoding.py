@@ -0,0 +1,160 @@
+import os
+from osgeo import gdal
+
+COMPRESSIONS = ("NONE", "DEFLATE", "ZSTD", "LZW", "JPEG")
+OVERVIEW_RESAMPLING = "AVERAGE"
+
+
+class RasterEncoding:
+    # GeoTIFF creation settings for one kind of output (visual or elevation).
+    # The default writes plain striped, uncompressed GeoTIFFs like earlier versions.
+
+    def __init__(self, compress="NONE", predictor="auto", level=None, quality=None,
+                 tiled=False, block_size=256, overviews=None, cog=False):
+        compress = (compress or "NONE").upper()
+        if compress not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compress}', expected one of {', '.join(COMPRESSIONS)}")
+        self.compress = compress
+        self.predictor = predictor
+        self.level = level
+        self.quality = quality
+        self.tiled = tiled or cog
+        self.block_size = block_size
+        self.overviews = list(overviews or [])
+        self.cog = cog
+
+    @classmethod
+    def from_config(cls, config):
+        # None, a compression name, or a table of keyword arguments
+        if config is None:
+            return cls()
+        if isinstance(config, str):
+            return cls(compress=config)
+        if isinstance(config, RasterEncoding):
+            return config
+        return cls(**config)
+
+    def is_default(self):
+        return self.compress == "NONE" and not self.tiled and not self.overviews and not self.cog
+
+    def describe(self):
+        parts = [self.compress]
+        if self.cog:
+            parts.append("COG")
+        elif self.tiled:
+            parts.append(f"tiled {self.block_size}")
+        if self.overviews:
+            parts.append("overviews " + ",".join(str(level) for level in self.overviews))
+        return " ".join(parts)
+
+    def check(self, data_type):
+        if self.compress == "JPEG" and data_type != gdal.GDT_Byte:
+            raise ValueError("JPEG compression only applies to 8-bit visual tiles.")
+
+    def predictor_value(self, data_type):
+        if self.compress not in ("DEFLATE", "ZSTD", "LZW") or not self.predictor:
+            return None
+        if self.predictor == "auto":
+            # Horizontal differencing for imagery, floating point predictor for elevations
+            return 3 if data_type in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+        return int(self.predictor)
+
+    def compression_options(self, data_type, bands):
+        options = []
+        if self.compress == "NONE":
+            return options
+        options.append(f"COMPRESS={self.compress}")
+
+        predictor = self.predictor_value(data_type)
+        if predictor:
+            options.append(f"PREDICTOR={predictor}")
+        if self.level is not None and self.compress == "DEFLATE":
+            options.append(f"{'LEVEL' if self.cog else 'ZLEVEL'}={self.level}")
+        if self.level is not None and self.compress == "ZSTD":
+            options.append(f"{'LEVEL' if self.cog else 'ZSTD_LEVEL'}={self.level}")
+        if self.compress == "JPEG":
+            if self.quality is not None:
+                options.append(f"{'QUALITY' if self.cog else 'JPEG_QUALITY'}={self.quality}")
+            if bands == 3 and not self.cog:
+                options.append("PHOTOMETRIC=YCBCR")
+        return options
+
+    def gtiff_options(self, data_type, bands):
+        options = self.compression_options(data_type, bands)
+        if self.tiled:
+            options += ["TILED=YES", f"BLOCKXSIZE={self.block_size}", f"BLOCKYSIZE={self.block_size}"]
+        return options
+
+    def cog_options(self, data_type, bands):
+        options = self.compression_options(data_type, bands) + [f"BLOCKSIZE={self.block_size}"]
+        options.append(f"OVERVIEW_RESAMPLING={OVERVIEW_RESAMPLING}")
+        options.append("OVERVIEWS=AUTO" if self.overviews else "OVERVIEWS=NONE")
+        # The COG driver always halves per level, so only the number of levels carries over
+        if self.overviews:
+            options.append(f"OVERVIEW_COUNT={len(self.overviews)}")
+        return options
+
+    def create(self, path, width, height, bands, data_type):
+        # COG files can only be produced by copying, so they are assembled in memory first
+        self.check(data_type)
+        if self.cog:
+            dataset = gdal.GetDriverByName("MEM").Create("", width, height, bands, data_type)
+        else:
+            dataset = gdal.GetDriverByName("GTiff").Create(path, width, height, bands, data_type,
+                                                          options=self.gtiff_options(data_type, bands))
+        if dataset is None:
+            raise Exception(f"GDAL could not create {path}")
+        return dataset
+
+    def finish(self, dataset, path):
+        data_type = dataset.GetRasterBand(1).DataType
+        bands = dataset.RasterCount
+
+        if self.cog:
+            out = gdal.GetDriverByName("COG").CreateCopy(path, dataset, options=self.cog_options(data_type, bands))
+            if out is None:
+                raise Exception(f"GDAL could not write COG {path}")
+            out = None
+            return
+
+        if self.overviews:
+            # Overviews use the same compression as the full resolution data. Thread local,
+            # since pipelined visual and DEM writers build overviews with different encodings.
+            compression = self.compression_options(data_type, bands)
+            for option in compression:
+                key, value = option.split("=", 1)
+                gdal.SetThreadLocalConfigOption(f"{key}_OVERVIEW", value)
+            try:
+                dataset.BuildOverviews(OVERVIEW_RESAMPLING, self.overviews)
+            finally:
+                for option in compression:
+                    key = option.split("=", 1)[0]
+                    gdal.SetThreadLocalConfigOption(f"{key}_OVERVIEW", None)
+        dataset.FlushCache()
+
+    def recode(self, path):
+        # Rewrites a finished GeoTIFF (e.g. from the layout exporter) with these settings
+        if self.is_default():
+            return
+        source = gdal.Open(path, gdal.GA_ReadOnly)
+        if source is None:
+            raise Exception(f"GDAL could not open {path}")
+
+        tmp_path = f"{path}.recode.tif"
+        data_type = source.GetRasterBand(1).DataType
+        self.check(data_type)
+        driver = gdal.GetDriverByName("COG" if self.cog else "GTiff")
+        options = self.cog_options(data_type, source.RasterCount) if self.cog \
+            else self.gtiff_options(data_type, source.RasterCount)
+        out = driver.CreateCopy(tmp_path, source, options=options)
+        source = None
+        if out is None:
+            raise Exception(f"GDAL could not recode {path}")
+        if not self.cog:
+            self.finish(out, tmp_path)
+        out = None
+
+        os.replace(tmp_path, path)
+        aux_path = f"{path}.aux.xml"
+        if os.path.exists(f"{tmp_path}.aux.xml"):
+            os.replace(f"{tmp_path}.aux.xml", aux_path)
@@ -0,0 +1,116 @@
+import math
+from collections import OrderedDict
+from qgis.core import QgsMapSettings, QgsRectangle, QgsVectorLayer
+from qgis.PyQt.QtCore import QRect, QSize
+from qgis.PyQt.QtGui import QColor, QPainter
+from .mosaic_export import MOSAIC_BLOCK_PX
+from .virtual_grid import regular_grid
+
+# Region images kept at once; the export visits tiles region by region, so a few are enough
+REGION_CACHE_SIZE = 4
+
+
+def static_layers(layers):
+    # The bottom run of layers that draws the same whatever the tile. Labels are placed per
+    # map extent, so the first labelled vector layer and everything above it stay per tile.
+    static = []
+    for layer in reversed(layers):
+        if isinstance(layer, QgsVectorLayer) and layer.labelsEnabled():
+            break
+        static.append(layer)
+    static.reverse()
+    return static
+
+
+class RegionCache:
+    # Draws the static bottom layers once for a block of neighbouring cells and crops every
+    # tile in the block out of that image. Only the layers above them are rendered per tile,
+    # on a transparent background, and painted over the crop.
+    # QgsMapRendererCache only reuses layer images for an identical extent, so it can't share
+    # work between tiles; the region image is the equivalent across extents.
+
+    def __init__(self, renderer, grid):
+        self.renderer = renderer
+        self.grid = grid
+        layers = renderer.settings.layers()
+        self.static = static_layers(layers)
+        self.dynamic = layers[:len(layers) - len(self.static)]
+
+        size = renderer.settings.outputSize()
+        self.tile_width = size.width()
+        self.tile_height = size.height()
+        self.block = max(1, MOSAIC_BLOCK_PX // max(self.tile_width, self.tile_height))
+
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_renderer(cls, renderer, coverage):
+        # Regions are laid out on the grid, so the grid must be regular and in the render CRS
+        if renderer.to_dest:
+            raise Exception("the grid is not in the project CRS")
+        cache = cls(renderer, regular_grid(coverage))
+        if not cache.static:
+            raise Exception("every layer is labelled, nothing to reuse")
+        return cache
+
+    def describe(self):
+        return (f"{len(self.static)} static layers cached per {self.block} x {self.block} cells, "
+                f"{len(self.dynamic)} drawn per tile")
+
+    def region_of(self, extent):
+        center = extent.center()
+        col = math.floor((center.x() - self.grid.xmin) / self.grid.h_spacing)
+        row = math.floor((center.y() - self.grid.ymin) / self.grid.v_spacing)
+        return col // self.block, row // self.block
+
+    def region_image(self, key, resolution):
+        # (image, left x, top y) of a region and whether it was rendered for this call
+        if key in self.images:
+            self.images.move_to_end(key)
+            self.hits += 1
+            return self.images[key], False
+
+        grid = self.grid
+        col0, row0 = key[0] * self.block, key[1] * self.block
+        col1 = min(grid.cols, col0 + self.block)
+        row1 = min(grid.rows, row0 + self.block)
+        # Every tile is centred on its cell, so one tile's margin around the cells covers them all
+        margin_x = self.tile_width * resolution / 2 - grid.h_spacing / 2
+        margin_y = self.tile_height * resolution / 2 - grid.v_spacing / 2
+        x_min = grid.xmin + col0 * grid.h_spacing - margin_x
+        y_max = grid.ymin + row1 * grid.v_spacing + margin_y
+        width = int(math.ceil((grid.xmin + col1 * grid.h_spacing + margin_x - x_min) / resolution)) + 1
+        height = int(math.ceil((y_max - (grid.ymin + row0 * grid.v_spacing - margin_y)) / resolution)) + 1
+
+        settings = QgsMapSettings(self.renderer.settings)
+        settings.setLayers(self.static)
+        settings.setOutputSize(QSize(width, height))
+        settings.setExtent(QgsRectangle(x_min, y_max - height * resolution, x_min + width * resolution, y_max))
+        image = self.renderer.render_settings(settings)
+
+        self.images[key] = (image, x_min, y_max)
+        while len(self.images) > REGION_CACHE_SIZE:
+            self.images.popitem(last=False)
+        self.misses += 1
+        return self.images[key], True
+
+    def render(self, extent):
+        # Same image the renderer would draw for extent (a visible tile extent); returns it and
+        # whether its region had to be rendered first
+        resolution = extent.width() / self.tile_width
+        (region, x_min, y_max), rendered = self.region_image(self.region_of(extent), resolution)
+        px = int(round((extent.xMinimum() - x_min) / resolution))
+        py = int(round((y_max - extent.yMaximum()) / resolution))
+        image = region.copy(QRect(px, py, self.tile_width, self.tile_height))
+
+        if self.dynamic:
+            settings = self.renderer.map_settings(extent)
+            settings.setLayers(self.dynamic)
+            settings.setBackgroundColor(QColor(0, 0, 0, 0))
+            top = self.renderer.render_settings(settings)
+            painter = QPainter(image)
+            painter.drawImage(0, 0, top)
+            painter.end()
+        return image, rendered
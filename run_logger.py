@@ -0,0 +1,198 @@
+import json
+import math
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-tile stages, in pipeline order. Atlas mode reports seek and render
+# (exportToImage renders, encodes and writes in one call); the direct
+# renderer reports render, encode and write separately. Both report the
+# DEM transform and clip.
+STAGES = ("seek", "render", "encode", "transform", "clip", "write")
+
+_CLOSE = object()
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def build_summary(tiles, elapsed_s):
+    latencies = sorted(tile["latency_ms"] for tile in tiles if tile.get("status") != "skipped")
+    stage_totals = {}
+    for tile in tiles:
+        for stage, ms in tile.get("stages_ms", {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+
+    exported = len(latencies)
+    return {
+        "event": "summary",
+        "tiles": len(tiles),
+        "completed": sum(1 for tile in tiles if tile.get("status") == "complete"),
+        "failed": sum(1 for tile in tiles if tile.get("status", "").startswith("failed")),
+        "skipped": sum(1 for tile in tiles if tile.get("status") == "skipped"),
+        "rendered": sum(1 for tile in tiles
+                        if tile.get("status") != "skipped" and "visual" not in tile.get("reused", ())),
+        "elapsed_s": round(elapsed_s, 3),
+        "tiles_per_s": round(exported / elapsed_s, 3) if elapsed_s > 0 else None,
+        "bytes_written": sum(tile.get("bytes_written", 0) for tile in tiles),
+        "bytes_visual": sum(tile.get("visual_bytes", 0) for tile in tiles),
+        "bytes_elevation": sum(tile.get("elevation_bytes", 0) for tile in tiles),
+        # Outputs an incremental run kept, and tiles copied from a shifted cell
+        "reused_visual": sum(1 for tile in tiles if "visual" in tile.get("reused", ())),
+        "reused_elevation": sum(1 for tile in tiles if "elevation" in tile.get("reused", ())),
+        "reused_moved": sum(1 for tile in tiles if "reused_from" in tile),
+        # Tiles cropped from an already rendered region image, and those that rendered one
+        "cache_hits": sum(1 for tile in tiles if tile.get("render_cache") == "hit"),
+        "cache_misses": sum(1 for tile in tiles if tile.get("render_cache") == "miss"),
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "stage_ms": {stage: round(total, 1) for stage, total in stage_totals.items()},
+    }
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def summarize_log(path, elapsed_s):
+    tiles = [record for record in read_records(path) if record.get("event") == "tile"]
+    return build_summary(tiles, elapsed_s)
+
+
+class TileRecord:
+    def __init__(self, fid):
+        self.fid = fid
+        self.start = time.perf_counter()
+        self.stages_ms = {}
+        self.bytes_written = 0
+        self.errors = []
+        self.extra = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages_ms[name] = self.stages_ms.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+class RunLogger:
+    # One open handle, written by a background thread so the export loop never waits on the disk
+
+    def __init__(self, path, context=None, flush_interval=1.0):
+        self.path = path
+        self.context = context or {}
+        self.flush_interval = flush_interval
+        self.start = time.perf_counter()
+        self.tiles = []
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        last_flush = time.perf_counter()
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+
+            if record is _CLOSE:
+                self._file.flush()
+                return
+            if record is not None:
+                self._file.write(json.dumps(record) + "\n")
+
+            if time.perf_counter() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.perf_counter()
+
+    def event(self, kind, **fields):
+        record = {"ts": round(time.time(), 3), "event": kind}
+        record.update(self.context)
+        record.update(fields)
+        self._queue.put(record)
+        return record
+
+    def message(self, text, **fields):
+        return self.event("message", message=text, **fields)
+
+    def tile(self, record, status):
+        latency_ms = (time.perf_counter() - record.start) * 1000.0
+        fields = {
+            "fid": record.fid,
+            "status": status,
+            "latency_ms": round(latency_ms, 2),
+            "stages_ms": {stage: round(ms, 2) for stage, ms in record.stages_ms.items()},
+            "bytes_written": record.bytes_written,
+        }
+        if record.errors:
+            fields["errors"] = record.errors
+        fields.update(record.extra)
+
+        self.tiles.append(fields)
+        return self.event("tile", **fields)
+
+    def summary(self):
+        return build_summary(self.tiles, time.perf_counter() - self.start)
+
+    def close(self, write_summary=True):
+        summary = None
+        if write_summary:
+            summary = self.summary()
+            summary.update(self.context)
+            self._queue.put(summary)
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._file.close()
+        return summary
+
+
+def format_summary(summary):
+    latency = summary["latency_ms"]
+
+    def ms(value):
+        return f"{value:.0f} ms" if value is not None else "n/a"
+
+    rate = f"{summary['tiles_per_s']:.2f} tiles/s" if summary["tiles_per_s"] is not None else "n/a"
+    # Encoding and compression happen in the encode and write stages
+    stages = summary.get("stage_ms", {})
+    encode_s = (stages.get("encode", 0.0) + stages.get("write", 0.0)) / 1000.0
+    extras = ""
+    if summary.get("reused_visual") or summary.get("reused_elevation"):
+        extras += (f"reused {summary['reused_visual']} visual / {summary['reused_elevation']} elevation tiles "
+                  f"({summary['reused_moved']} from moved cells), ")
+    cached = summary.get("cache_hits", 0) + summary.get("cache_misses", 0)
+    if cached:
+        extras += f"render cache {summary['cache_hits']}/{cached} hits ({summary['cache_hits'] / cached:.0%}), "
+    if "pixels_saved" in summary:
+        # Negative when the target resolution needs more than 300 dpi
+        saved = summary["pixels_saved"]
+        extras += (f"{summary['dpi']:g} dpi ({abs(saved) / 1e6:,.1f} MP {'fewer' if saved >= 0 else 'more'} "
+                   f"than at 300 dpi), ")
+    return (("Cancelled: " if summary.get("cancelled") else "") +
+            f"{summary['completed']} complete, {summary['failed']} failed, {summary['skipped']} skipped "
+            f"in {summary['elapsed_s']:.1f} s ({rate}), {summary['bytes_written'] / 1e6:.1f} MB written "
+            f"(visual {summary.get('bytes_visual', 0) / 1e6:.1f} MB, elevation {summary.get('bytes_elevation', 0) / 1e6:.1f} MB), "
+            f"encode {encode_s:.1f} s, " + extras +
+            f"latency p50 {ms(latency['p50'])} / p95 {ms(latency['p95'])} / p99 {ms(latency['p99'])}")
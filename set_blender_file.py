@@ -2,6 +2,7 @@ import shutil
 import subprocess
 import os
 import platform
+from .manifest import MANIFEST_NAME
 
 plugin_dir = os.path.dirname(__file__)
 
@@ -20,9 +21,10 @@ def copy_blender_script(src_path, dest_path):
     shutil.copyfile(src_path, dest_path)
     print(f"Copied Blender script to: {dest_path}")
 
-def patch_blender_script(file_path, new_visual_path, new_elevation_path, crs):
+def patch_blender_script(file_path, new_visual_path, new_elevation_path, crs, manifest_path=None):
     visual_path = sanitize_path(new_visual_path)
     elevation_path = sanitize_path(new_elevation_path)
+    manifest_path = sanitize_path(manifest_path or os.path.join(new_visual_path, MANIFEST_NAME))
 
     with open(file_path, "r") as f:
         lines = f.readlines()
@@ -35,15 +37,19 @@ def patch_blender_script(file_path, new_visual_path, new_elevation_path, crs):
                 f.write(f"elvfolder = r'{elevation_path}'\n")
             elif line.strip().startswith("crs ="):
                 f.write(f"crs = r'{crs}'\n")
+            elif line.strip().startswith("manifest_path ="):
+                f.write(f"manifest_path = r'{manifest_path}'\n")
             else:
                 f.write(line)
     print("Blender script patched successfully.")
 
-def prepare_blender_script(plugin_dir, visual_path, elevation_path, grid_crs):
+def prepare_blender_script(plugin_dir, visual_path, elevation_path, render_crs, open_output=True):
     src = sanitize_path(os.path.join(plugin_dir, "blender_import_template.py"))
     dest = sanitize_path(os.path.join(plugin_dir, "blender_import.py"))
     copy_blender_script(src, dest)
-    crs = grid_crs
-    print(f"CRS passed to patch_blender_script: '{grid_crs}'")
+    crs = render_crs
+    print(f"CRS passed to patch_blender_script: '{render_crs}'")
     patch_blender_script(dest, visual_path, elevation_path, crs)
-    open_folder(os.path.dirname(dest))
\ No newline at end of file
+    if open_output:
+        open_folder(os.path.dirname(dest))
+    return dest
\ No newline at end of file
@@ -0,0 +1,186 @@
+import json
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from qgis.core import QgsFeatureRequest, QgsProject
+from .headless import python_executable
+from .export_worker import PROGRESS_PREFIX
+from .virtual_grid import VirtualGrid, cell_id_request, feature_fid
+from .run_logger import summarize_log, format_summary
+
+
+def split_fid_ranges(fids, shard_count):
+    # Contiguous, inclusive (first, last) fid ranges of near-equal size
+    if not isinstance(fids, range):
+        fids = sorted(fids)
+    shard_count = max(1, min(shard_count, len(fids)))
+    size, extra = divmod(len(fids), shard_count)
+
+    ranges = []
+    start = 0
+    for index in range(shard_count):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append((fids[start], fids[end - 1]))
+        start = end
+    return ranges
+
+
+def save_project_copy(project, path):
+    # QgsProject.write(path) retargets the open project, so put the file name back
+    original = project.fileName()
+    if not project.write(path):
+        raise Exception(f"Could not write project copy to {path}: {project.error()}")
+    project.setFileName(original)
+
+
+def merge_shard_logs(log_path, shard_logs):
+    # Shard records are already tagged with their shard, so the JSONL files just concatenate
+    with open(log_path, "a", encoding="utf-8") as log:
+        for index, shard_log in enumerate(shard_logs):
+            if os.path.exists(shard_log):
+                with open(shard_log, "r", encoding="utf-8") as f:
+                    log.write(f.read())
+                os.remove(shard_log)
+            else:
+                log.write(json.dumps({"ts": round(time.time(), 3), "event": "message", "shard": index,
+                                      "message": "No log written."}) + "\n")
+
+
+def _read_output(shard_index, stream, events):
+    for line in stream:
+        events.put((shard_index, line.rstrip("\n")))
+    events.put((shard_index, None))
+
+
+class ShardPlan:
+    def __init__(self, job_path, ranges, total, log_path, cancel_path):
+        self.job_path = job_path
+        self.ranges = ranges
+        self.total = total
+        self.log_path = log_path
+        self.cancel_path = cancel_path
+
+
+def prepare_shards(job, grid_layer, log_path, shard_count=None):
+    # Main thread part: split the grid and write the project copy and job file
+    project = QgsProject.instance()
+    shard_count = shard_count or os.cpu_count() or 1
+
+    if isinstance(grid_layer, VirtualGrid):
+        fids = grid_layer.fids()
+    else:
+        # Tile fids, which for filtered grid layers differ from the feature ids
+        request, index = cell_id_request(grid_layer)
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        fids = sorted(feature_fid(feature, index) for feature in grid_layer.getFeatures(request))
+    if not fids:
+        raise Exception("Grid layer has no features to export.")
+    ranges = split_fid_ranges(fids, shard_count)
+
+    # === SERIALIZE PROJECT AND JOB ===
+    work_dir = tempfile.mkdtemp(prefix="rockycrop_shards_")
+    project_path = os.path.join(work_dir, "project.qgz")
+    save_project_copy(project, project_path)
+
+    # Workers stop after their current tile once this file exists
+    cancel_path = os.path.join(work_dir, "cancel")
+
+    grid_layer_id = None if isinstance(grid_layer, VirtualGrid) else grid_layer.id()
+    job = dict(job, project=project_path, grid_layer_id=grid_layer_id, cancel_path=cancel_path)
+    job_path = os.path.join(work_dir, "job.json")
+    with open(job_path, "w") as f:
+        json.dump(job, f, indent=2)
+
+    return ShardPlan(job_path, ranges, len(fids), log_path, cancel_path)
+
+
+def run_shards(plan, progress_callback=None, should_cancel=None):
+    # Only starts and watches processes, so it can run on any thread
+    run_start = time.perf_counter()
+    log_path = plan.log_path
+
+    # === START WORKERS ===
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_worker.py")
+    creation_flags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+    events = queue.Queue()
+    processes = []
+    shard_logs = []
+
+    for index, (first, last) in enumerate(plan.ranges):
+        shard_log = f"{log_path}.shard{index}"
+        shard_logs.append(shard_log)
+        command = [
+            python_executable(), worker_script,
+            "--job", plan.job_path,
+            "--shard", str(index),
+            "--first", str(first),
+            "--last", str(last),
+            "--log", shard_log
+        ]
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            creationflags=creation_flags
+        )
+        threading.Thread(target=_read_output, args=(index, process.stdout, events), daemon=True).start()
+        processes.append(process)
+
+    print(f"Started {len(processes)} export workers for {plan.total} tiles")
+
+    # === COLLECT PROGRESS ===
+    done = 0
+    total = plan.total
+    open_streams = len(processes)
+    cancelled = False
+    while open_streams:
+        if not cancelled and should_cancel and should_cancel():
+            open(plan.cancel_path, "w").close()
+            cancelled = True
+            print("Export cancelled, waiting for workers to finish their current tile")
+
+        try:
+            shard_index, line = events.get(timeout=0.1)
+        except queue.Empty:
+            if progress_callback:
+                progress_callback(done, total)
+            continue
+
+        if line is None:
+            open_streams -= 1
+        elif line.startswith(PROGRESS_PREFIX):
+            done += 1
+            if progress_callback:
+                progress_callback(done, total)
+        else:
+            print(f"[shard {shard_index}] {line}")
+
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+
+    # Run-wide summary over every shard's tile records, only this run's part of the log
+    run_log = f"{log_path}.run"
+    merge_shard_logs(run_log, shard_logs)
+    summary = summarize_log(run_log, time.perf_counter() - run_start)
+    summary["shards"] = len(processes)
+    if cancelled:
+        summary["cancelled"] = True
+    with open(run_log, "a", encoding="utf-8") as log:
+        log.write(json.dumps(summary) + "\n")
+    merge_shard_logs(log_path, [run_log])
+
+    if failed:
+        raise Exception(f"Export shards failed: {failed}")
+
+    print(f"Sharded export finished: {done}/{total} tiles")
+    print(format_summary(summary))
+    return summary
+
+
+def run_sharded_export(job, grid_layer, log_path, shard_count=None, progress_callback=None, should_cancel=None):
+    plan = prepare_shards(job, grid_layer, log_path, shard_count)
+    return run_shards(plan, progress_callback, should_cancel)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from qgis.core import QgsMapLayerStyle
+from .dem_clip import DEM_BUFFER
+
+# Decimals extents are compared at, well below a pixel in metres or degrees
+EXTENT_DECIMALS = 7
+
+
+def digest(values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def layer_identity(layer):
+    # Source plus a hash of the full style, so a symbology change counts as a new input
+    style = QgsMapLayerStyle()
+    style.readFromLayer(layer)
+    return [layer.id(), layer.providerType(), layer.source(), digest(style.xmlData())]
+
+
+def source_identity(manifest, source):
+    # Content checksum for local files (cached by size and mtime), the source string otherwise
+    path = source.split("|")[0]
+    if os.path.isfile(path):
+        return {"sha256": manifest.source_checksum(path)}
+    return {"source": source}
+
+
+def export_settings(dem_layer, layers, dpi, page_size_mm, render_mode, visual_encoding, elevation_encoding,
+                    elevation_grid=None, elevation_resampling=None):
+    # Digest of the run settings every tile shares, so resume redoes tiles written with other ones.
+    # Cheap enough for every run: the DEM is identified by path, size and mtime, not its content.
+    path = dem_layer.source().split("|")[0]
+    dem = [path, os.path.getsize(path), os.path.getmtime(path)] if os.path.isfile(path) else [dem_layer.source()]
+    return digest({
+        "layers": [layer_identity(layer) for layer in layers],
+        "dpi": dpi,
+        "page_mm": list(page_size_mm),
+        "render_mode": render_mode,
+        "visual_encoding": vars(visual_encoding),
+        "elevation_encoding": vars(elevation_encoding),
+        "dem": dem,
+        "buffer": DEM_BUFFER,
+        "elevation_grid": [elevation_grid, elevation_resampling] if elevation_grid else None,
+    })
+
+
+class TileInputs:
+    # Fingerprints of what each tile output is made from. The visual depends on the cell
+    # extent, rendered layers, DPI and page size; the elevation on the DEM window and the DEM file.
+
+    def __init__(self, manifest, dem_layer, layers, dpi, page_size_mm, render_mode, visual_encoding, elevation_encoding,
+                 elevation_grid=None, elevation_resampling=None):
+        self.visual_base = {
+            "layers": [layer_identity(layer) for layer in layers],
+            "dpi": dpi,
+            "page_mm": list(page_size_mm),
+            "render_mode": render_mode,
+            "encoding": vars(visual_encoding),
+        }
+        self.elevation_base = {
+            "dem": source_identity(manifest, dem_layer.source()),
+            "buffer": DEM_BUFFER,
+            "encoding": vars(elevation_encoding),
+        }
+        # Added only when set, so native resolution tiles keep their earlier fingerprints
+        if elevation_grid:
+            self.elevation_base["grid"] = [elevation_grid, elevation_resampling]
+
+    def visual(self, extent):
+        bounds = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
+        return digest(dict(self.visual_base, extent=[round(value, EXTENT_DECIMALS) for value in bounds]))
+
+    def elevation(self, dem_bounds):
+        return digest(dict(self.elevation_base, dem_extent=[round(value, EXTENT_DECIMALS) for value in dem_bounds]))
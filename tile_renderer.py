@@ -0,0 +1,146 @@
+from qgis.core import (
+    QgsMapLayer,
+    QgsMapSettings,
+    QgsMapRendererParallelJob,
+    QgsCoordinateReferenceSystem,
+)
+from qgis.PyQt.QtCore import QSize
+from qgis.PyQt.QtGui import QColor, QImage
+from osgeo import gdal
+from .transforms import get_transform
+from .raster_encoding import RasterEncoding
+
+MM_PER_INCH = 25.4
+
+# Visual tiles are written as RGB, the alpha channel is dropped
+VISUAL_BANDS = 3
+
+
+def page_size_pixels(page_width_mm, page_height_mm, dpi):
+    # Same rounding QgsLayoutExporter uses when exporting a page to an image
+    width = int(page_width_mm / MM_PER_INCH * dpi + 0.5)
+    height = int(page_height_mm / MM_PER_INCH * dpi + 0.5)
+    return width, height
+
+
+def visible_layers(project):
+    # Layers a layout map item would draw when it is not locked to a layer set
+    root = project.layerTreeRoot()
+    checked = set(layer.id() for layer in root.checkedLayers())
+    return [layer for layer in root.layerOrder() if layer.id() in checked]
+
+
+def export_layers(project, coverage=None, names=None):
+    # Layers drawn into the visual tiles: the named ones (names or ids, in layer tree order),
+    # or the visible ones without the grid overlay
+    if names:
+        wanted = set(names)
+        layers = [layer for layer in project.layerTreeRoot().layerOrder()
+                  if layer.id() in wanted or layer.name() in wanted]
+        missing = wanted - set(layer.id() for layer in layers) - set(layer.name() for layer in layers)
+        if missing:
+            raise Exception(f"Visual layers not found: {', '.join(sorted(missing))}")
+        return layers
+
+    layers = visible_layers(project)
+    if isinstance(coverage, QgsMapLayer):
+        layers = [layer for layer in layers if layer.id() != coverage.id()]
+    return layers
+
+
+def image_to_rgba(image):
+    # Pixel-interleaved RGBA bytes plus the layout needed to write them
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    ptr = image.constBits()
+    ptr.setsize(image.bytesPerLine() * image.height())
+    return bytes(ptr), image.width(), image.height(), image.bytesPerLine()
+
+
+def write_geotiff(image, extent, crs, path, encoding=None):
+    write_rgba_geotiff(*image_to_rgba(image), extent, crs, path, encoding)
+
+
+def write_rgba_geotiff(data, width, height, line_bytes, extent, crs, path, encoding=None):
+    encoding = encoding or RasterEncoding()
+    dataset = encoding.create(path, width, height, VISUAL_BANDS, gdal.GDT_Byte)
+
+    dataset.SetGeoTransform((
+        extent.xMinimum(), extent.width() / width, 0.0,
+        extent.yMaximum(), 0.0, -extent.height() / height
+    ))
+    dataset.SetProjection(crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL))
+
+    # Pixel-interleaved RGBA buffer straight from Qt, alpha is dropped
+    dataset.WriteRaster(
+        0, 0, width, height, data,
+        band_list=[1, 2, 3],
+        buf_pixel_space=4,
+        buf_line_space=line_bytes,
+        buf_band_space=1
+    )
+    for index, interp in enumerate((gdal.GCI_RedBand, gdal.GCI_GreenBand, gdal.GCI_BlueBand), start=1):
+        dataset.GetRasterBand(index).SetColorInterpretation(interp)
+
+    encoding.finish(dataset, path)
+    dataset = None
+
+
+class DirectTileRenderer:
+    # Renders grid cells straight through QgsMapSettings, no layout or atlas involved
+
+    def __init__(self, project, coverage_crs, page_width_mm, page_height_mm, dpi=300, layers=None, dest_crs=None):
+        self.project = project
+        self.dest_crs = dest_crs or project.crs()
+        self.dpi = dpi
+
+        width, height = page_size_pixels(page_width_mm, page_height_mm, dpi)
+
+        self.settings = QgsMapSettings()
+        self.settings.setLayers(layers if layers is not None else visible_layers(project))
+        self.settings.setDestinationCrs(self.dest_crs)
+        self.settings.setTransformContext(project.transformContext())
+        self.settings.setOutputDpi(dpi)
+        self.settings.setOutputSize(QSize(width, height))
+        self.settings.setBackgroundColor(QColor(255, 255, 255))
+        self.settings.setFlag(QgsMapSettings.Antialiasing, True)
+
+        self.to_dest = None
+        if coverage_crs != self.dest_crs:
+            self.to_dest = get_transform(coverage_crs, self.dest_crs, project)
+
+    def cell_extent(self, bbox):
+        # Cell bounding box in coverage CRS -> destination CRS
+        if self.to_dest:
+            bbox = self.to_dest.transformBoundingBox(bbox)
+        return bbox
+
+    def map_settings(self, extent):
+        settings = QgsMapSettings(self.settings)
+        # setExtent widens to the output aspect ratio, centred like an atlas map in fixed mode
+        settings.setExtent(extent)
+        return settings
+
+    def visible_extent(self, bbox):
+        return self.map_settings(self.cell_extent(bbox)).visibleExtent()
+
+    def render(self, extent):
+        settings = self.map_settings(extent)
+        return self.render_settings(settings), settings.visibleExtent()
+
+    def render_region(self, extent, width, height):
+        # Any output size at the renderer's DPI, used for mosaic strips
+        settings = QgsMapSettings(self.settings)
+        settings.setOutputSize(QSize(width, height))
+        settings.setExtent(extent)
+        return self.render_settings(settings)
+
+    def render_settings(self, settings):
+        job = QgsMapRendererParallelJob(settings)
+        job.start()
+        job.waitForFinished()
+        return job.renderedImage()
+
+    def render_to_file(self, bbox, path, encoding=None):
+        image, extent = self.render(self.cell_extent(bbox))
+        write_geotiff(image, extent, self.dest_crs, path, encoding)
+        return extent
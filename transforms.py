@@ -0,0 +1,144 @@
+import numpy as np
+from osgeo import osr
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsPointXY,
+    QgsProject,
+    QgsRectangle
+)
+
+# Points per bounding box edge, like QgsCoordinateTransform.transformBoundingBox
+EDGE_POINTS = 21
+
+_crs_cache = {}
+_transform_cache = {}
+_osr_cache = {}
+
+
+def crs_key(crs):
+    return crs.authid() or crs.toWkt()
+
+
+def get_crs(crs):
+    # Accepts an authid string or a CRS; building CRS objects from strings is not free
+    if isinstance(crs, QgsCoordinateReferenceSystem):
+        return crs
+    if crs not in _crs_cache:
+        _crs_cache[crs] = QgsCoordinateReferenceSystem(crs)
+    return _crs_cache[crs]
+
+
+def transform_context(context=None):
+    if context is None:
+        return QgsProject.instance().transformContext()
+    if isinstance(context, QgsProject):
+        return context.transformContext()
+    return context
+
+
+def get_transform(source_crs, dest_crs, context=None):
+    # One QgsCoordinateTransform per (source, destination, context). Transforms are not
+    # thread safe, so this is for the thread driving the export.
+    source_crs = get_crs(source_crs)
+    dest_crs = get_crs(dest_crs)
+    context = transform_context(context)
+
+    # Contexts compare by value but can't be hashed, so each CRS pair keeps a short list
+    entries = _transform_cache.setdefault((crs_key(source_crs), crs_key(dest_crs)), [])
+    for cached_context, transform in entries:
+        if cached_context == context:
+            return transform
+
+    transform = QgsCoordinateTransform(source_crs, dest_crs, context)
+    entries.append((context, transform))
+    return transform
+
+
+def clear_cache():
+    _crs_cache.clear()
+    _transform_cache.clear()
+    _osr_cache.clear()
+
+
+def _osr_transform(source_crs, dest_crs):
+    key = (crs_key(source_crs), crs_key(dest_crs))
+    if key not in _osr_cache:
+        srs = []
+        for crs in (source_crs, dest_crs):
+            ref = osr.SpatialReference()
+            ref.SetFromUserInput(crs.authid() or crs.toWkt())
+            # x/y order regardless of what the authority says, like QGIS
+            ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            srs.append(ref)
+        _osr_cache[key] = osr.CoordinateTransformation(*srs)
+    return _osr_cache[key]
+
+
+def transform_points(xs, ys, source_crs, dest_crs, context=None):
+    # Transforms many points in one call. GDAL does the work unless the project
+    # picked specific datum operations, which only QGIS knows how to apply.
+    source_crs = get_crs(source_crs)
+    dest_crs = get_crs(dest_crs)
+    xs = np.asarray(xs, dtype=np.float64).ravel()
+    ys = np.asarray(ys, dtype=np.float64).ravel()
+
+    if source_crs == dest_crs or len(xs) == 0:
+        return xs.copy(), ys.copy()
+
+    context = transform_context(context)
+    if not context.coordinateOperations():
+        try:
+            out = np.array(_osr_transform(source_crs, dest_crs).TransformPoints(np.column_stack((xs, ys))))
+            return out[:, 0], out[:, 1]
+        except Exception as err:
+            print(f"Batched GDAL transform failed, using QGIS per point: {err}")
+
+    transform = get_transform(source_crs, dest_crs, context)
+    out_x = np.empty_like(xs)
+    out_y = np.empty_like(ys)
+    for index in range(len(xs)):
+        try:
+            point = transform.transform(QgsPointXY(xs[index], ys[index]))
+            out_x[index], out_y[index] = point.x(), point.y()
+        except Exception:
+            out_x[index] = out_y[index] = np.nan
+    return out_x, out_y
+
+
+def transform_bounds(bounds, source_crs, dest_crs, context=None):
+    # bounds is an (N, 4) array of xmin, ymin, xmax, ymax. Every edge is densified
+    # so curved edges in the destination CRS are still fully covered.
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    if get_crs(source_crs) == get_crs(dest_crs) or len(bounds) == 0:
+        return bounds.copy()
+
+    t = np.linspace(0.0, 1.0, EDGE_POINTS)
+    xmin, ymin, xmax, ymax = (bounds[:, i:i + 1] for i in range(4))
+    width = xmax - xmin
+    height = ymax - ymin
+
+    xs = np.hstack((xmin + width * t, np.repeat(xmax, EDGE_POINTS, axis=1), xmax - width * t, np.repeat(xmin, EDGE_POINTS, axis=1)))
+    ys = np.hstack((np.repeat(ymin, EDGE_POINTS, axis=1), ymin + height * t, np.repeat(ymax, EDGE_POINTS, axis=1), ymax - height * t))
+
+    out_x, out_y = transform_points(xs, ys, source_crs, dest_crs, context)
+    out_x = out_x.reshape(xs.shape)
+    out_y = out_y.reshape(ys.shape)
+
+    # Points that failed to transform are ignored, like transformBoundingBox does
+    invalid = ~(np.isfinite(out_x) & np.isfinite(out_y))
+    out_x = np.where(invalid, np.nan, out_x)
+    out_y = np.where(invalid, np.nan, out_y)
+    with np.errstate(all="ignore"):
+        return np.column_stack((
+            np.nanmin(out_x, axis=1), np.nanmin(out_y, axis=1),
+            np.nanmax(out_x, axis=1), np.nanmax(out_y, axis=1)
+        ))
+
+
+def rectangles_to_bounds(rectangles):
+    return np.array([[r.xMinimum(), r.yMinimum(), r.xMaximum(), r.yMaximum()] for r in rectangles], dtype=np.float64)
+
+
+def bounds_to_rectangles(bounds):
+    return [QgsRectangle(*row) for row in bounds.tolist()]
@@ -0,0 +1,205 @@
+import math
+from collections import namedtuple
+import numpy as np
+from qgis.core import QgsCoordinateReferenceSystem, QgsFeatureRequest, QgsRectangle
+
+# Memory provider fids start at 1, so tiles keep the same names as a materialised grid
+FIRST_FID = 1
+
+# Grid layers keep each cell's full-grid id in this field. Tiles are named from it, so a
+# filtered layer (whose memory provider fids run 1..k) names tiles like the virtual grid.
+CELL_ID_FIELD = "id"
+
+GridCell = namedtuple("GridCell", ["fid", "id", "col", "row", "rect"])
+
+
+class VirtualGrid:
+    # A regular grid described only by origin, spacing and size; cells are computed on demand.
+    # Cell ids follow the materialised layer: id = col * rows + row, fid = id + FIRST_FID.
+    # cell_fids optionally gives the fid of every cell by id, 0 for cells left out of the grid
+    # (outside the AOI or without DEM data).
+
+    def __init__(self, xmin, ymin, h_spacing, v_spacing, cols, rows, crs, cell_fids=None):
+        self.xmin = xmin
+        self.ymin = ymin
+        self.h_spacing = h_spacing
+        self.v_spacing = v_spacing
+        self.cols = cols
+        self.rows = rows
+        self._crs = crs if isinstance(crs, QgsCoordinateReferenceSystem) else QgsCoordinateReferenceSystem(crs)
+
+        self.cell_fids = None
+        if cell_fids is not None:
+            self.cell_fids = np.asarray(cell_fids, dtype=np.int64)
+            self._kept_ids = np.flatnonzero(self.cell_fids)
+            kept_fids = self.cell_fids[self._kept_ids]
+            self._fid_order = np.argsort(kept_fids, kind="stable")
+            self._sorted_fids = kept_fids[self._fid_order]
+
+    @classmethod
+    def masked(cls, xmin, ymin, h_spacing, v_spacing, cols, rows, crs, keep):
+        # Cells keep the fids they have in the full grid, so tile names don't depend on the filter
+        fids = np.where(keep, np.arange(cols * rows, dtype=np.int64) + FIRST_FID, 0)
+        return cls(xmin, ymin, h_spacing, v_spacing, cols, rows, crs, fids)
+
+    def __len__(self):
+        return self.cols * self.rows
+
+    def crs(self):
+        return self._crs
+
+    def featureCount(self):
+        return len(self) if self.cell_fids is None else len(self._kept_ids)
+
+    def extent(self):
+        return QgsRectangle(
+            self.xmin, self.ymin,
+            self.xmin + self.cols * self.h_spacing,
+            self.ymin + self.rows * self.v_spacing
+        )
+
+    def fids(self):
+        if self.cell_fids is None:
+            return range(FIRST_FID, FIRST_FID + len(self))
+        return self._sorted_fids.tolist()
+
+    def cell_at(self, col, row):
+        # Cells left out of a filtered grid have fid 0
+        x1 = self.xmin + col * self.h_spacing
+        y1 = self.ymin + row * self.v_spacing
+        cell_id = col * self.rows + row
+        fid = cell_id + FIRST_FID if self.cell_fids is None else int(self.cell_fids[cell_id])
+        return GridCell(fid, cell_id, col, row,
+                        QgsRectangle(x1, y1, x1 + self.h_spacing, y1 + self.v_spacing))
+
+    def cell(self, fid):
+        if self.cell_fids is None:
+            cell_id = fid - FIRST_FID
+            if cell_id < 0 or cell_id >= len(self):
+                raise KeyError(f"Cell {fid} is outside the grid")
+        else:
+            index = int(np.searchsorted(self._sorted_fids, fid))
+            if index >= len(self._sorted_fids) or self._sorted_fids[index] != fid:
+                raise KeyError(f"Cell {fid} is not in the grid")
+            cell_id = int(self._kept_ids[self._fid_order[index]])
+        col, row = divmod(cell_id, self.rows)
+        return self.cell_at(col, row)
+
+    def cells(self, fid_range=None):
+        if self.cell_fids is not None:
+            first, last = fid_range if fid_range else (-math.inf, math.inf)
+            start = int(np.searchsorted(self._sorted_fids, first, side="left"))
+            end = int(np.searchsorted(self._sorted_fids, last, side="right"))
+            for fid in self._sorted_fids[start:end].tolist():
+                yield self.cell(fid)
+            return
+
+        first, last = fid_range if fid_range else (FIRST_FID, FIRST_FID + len(self) - 1)
+        first = max(first, FIRST_FID)
+        last = min(last, FIRST_FID + len(self) - 1)
+        for fid in range(first, last + 1):
+            yield self.cell(fid)
+
+    def cells_in_rect(self, rect):
+        # Only the column/row span that touches rect is visited
+        col_start = max(0, math.ceil((rect.xMinimum() - self.xmin) / self.h_spacing) - 1)
+        col_end = min(self.cols - 1, math.floor((rect.xMaximum() - self.xmin) / self.h_spacing))
+        row_start = max(0, math.ceil((rect.yMinimum() - self.ymin) / self.v_spacing) - 1)
+        row_end = min(self.rows - 1, math.floor((rect.yMaximum() - self.ymin) / self.v_spacing))
+
+        for col in range(col_start, col_end + 1):
+            for row in range(row_start, row_end + 1):
+                cell = self.cell_at(col, row)
+                if cell.fid and cell.rect.intersects(rect):
+                    yield cell
+
+
+def cell_id_index(layer):
+    # Field index of the cell id, -1 for layers not made by grid generation
+    return layer.fields().indexOf(CELL_ID_FIELD)
+
+
+def feature_fid(feature, id_index):
+    # Tile fid of a grid layer feature: full-grid cell id + FIRST_FID, the feature id otherwise
+    if id_index < 0:
+        return feature.id()
+    return int(feature.attribute(id_index)) + FIRST_FID
+
+
+def cell_id_request(layer):
+    # Only the cell id attribute, with geometry
+    request = QgsFeatureRequest()
+    index = cell_id_index(layer)
+    if index < 0:
+        request.setNoAttributes()
+    else:
+        request.setSubsetOfAttributes([index])
+    return request, index
+
+
+def fid_range_expression(fid_range, coverage=None):
+    # Inclusive range of tile fids, used to restrict an export to one shard
+    if coverage is not None and not isinstance(coverage, VirtualGrid) and cell_id_index(coverage) >= 0:
+        first, last = int(fid_range[0]) - FIRST_FID, int(fid_range[1]) - FIRST_FID
+        return f'"{CELL_ID_FIELD}" >= {first} AND "{CELL_ID_FIELD}" <= {last}'
+    return f"$id >= {int(fid_range[0])} AND $id <= {int(fid_range[1])}"
+
+
+def coverage_cells(coverage, fid_range=None):
+    # (fid, bounding box) for every cell of a virtual grid or coverage layer
+    if isinstance(coverage, VirtualGrid):
+        for cell in coverage.cells(fid_range):
+            yield cell.fid, cell.rect
+        return
+
+    request, index = cell_id_request(coverage)
+    if fid_range:
+        request.setFilterExpression(fid_range_expression(fid_range, coverage))
+    for feature in coverage.getFeatures(request):
+        yield feature_fid(feature, index), feature.geometry().boundingBox()
+
+
+def regular_grid(coverage):
+    # A layer made by grid generation, described as a VirtualGrid with the same fids
+    if isinstance(coverage, VirtualGrid):
+        return coverage
+
+    first = first_cell_extent(coverage)
+    if first is None or first.isNull():
+        raise ValueError("Coverage layer has no usable first cell.")
+
+    extent = coverage.extent()
+    cols = int(round(extent.width() / first.width()))
+    rows = int(round(extent.height() / first.height()))
+    if cols * rows == coverage.featureCount():
+        return VirtualGrid(extent.xMinimum(), extent.yMinimum(), first.width(), first.height(), cols, rows, coverage.crs())
+
+    # A filtered grid: place every feature in the grid spanned by the layer extent
+    cell_fids = np.zeros(cols * rows, dtype=np.int64)
+    request, index = cell_id_request(coverage)
+    for feature in coverage.getFeatures(request):
+        box = feature.geometry().boundingBox()
+        col = (box.xMinimum() - extent.xMinimum()) / first.width()
+        row = (box.yMinimum() - extent.yMinimum()) / first.height()
+        if (abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6
+                or not math.isclose(box.width(), first.width(), rel_tol=1e-6)
+                or not math.isclose(box.height(), first.height(), rel_tol=1e-6)):
+            raise ValueError("Coverage layer is not a regular grid.")
+        cell_fids[int(round(col)) * rows + int(round(row))] = feature_fid(feature, index)
+
+    return VirtualGrid(extent.xMinimum(), extent.yMinimum(), first.width(), first.height(), cols, rows,
+                       coverage.crs(), cell_fids)
+
+
+def first_cell_extent(coverage):
+    if isinstance(coverage, VirtualGrid):
+        fids = coverage.fids()
+        return coverage.cell(fids[0]).rect if len(fids) else None
+
+    feature = next(coverage.getFeatures(QgsFeatureRequest().setLimit(1)), None)
+    if feature is None:
+        return None
+    geometry = feature.geometry()
+    if not geometry or geometry.isNull():
+        return QgsRectangle()
+    return geometry.boundingBox()
@@ -0,0 +1,95 @@
+import math
+from qgis.core import QgsDistanceArea, QgsPointXY, QgsRasterLayer
+from .basemap_cache import xyz_layers, ZOOM0_RESOLUTION
+from .tile_renderer import page_size_pixels, visible_layers, MM_PER_INCH
+from .transforms import get_crs, transform_points
+from .virtual_grid import regular_grid
+
+# DPI every visual export used before the resolution could be chosen
+DEFAULT_DPI = 300
+
+
+def ground_distance(crs, x1, y1, x2, y2, project):
+    # Metres on the WGS84 ellipsoid between two points in crs
+    measure = QgsDistanceArea()
+    measure.setSourceCrs(get_crs(crs), project.transformContext())
+    measure.setEllipsoid("WGS84")
+    return measure.measureLine(QgsPointXY(x1, y1), QgsPointXY(x2, y2))
+
+
+def cell_ground_size(grid, project):
+    # Width and height of the middle cell in metres
+    cx = grid.xmin + (grid.cols // 2 + 0.5) * grid.h_spacing
+    cy = grid.ymin + (grid.rows // 2 + 0.5) * grid.v_spacing
+    width = ground_distance(grid.crs(), cx - grid.h_spacing / 2, cy, cx + grid.h_spacing / 2, cy, project)
+    height = ground_distance(grid.crs(), cx, cy - grid.v_spacing / 2, cx, cy + grid.v_spacing / 2, project)
+    return width, height
+
+
+def grid_latitude(grid):
+    extent = grid.extent()
+    center = extent.center()
+    lon, lat = transform_points([center.x()], [center.y()], grid.crs(), "EPSG:4326")
+    return float(lat[0])
+
+
+def native_resolution(layers, grid, project):
+    # Finest ground resolution (m/px) of the raster layers in the render, at the grid's latitude.
+    # XYZ basemaps use their deepest zoom level, local rasters their pixel size.
+    found = []
+    xyz = xyz_layers(layers)
+    if xyz:
+        latitude = grid_latitude(grid)
+        for layer, uri in xyz:
+            zmax = int(uri.param("zmax") or 19)
+            found.append(ZOOM0_RESOLUTION / 2 ** zmax * math.cos(math.radians(latitude)))
+
+    xyz_ids = set(layer.id() for layer, uri in xyz)
+    for layer in layers:
+        if not isinstance(layer, QgsRasterLayer) or layer.id() in xyz_ids or layer.providerType() != "gdal":
+            continue
+        center = layer.extent().center()
+        pixel = layer.rasterUnitsPerPixelX()
+        found.append(ground_distance(layer.crs(), center.x() - pixel / 2, center.y(),
+                                     center.x() + pixel / 2, center.y(), project))
+    return min(found) if found else None
+
+
+def visual_sizing(project, coverage, page_width_mm, page_height_mm, resolution, layers=None):
+    # DPI that draws the grid at resolution metres per pixel, or at the basemap's native
+    # resolution for "basemap". The page size keeps the tile extents and aspect ratio;
+    # only the pixel count per tile changes.
+    grid = regular_grid(coverage)
+    if resolution == "basemap":
+        layers = layers if layers is not None else visible_layers(project)
+        resolution = native_resolution(layers, grid, project)
+        if resolution is None:
+            raise Exception("No raster basemap to match, set visual_resolution in metres per pixel instead.")
+
+    # The renderer fits the cell into the page, so the tighter side sets the DPI
+    width_m, height_m = cell_ground_size(grid, project)
+    dpi = max(width_m / resolution / (page_width_mm / MM_PER_INCH),
+              height_m / resolution / (page_height_mm / MM_PER_INCH))
+    dpi = max(1.0, round(dpi, 2))
+
+    width_px, height_px = page_size_pixels(page_width_mm, page_height_mm, dpi)
+    default_width, default_height = page_size_pixels(page_width_mm, page_height_mm, DEFAULT_DPI)
+    return {
+        "dpi": dpi,
+        "resolution_m": round(resolution, 4),
+        "width_px": width_px,
+        "height_px": height_px,
+        "pixels_saved_per_tile": default_width * default_height - width_px * height_px,
+    }
+
+
+def add_pixel_savings(summary, page_width_mm, page_height_mm, dpi):
+    # Pixels not rendered compared with the fixed 300 DPI export, over the tiles rendered this run.
+    # Negative when the chosen resolution needs more than 300 DPI.
+    if dpi == DEFAULT_DPI:
+        return summary
+    width, height = page_size_pixels(page_width_mm, page_height_mm, dpi)
+    default_width, default_height = page_size_pixels(page_width_mm, page_height_mm, DEFAULT_DPI)
+    summary["dpi"] = dpi
+    summary["pixels_saved"] = summary.get("rendered", 0) * (default_width * default_height - width * height)
+    return summary